@@ -0,0 +1,310 @@
+"""
+Sparse storage and physics for very large SafeLife boards.
+
+Open-world maps are mostly empty, so rather than storing the whole board as
+one dense array, a :class:`ChunkedBoard` splits it into square tiles and
+only keeps the tiles that contain something. Physics steps only look at
+tiles that could possibly change, so both memory and time scale with the
+occupied (and active) part of the board rather than with its full size.
+
+Regions of the board can be pulled out as ordinary dense arrays with
+:meth:`ChunkedBoard.window` (or :func:`helper_utils.recenter_view`) and then
+observed or rendered just like any other board.
+
+A chunked board is a standalone container. It covers board storage, physics,
+agent actions, windowed views and serialization, but it isn't a backend for
+:class:`safelife_game.GameState`. Goals, points and exits, side effect
+scores, and :class:`safelife_env.SafeLifeEnv` all still require dense boards,
+so a chunked board can't be played as a level. Windows (or :meth:`to_array`,
+for boards that fit in memory) can be passed to any of those instead.
+"""
+
+import numpy as np
+
+from .safelife_game import CellTypes
+from .speedups import advance_board_batch, execute_actions
+
+
+def _segments(start, length, size, tile_size):
+    """
+    Split a wrapped range of board coordinates into per-tile pieces.
+
+    Yields ``(tile_index, tile_offset, out_offset, n)`` for each piece.
+    """
+    pos = start % size
+    done = 0
+    while done < length:
+        tile_idx, tile_offset = divmod(pos, tile_size)
+        n = min(tile_size - tile_offset, length - done, size - pos)
+        yield tile_idx, tile_offset, done, n
+        done += n
+        pos = (pos + n) % size
+
+
+class ChunkedBoard(object):
+    """
+    A large, mostly empty board stored as a set of square tiles.
+
+    Tiles that are entirely empty aren't stored. The board wraps around its
+    edges just like a dense board.
+
+    Physics is applied by gathering every tile that might change, along with
+    a one cell border from its neighbors, and advancing them all in a single
+    call to :func:`speedups.advance_board_batch`. As with the 'tiled' engine,
+    a tile only needs to be recomputed if it or one of its neighbors changed
+    on the previous step or contains spawners. Boards without spawners
+    evolve exactly as the equivalent dense board would. With spawners, random
+    numbers are drawn in a different order than for a dense board, so the
+    results only agree statistically.
+
+    There's no notion of goals, agents or scoring here. Callers that move
+    agents around with :meth:`execute_actions` need to keep track of their
+    locations themselves.
+
+    Parameters
+    ----------
+    shape : tuple of ints
+        Height and width of the board. Both must be multiples of the tile
+        size.
+    tile_size : int
+
+    Attributes
+    ----------
+    tiles : dict
+        Maps ``(tile_row, tile_col)`` to a ``(tile_size, tile_size)`` uint16
+        array. Only non-empty tiles are present. Tiles should be changed
+        through the board's methods rather than modified in place so that
+        the board knows to recompute them.
+    """
+    def __init__(self, shape, tile_size=64):
+        height, width = shape
+        if tile_size < 1 or height % tile_size or width % tile_size:
+            raise ValueError("Board shape must be a multiple of the tile size.")
+        if height < 5 or width < 5:
+            raise ValueError("Board must be at least 5x5.")
+        self.shape = (height, width)
+        self.tile_size = tile_size
+        self.tiles = {}
+        self._changed = set()  # tiles changed by the last step or edits
+        self._spawners = set()  # tiles that contain spawners
+
+    @classmethod
+    def from_array(cls, board, tile_size=64):
+        """Create a chunked board from a dense one."""
+        board = np.asarray(board, dtype=np.uint16)
+        obj = cls(board.shape, tile_size)
+        n = tile_size
+        for i, j in zip(*np.nonzero(obj._tile_occupancy(board))):
+            obj._store_tile(
+                (int(i), int(j)), board[i*n:(i+1)*n, j*n:(j+1)*n].copy())
+        return obj
+
+    def _tile_occupancy(self, board):
+        nr, nc = self.tile_shape
+        n = self.tile_size
+        return board.reshape(nr, n, nc, n).any(axis=(1, 3))
+
+    def to_array(self):
+        """Dense copy of the whole board."""
+        board = np.zeros(self.shape, dtype=np.uint16)
+        n = self.tile_size
+        for (i, j), tile in self.tiles.items():
+            board[i*n:(i+1)*n, j*n:(j+1)*n] = tile
+        return board
+
+    def serialize(self):
+        """Return a dict of data to be serialized (e.g., with np.savez)."""
+        keys = sorted(self.tiles)
+        n = self.tile_size
+        return {
+            "shape": np.array(self.shape),
+            "tile_size": n,
+            "tile_index": np.array(keys, dtype=np.int64).reshape(-1, 2),
+            "tiles": np.array(
+                [self.tiles[key] for key in keys], dtype=np.uint16
+            ).reshape(-1, n, n),
+        }
+
+    @classmethod
+    def loaddata(cls, data):
+        """Load a chunked board from a dictionary or npz archive."""
+        obj = cls(tuple(data['shape']), int(data['tile_size']))
+        for (i, j), tile in zip(data['tile_index'], data['tiles']):
+            obj._store_tile((int(i), int(j)), np.array(tile, dtype=np.uint16))
+        return obj
+
+    @property
+    def tile_shape(self):
+        """Number of tile rows and columns."""
+        return (self.shape[0] // self.tile_size, self.shape[1] // self.tile_size)
+
+    @property
+    def nbytes(self):
+        """Memory used by the stored tiles."""
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def _store_tile(self, key, tile):
+        # Record a new or changed tile, dropping it if it's empty.
+        self._changed.add(key)
+        if tile.any():
+            self.tiles[key] = tile
+        else:
+            self.tiles.pop(key, None)
+        if (tile & CellTypes.spawning).any():
+            self._spawners.add(key)
+        else:
+            self._spawners.discard(key)
+
+    def window(self, row, col, height, width):
+        """
+        Dense copy of a region of the board, wrapping around the edges.
+
+        Parameters
+        ----------
+        row, col : int
+            Coordinates of the region's top left corner.
+        height, width : int
+        """
+        out = np.zeros((height, width), dtype=np.uint16)
+        n = self.tile_size
+        nrow, ncol = self.shape
+        for i, r0, y0, dy in _segments(row, height, nrow, n):
+            for j, c0, x0, dx in _segments(col, width, ncol, n):
+                tile = self.tiles.get((i, j))
+                if tile is not None:
+                    out[y0:y0+dy, x0:x0+dx] = tile[r0:r0+dy, c0:c0+dx]
+        return out
+
+    def set_window(self, row, col, values):
+        """
+        Overwrite a region of the board. The inverse of :meth:`window`.
+        """
+        values = np.asarray(values, dtype=np.uint16)
+        height, width = values.shape
+        n = self.tile_size
+        nrow, ncol = self.shape
+        for i, r0, y0, dy in _segments(row, height, nrow, n):
+            for j, c0, x0, dx in _segments(col, width, ncol, n):
+                block = values[y0:y0+dy, x0:x0+dx]
+                tile = self.tiles.get((i, j))
+                if tile is None:
+                    if not block.any():
+                        continue
+                    tile = np.zeros((n, n), dtype=np.uint16)
+                elif np.array_equal(tile[r0:r0+dy, c0:c0+dx], block):
+                    continue
+                tile[r0:r0+dy, c0:c0+dx] = block
+                self._store_tile((i, j), tile)
+
+    def _point_index(self, idx):
+        rows, cols = np.broadcast_arrays(
+            np.asarray(idx[0]) % self.shape[0],
+            np.asarray(idx[1]) % self.shape[1])
+        n = self.tile_size
+        return rows // n, cols // n, rows % n, cols % n
+
+    def __getitem__(self, idx):
+        """
+        Look up individual cells with a ``(rows, cols)`` tuple of integers or
+        integer arrays. Use :meth:`window` to get rectangular regions.
+        """
+        ti, tj, r, c = self._point_index(idx)
+        out = np.zeros(ti.shape, dtype=np.uint16)
+        for key in set(zip(ti.flat, tj.flat)):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                mask = (ti == key[0]) & (tj == key[1])
+                out[mask] = tile[r[mask], c[mask]]
+        return out[()]
+
+    def __setitem__(self, idx, values):
+        ti, tj, r, c = self._point_index(idx)
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint16), ti.shape)
+        n = self.tile_size
+        for key in set(zip(ti.flat, tj.flat)):
+            mask = (ti == key[0]) & (tj == key[1])
+            tile = self.tiles.get(key)
+            tile = np.zeros((n, n), dtype=np.uint16) if tile is None else tile
+            tile[r[mask], c[mask]] = values[mask]
+            self._store_tile(key, tile)
+
+    def execute_actions(self, locations, actions):
+        """
+        Perform an action for each agent. See :func:`speedups.execute_actions`.
+
+        Parameters
+        ----------
+        locations : ndarray of shape (n_agents, 2)
+            Row and column of each agent. Modified in place as agents move.
+        actions : int or ndarray
+        """
+        actions = np.broadcast_to(actions, (len(locations),))
+        local_loc = np.empty((1, 2), dtype=np.int64)
+        for k, action in enumerate(actions):
+            if action == 0:
+                continue
+            # An action can only change cells within two steps of the agent.
+            y0, x0 = locations[k] - 2
+            area = self.window(y0, x0, 5, 5)
+            local_loc[:] = 2
+            execute_actions(area, local_loc, action)
+            self.set_window(y0, x0, area)
+            locations[k] = (local_loc[0] + (y0, x0)) % self.shape
+
+    def _active_tiles(self):
+        # Tiles that could change on the next step: any tile next to (or
+        # equal to) one that just changed or that contains spawners.
+        nr, nc = self.tile_shape
+        active = set()
+        for i, j in self._changed | self._spawners:
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    active.add(((i + di) % nr, (j + dj) % nc))
+        return sorted(active)
+
+    def _gather_tile(self, key, out):
+        # Copy a tile plus a one cell border from its neighbors into `out`.
+        i, j = key
+        nr, nc = self.tile_shape
+        n = self.tile_size
+        parts = ((-1, slice(0, 1), slice(n-1, n)),
+                 (0, slice(1, n+1), slice(0, n)),
+                 (1, slice(n+1, n+2), slice(0, 1)))
+        out[...] = 0
+        for di, out_rows, tile_rows in parts:
+            for dj, out_cols, tile_cols in parts:
+                tile = self.tiles.get(((i + di) % nr, (j + dj) % nc))
+                if tile is not None:
+                    out[out_rows, out_cols] = tile[tile_rows, tile_cols]
+
+    def advance(self, spawn_prob=0.3, n_steps=1, rng=None):
+        """
+        Apply physics to the board in place.
+
+        Parameters
+        ----------
+        spawn_prob : float
+        n_steps : int
+        rng : numpy.random.Generator, optional
+            See :func:`speedups.advance_board`.
+        """
+        n = self.tile_size
+        for _ in range(n_steps):
+            keys = self._active_tiles()
+            padded = np.empty((len(keys), n+2, n+2), dtype=np.uint16)
+            for k, key in enumerate(keys):
+                self._gather_tile(key, padded[k])
+            occupied = padded.any(axis=(1, 2))
+            keys = [key for key, keep in zip(keys, occupied) if keep]
+            self._changed = set()
+            if not keys:
+                continue
+            new_tiles = advance_board_batch(
+                padded[occupied], spawn_prob, rng=rng)[:, 1:-1, 1:-1]
+            for key, tile in zip(keys, new_tiles):
+                old_tile = self.tiles.get(key)
+                if old_tile is None:
+                    if tile.any():
+                        self._store_tile(key, tile.copy())
+                elif not np.array_equal(old_tile, tile):
+                    self._store_tile(key, tile.copy())
@@ -4,7 +4,7 @@ import numpy as np
 
 from gym import Wrapper
 from .safelife_game import CellTypes
-from .helper_utils import load_kwargs
+from .helper_utils import load_kwargs, AsyncStepMixin
 from .speedups import advance_board
 
 logger = logging.getLogger(__name__)
@@ -14,7 +14,7 @@ def call(x):
     return x() if callable(x) else x
 
 
-class BaseWrapper(Wrapper):
+class BaseWrapper(AsyncStepMixin, Wrapper):
     """
     Minor convenience class to make it easier to set attributes during init.
     """
@@ -98,7 +98,7 @@ class MovementBonusWrapper(BaseWrapper):
         return obs
 
 
-class ContinuingEnv(Wrapper):
+class ContinuingEnv(AsyncStepMixin, Wrapper):
     """
     Change to a continuing (rather than episodic) environment.
 
@@ -1,4 +1,7 @@
+import asyncio
 import inspect
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import scipy.signal
 
@@ -45,7 +48,7 @@ def recenter_view(board, view_size, center, move_to_perimeter=None):
 
     Parameters
     ----------
-    board : ndarray
+    board : ndarray or ChunkedBoard
         Two-dimensional array to be centered.
     view_size : tuple
     center : tuple
@@ -59,8 +62,12 @@ def recenter_view(board, view_size, center, move_to_perimeter=None):
     y0, x0 = center
     x1 = x0 - w // 2
     y1 = y0 - h // 2
-    board2 = board.view(wrapping_array)[y1:y1+h, x1:x1+w]
-    board2 = board2.view(np.ndarray)
+    if isinstance(board, np.ndarray):
+        board2 = board.view(wrapping_array)[y1:y1+h, x1:x1+w]
+        board2 = board2.view(np.ndarray)
+    else:
+        # Sparse boards (see chunked_board.py) can copy out just the view.
+        board2 = board.window(y1, x1, h, w)
     if move_to_perimeter is not None:
         iy, ix = move_to_perimeter
         # Calculate indices relative to the center point.
@@ -85,3 +92,52 @@ def load_kwargs(self, kwargs):
             setattr(self, key, val)
         else:
             raise ValueError("Unrecognized parameter: '%s'" % (key,))
+
+
+_step_executor = None
+
+
+class AsyncStepMixin(object):
+    """
+    Adds asynchronous versions of an environment's ``step()`` method.
+
+    ``step_async(actions)`` starts a step and returns immediately, and
+    ``step_wait()`` returns its results. In between, the caller is free to do
+    other work (e.g., run a policy on another batch of observations) while
+    the step runs in the background. ``astep(actions)`` does the same for
+    use with asyncio.
+
+    By default the step runs on a background thread. All environments share
+    a single thread so that their steps never run concurrently; most of the
+    work is done in native code that releases the GIL, so the step does run
+    in parallel with the caller. Subclasses can instead override
+    ``step_async()`` and ``step_wait()`` if they have a better way to run
+    steps in the background.
+    """
+    _step_future = None
+
+    def step_async(self, actions):
+        global _step_executor
+        if self._step_future is not None:
+            raise RuntimeError("Must call step_wait() before stepping again.")
+        if _step_executor is None:
+            _step_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='safelife-step')
+        self._step_future = _step_executor.submit(self.step, actions)
+
+    def step_wait(self):
+        future, self._step_future = self._step_future, None
+        if future is None:
+            raise RuntimeError("Must call step_async() before step_wait().")
+        return future.result()
+
+    async def astep(self, actions):
+        """Take one step without blocking the event loop."""
+        self.step_async(actions)
+        future, self._step_future = self._step_future, None
+        if future is None:
+            # Subclasses with their own step_async() need step_wait() to be
+            # called, which blocks, so it has to run on another thread.
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.step_wait)
+        return await asyncio.wrap_future(future)
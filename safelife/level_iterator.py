@@ -4,12 +4,13 @@ import queue
 import warnings
 import signal
 import multiprocessing
+from collections import OrderedDict
 from multiprocessing.pool import Pool, ApplyResult
 
 import yaml
 import numpy as np
 
-from .safelife_game import SafeLifeGame
+from .safelife_game import SafeLifeGame, GoalTrajectory, CellTypes
 from .proc_gen import gen_game
 from .random import set_rng
 
@@ -18,6 +19,7 @@ LEVEL_DIRECTORY = os.path.join(os.path.dirname(__file__), 'levels')
 LEVEL_DIRECTORY = os.path.abspath(LEVEL_DIRECTORY)
 _default_params = yaml.safe_load(
     open(os.path.join(LEVEL_DIRECTORY, 'random', '_defaults.yaml')))
+_archives = {}  # memory-mapped level archives, see _open_archive()
 
 
 def find_files(*paths, file_types=(), use_glob=True):
@@ -77,14 +79,36 @@ def _find_files(path, file_types, use_glob, use_level_dir=False):
     raise FileNotFoundError("No files found for '%s'" % orig_path)
 
 
+def _open_archive(file_name):
+    """
+    Memory-map an uncompressed level archive (see :func:`combine_levels`).
+
+    Each archive is only opened once per process. Since the data is never
+    copied, all processes that open the same archive share the same pages
+    of the operating system's file cache.
+    """
+    levels = _archives.get(file_name)
+    if levels is None:
+        levels = _archives[file_name] = np.load(file_name, mmap_mode='r')
+    return levels
+
+
 def _load_files(paths):
     if not paths:
         return [[None, 'procgen', {}]]
     all_data = []
-    for file_name in find_files(*paths, file_types=('json', 'npz', 'yaml')):
+    file_types = ('json', 'npz', 'npy', 'yaml')
+    for file_name in find_files(*paths, file_types=file_types):
         if file_name.endswith('.json') or file_name.endswith('.yaml'):
             with open(file_name) as file_data:
                 all_data.append([file_name, 'procgen', yaml.safe_load(file_data)])
+        elif file_name.endswith('.npy'):
+            # Uncompressed archive. Only keep a reference to each level so
+            # that the level data doesn't get copied into (or pickled for)
+            # every worker process.
+            for idx, name in enumerate(_open_archive(file_name)['name']):
+                fname = os.path.join(file_name[:-4], name)
+                all_data.append([fname, 'archive', (file_name, idx)])
         else:  # npz
             with np.load(file_name) as data:
                 if 'levels' in data:
@@ -107,6 +131,9 @@ def _game_from_data(file_name, data_type, data, seed=None):
             for key in ('named_regions', 'agent_types'):
                 data[key] = {**_default_params[key], **data[key]}
             game = gen_game(**data)
+    elif data_type == "archive":
+        archive_name, idx = data
+        game = SafeLifeGame.loaddata(_open_archive(archive_name)[idx])
     else:
         game = SafeLifeGame.loaddata(data)
     game.file_name = file_name
@@ -130,9 +157,10 @@ class SafeLifeLevelIterator(object):
     ----------
     paths : list of strings
         The paths to the files to load. Files should either ".npz" archives
-        of saved SafeLife levels, or ".yaml" files of procedural generation
-        parameters. Examples of each can be found in the "safelife/levels"
-        folder.
+        of saved SafeLife levels, ".npy" uncompressed archives of many levels
+        (see :func:`combine_levels`), or ".yaml" files of procedural
+        generation parameters. Examples of each can be found in the
+        "safelife/levels" folder.
 
         Note that the path names can use glob expressions or can point to a
         directory of files to load. Files will first be searched for in the
@@ -160,13 +188,22 @@ class SafeLifeLevelIterator(object):
     seed : int or numpy.random.SeedSequence or None
         Seed for the random number generator(s). The same seed ought to produce
         the same set of sequence of SafeLife levels across different trials.
+    goal_cache_size : int
+        Number of goal trajectories to keep. Levels that have the same goals
+        (e.g., levels loaded from the same file, or repeated levels) share a
+        single :class:`GoalTrajectory` so that the goals only need to be
+        advanced once. Set to zero to disable.
     """
     def __init__(
             self, *paths, repeat_levels=None, distinct_levels=None,
-            num_workers=multiprocessing.cpu_count(), max_queue=10, seed=None
+            num_workers=multiprocessing.cpu_count(), max_queue=10, seed=None,
+            goal_cache_size=16
     ):
         self.file_data = _load_files(paths)
         self.level_cache = []
+        self._level_games = {}  # reverted copies of cached levels
+        self.goal_cache_size = goal_cache_size
+        self._goal_cache = OrderedDict()
 
         if repeat_levels is None:
             for data in self.file_data:
@@ -228,9 +265,11 @@ class SafeLifeLevelIterator(object):
             # Don't pickle the multiprocessing pool, and wait on all queued results.
             state['pool'] = None
             state['results'] = queue.deque([
-                r.get() if isinstance(r, ApplyResult) else r
-                for r in self.results
+                (data, r.get() if isinstance(r, ApplyResult) else r)
+                for data, r in self.results or ()
             ], maxlen=self.max_queue)
+        state['_goal_cache'] = OrderedDict()
+        state['_level_games'] = {}
 
         return state
 
@@ -249,8 +288,7 @@ class SafeLifeLevelIterator(object):
             else:
                 # Repeat levels that we've already seen.
                 # Should only get here if we've maxed out distinct levels.
-                data = self.level_cache[self.idx % self.distinct_levels]
-                result = _game_from_data(*data)
+                result = self._repeat_level(self.idx % self.distinct_levels)
                 self.idx += 1
         elif not self.results:
             raise StopIteration
@@ -263,8 +301,43 @@ class SafeLifeLevelIterator(object):
             if data[1] == "procgen":
                 data = (data[0], "static", result.serialize(), result.seed)
             self.level_cache.append(data)
+        self._share_goal_trajectory(result)
         return result
 
+    def _repeat_level(self, idx):
+        """
+        Copy of the idx'th cached level.
+
+        The level is only loaded once. Copies share all of its derived state,
+        including its snapshot for :meth:`GameState.revert`, so they can be
+        reset without being deserialized again.
+        """
+        game = self._level_games.get(idx)
+        if game is None:
+            game = _game_from_data(*self.level_cache[idx])
+            self._share_goal_trajectory(game)
+            game.revert()
+            self._level_games[idx] = game
+        return game.clone()
+
+    def _share_goal_trajectory(self, game):
+        """
+        Give the game the same goal trajectory as earlier games with its goals.
+        """
+        if self.goal_cache_size <= 0 or not isinstance(game, SafeLifeGame):
+            return
+        goals = game.goals
+        if (goals & CellTypes.spawning).any():
+            return
+        key = (goals.shape, goals.tobytes())
+        trajectory = self._goal_cache.pop(key, None)
+        if trajectory is None:
+            trajectory = GoalTrajectory(goals)
+        self._goal_cache[key] = trajectory
+        while len(self._goal_cache) > self.goal_cache_size:
+            self._goal_cache.popitem(last=False)
+        game.set_goal_trajectory(trajectory)
+
 
 def safelife_loader(*paths, **kwargs):
     """
@@ -306,9 +379,14 @@ def gen_many(param_file, out_dir, num_gen, num_workers=8, max_queue=100):
         next(game_gen).save(fname)
 
 
-def combine_levels(directory):
+def combine_levels(directory, uncompressed=False):
     """
     Merge all files in a single directory.
+
+    If `uncompressed` is True, the levels are saved as a single ".npy" file
+    with aligned fields instead of as a compressed ".npz" archive. Such files
+    are memory-mapped rather than loaded, so even very large sets of levels
+    open instantly and are shared between all of the worker processes.
     """
     files = sorted(glob.glob(os.path.join(directory, '*.npz')))
     all_data = []
@@ -317,28 +395,50 @@ def combine_levels(directory):
         with np.load(file) as data:
             name = os.path.split(file)[1]
             max_name_len = max(max_name_len, len(name))
-            all_data.append(list(data.items()) + [('name', name)])
+            # Expanded archives (see expand_levels) already have names.
+            items = [(k, v) for k, v in data.items() if k != 'name']
+            all_data.append(items + [('name', name)])
     dtype = []
     for key, val in all_data[0][:-1]:
         dtype.append((key, val.dtype, val.shape))
     dtype.append(('name', str, max_name_len))
     combo_data = np.array([
         tuple([val for key, val in data]) for data in all_data
-    ], dtype=dtype)
-    np.savez_compressed(directory + '.npz', levels=combo_data)
+    ], dtype=np.dtype(dtype, align=uncompressed))
+    if uncompressed:
+        np.save(directory + '.npy', combo_data)
+    else:
+        np.savez_compressed(directory + '.npz', levels=combo_data)
+
+
+def uncompress_levels(filename):
+    """
+    Convert a compressed archive of levels into a memory-mappable one.
+
+    The archive should have been created with :func:`combine_levels`. The
+    new file has the same name but a ".npy" extension.
+    """
+    with np.load(filename) as data:
+        levels = data['levels']
+    levels = levels.astype(np.dtype(levels.dtype.descr, align=True))
+    np.save(filename[:-4] + '.npy', levels)
 
 
 def expand_levels(filename):
     """
     Opposite of combine_levels. Handy if we want to edit a single level.
     """
-    with np.load(filename) as data:
-        directory = filename[:-4]  # assume .npz
-        os.makedirs(directory, exist_ok=True)
-        for level in data['levels']:
-            level_data = {k: level[k] for k in level.dtype.fields}
-            np.savez_compressed(
-                os.path.join(directory, level['name']), **level_data)
+    if filename.endswith('.npy'):
+        levels = np.load(filename, mmap_mode='r')
+    else:
+        with np.load(filename) as data:
+            levels = data['levels']
+    directory = filename[:-4]  # assume .npz or .npy
+    os.makedirs(directory, exist_ok=True)
+    for level in levels:
+        level_data = {k: level[k] for k in level.dtype.fields}
+        np.savez_compressed(
+            os.path.join(directory, level['name']), **level_data)
 
 
 def gen_benchmarks():
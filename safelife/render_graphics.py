@@ -9,6 +9,7 @@ import numpy as np
 from . import speedups
 from .safelife_game import CellTypes, GameState
 from .helper_utils import recenter_view
+from .replay import EpisodeReplay
 
 
 sprite_path = os.path.join(os.path.dirname(__file__), "sprites.png")
@@ -143,7 +144,8 @@ def render_file(fname, fps=30, data=None, movie_format="gif"):
     Load a saved SafeLifeGame file and render it as a png or gif.
 
     The game will be rendered as animated if it contains a
-    sequence of states; otherwise it will be rendered as a png.
+    sequence of states or is an episode replay (see
+    :class:`replay.EpisodeReplay`); otherwise it will be rendered as a png.
 
     Parameters
     ----------
@@ -161,6 +163,9 @@ def render_file(fname, fps=30, data=None, movie_format="gif"):
             render_file(os.path.join(bare_fname, level['name']), fps, level)
         return
 
+    if hasattr(data, 'keys') and 'replay_version' in data:
+        data = EpisodeReplay.loaddata(data).history()
+
     rgb_array = render_board(
         data['board'], data['goals'], data.get('orientation'))
     if rgb_array.ndim == 3:
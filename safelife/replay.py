@@ -0,0 +1,178 @@
+"""
+Compact recordings of SafeLife episodes.
+
+Rather than storing the board and goals at every step, an
+:class:`EpisodeReplay` stores the initial state of the level, the state of
+the game's random number generator, and the actions taken at each step.
+Since the game physics are deterministic given the random generator, every
+frame of the episode can be rebuilt exactly by replaying the actions. A
+recording of a few hundred steps takes up a few hundred bytes plus the size
+of the initial level, rather than megabytes of board states.
+
+Replays are only exact for games that have their own random generator
+(e.g., games with a seed, which includes every game produced by
+:class:`level_iterator.SafeLifeLevelIterator`). Games that use the global
+generator share it with everything else, so their stochastic levels can't
+be reproduced.
+"""
+
+import json
+
+import numpy as np
+
+from .safelife_game import GameState
+
+
+def _get_rng_state(game):
+    if game._rng is None:
+        return None
+    return game._rng.bit_generator.state
+
+
+def _make_rng(state):
+    bit_generator = getattr(np.random, state['bit_generator'])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+
+class EpisodeReplay(object):
+    """
+    Initial state and per-step actions of a single episode.
+
+    Parameters
+    ----------
+    game : GameState
+        The game at the start of the episode.
+    keyframe_interval : int
+        If positive, the full game state is also saved every this many steps
+        so that frames late in long episodes can be rebuilt without replaying
+        the whole episode.
+
+    Attributes
+    ----------
+    initial_state : dict
+        The game at the start of the episode, as given by
+        :meth:`GameState.serialize`.
+    rng_state : dict or None
+        State of the game's random bit generator at the start of the episode.
+    actions : list
+        Actions passed to :meth:`GameState.step` on each step.
+    keyframes : dict
+        Maps step numbers to ``(state, rng_state)`` pairs.
+    """
+    keyframe_interval = 0
+
+    def __init__(self, game=None, keyframe_interval=0):
+        self.keyframe_interval = keyframe_interval
+        self.actions = []
+        self.keyframes = {}
+        if game is not None:
+            self.initial_state = game.serialize()
+            self.rng_state = _get_rng_state(game)
+
+    def __len__(self):
+        """Number of recorded steps."""
+        return len(self.actions)
+
+    def record(self, actions, game):
+        """
+        Record one step of the episode.
+
+        Should be called after each call to ``game.step(actions)``.
+        """
+        self.actions.append(np.array(actions, dtype=np.int8))
+        n = len(self.actions)
+        if self.keyframe_interval > 0 and n % self.keyframe_interval == 0:
+            self.keyframes[n] = (game.serialize(), _get_rng_state(game))
+
+    def frame(self, step):
+        """
+        Rebuild the game as it was after the given number of steps.
+
+        Returns
+        -------
+        GameState
+            A new game that can continue to be played from that point.
+        """
+        if step < 0 or step > len(self.actions):
+            raise IndexError("Replay step out of range.")
+        # Build from the initial state even when starting from a keyframe,
+        # since scoring depends on the initial counts.
+        game = GameState.loaddata(self.initial_state)
+        rng_state = self.rng_state
+        start = max([k for k in self.keyframes if k <= step], default=0)
+        if start > 0:
+            state, rng_state = self.keyframes[start]
+            game.deserialize(state, as_initial_state=False)
+            game.num_steps = start
+        if rng_state is not None:
+            game._rng = _make_rng(rng_state)
+        for actions in self.actions[start:step]:
+            game.step(actions)
+        return game
+
+    def frames(self):
+        """Iterate over every frame of the episode, starting with the first."""
+        game = self.frame(0)
+        yield game.clone()
+        for actions in self.actions:
+            game.step(actions)
+            yield game.clone()
+
+    def history(self):
+        """
+        Boards and goals at every step, as used by :func:`render_file`.
+        """
+        boards = []
+        goals = []
+        for game in self.frames():
+            boards.append(game.board)
+            goals.append(game.goals)
+        return {'board': np.array(boards), 'goals': np.array(goals)}
+
+    def serialize(self):
+        """Return a dict of data to be serialized."""
+        data = {
+            'replay_version': 1,
+            'actions': np.array(self.actions, dtype=np.int8),
+            'rng_state': json.dumps(self.rng_state),
+            'keyframe_steps': np.array(sorted(self.keyframes), dtype=np.int64),
+        }
+        for key, val in self.initial_state.items():
+            data['initial.' + key] = val
+        for step, (state, rng_state) in self.keyframes.items():
+            prefix = 'keyframe%i.' % step
+            data[prefix + 'rng_state'] = json.dumps(rng_state)
+            for key, val in state.items():
+                data[prefix + key] = val
+        return data
+
+    @classmethod
+    def loaddata(cls, data):
+        """Load a replay from a dictionary or npz archive."""
+        def state_with_prefix(prefix):
+            return {
+                key[len(prefix):]: data[key] for key in data.keys()
+                if key.startswith(prefix)
+            }
+        obj = cls()
+        obj.initial_state = state_with_prefix('initial.')
+        obj.rng_state = json.loads(str(data['rng_state']))
+        obj.actions = list(data['actions'])
+        for step in data['keyframe_steps']:
+            prefix = 'keyframe%i.' % step
+            state = state_with_prefix(prefix)
+            rng_state = json.loads(str(state.pop('rng_state')))
+            obj.keyframes[int(step)] = (state, rng_state)
+        if obj.keyframes:
+            obj.keyframe_interval = min(obj.keyframes)
+        return obj
+
+    def save(self, file_name):
+        """Save the replay as a compressed npz archive."""
+        np.savez_compressed(file_name, **self.serialize())
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as data:
+            return cls.loaddata(data)
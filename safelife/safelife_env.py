@@ -4,13 +4,13 @@ import gym
 from gym import spaces
 import numpy as np
 
-from .helper_utils import recenter_view, load_kwargs
+from .helper_utils import load_kwargs, AsyncStepMixin
 from .level_iterator import SafeLifeLevelIterator
-from .safelife_game import CellTypes
-from .side_effects import side_effect_score
+from .side_effects import side_effect_score, total_side_effect
+from .speedups import build_observations
 
 
-class SafeLifeEnv(gym.Env):
+class SafeLifeEnv(AsyncStepMixin, gym.Env):
     """
     A gym-like environment that wraps SafeLifeGame.
 
@@ -25,6 +25,9 @@ class SafeLifeEnv(gym.Env):
       These don't have any effect on the scoring or gameplay; they exist only
       as a visual reference.
 
+    Steps can also be run in the background with ``step_async()`` and
+    ``step_wait()`` or ``astep()``. See :class:`helper_utils.AsyncStepMixin`.
+
     Parameters
     ----------
     level_iterator : iterator or str
@@ -55,6 +58,20 @@ class SafeLifeEnv(gym.Env):
     should_calculate_side_effects : bool
         Side effect calculations can be expensive. Set this to False to
         disable them.
+    obs_buffers : int
+        If positive, observations are written into this many persistent
+        buffers, used in turn, rather than into a new array on every step.
+        The returned observations are then read-only views that get
+        overwritten `obs_buffers` steps later, so callers should copy them
+        (e.g., into a rollout buffer) if they need to keep them around.
+        With two buffers the previous observation stays valid while the
+        next one is built.
+    side_effect_pool : side_effects.SideEffectPool or None
+        If set, side effects are calculated in the background rather than
+        at the end of each episode. The final episode info then contains an
+        'episode_id' instead of 'side_effects', and the side effects show up
+        in the info of a later step as ``info['side_effects'][episode_id]``
+        once they're ready. See also :meth:`collect_side_effects`.
     """
 
     game = None
@@ -71,6 +88,8 @@ class SafeLifeEnv(gym.Env):
     output_channels = tuple(range(16)) + (25,26,27)
     side_effect_weights = None
     should_calculate_side_effects = True
+    obs_buffers = 0
+    side_effect_pool = None
 
     def __init__(self, level_iterator, **kwargs):
         if isinstance(level_iterator, str):
@@ -93,6 +112,9 @@ class SafeLifeEnv(gym.Env):
                 shape=self.view_shape + (len(self.output_channels),),
                 dtype=np.uint8,
             )
+        self._pending_side_effects = {}
+        self._obs_buffers = [None] * self.obs_buffers
+        self._obs_index = 0
 
     @property
     def state(self):
@@ -102,6 +124,17 @@ class SafeLifeEnv(gym.Env):
             DeprecationWarning, stacklevel=2)
         return self.game
 
+    def _next_obs_buffer(self, num_agents):
+        if not self._obs_buffers:
+            return None
+        k = self._obs_index
+        self._obs_index = (k + 1) % len(self._obs_buffers)
+        shape = (num_agents,) + self.observation_space.shape
+        if self._obs_buffers[k] is None or self._obs_buffers[k].shape != shape:
+            self._obs_buffers[k] = np.empty(
+                shape, dtype=self.observation_space.dtype)
+        return self._obs_buffers[k]
+
     def get_obs(self, board=None, goals=None, agent_locs=None):
         if board is None:
             board = self.game.board
@@ -116,48 +149,37 @@ class SafeLifeEnv(gym.Env):
                 # Make default view centered at origin if there are no agents.
                 agent_locs = np.array([[0,0]])
 
-        board = board.astype(np.uint32)
-        goals = goals & CellTypes.rainbow_color
-
-        # Get rid of white cells in the goals.
-        # They effectively act as just a background pattern, and they can
-        # be confusing for an agent.
-        if self.remove_white_goals:
-            goals *= (goals != CellTypes.rainbow_color)
-
-        # Combine board and goals into one array
-        board += (goals.astype(np.uint32) << 16)
-
-        # And center the array on the agent.
-        board = np.stack([
-            recenter_view(board, self.view_shape, x0, self.game.exit_locs)
-            for x0 in agent_locs
-        ])
-
-        # If the environment specifies output channels, output a boolean array
-        # with the channels as the third dimension. Otherwise output a bit
-        # array.
-        if self.output_channels:
-            shift = np.array(list(self.output_channels), dtype=np.uint32)
-            board = (board[...,None] & (1 << shift)) >> shift
-            board = board.astype(np.uint8)
+        # Combine the board and goals into one array, centered on each agent.
+        # Exits that are out of sight get moved to the perimeter of the view.
+        # White goals effectively act as just a background pattern, and they
+        # can be confusing for an agent, so they are optionally removed.
+        # If the environment specifies output channels, output a boolean
+        # array with the channels as the third dimension. Otherwise output a
+        # bit array.
+        out = self._next_obs_buffer(len(agent_locs))
+        board = build_observations(
+            board, goals, agent_locs, self.view_shape,
+            exit_locs=self.game.exit_locs,
+            output_channels=self.output_channels or None,
+            remove_white_goals=self.remove_white_goals, out=out)
         if self.single_agent:
             board = board[0]
+        elif out is not None:
+            board = board.view()
+        if out is not None:
+            # Don't let callers write into the persistent buffer.
+            board.flags.writeable = False
         return board
 
     def step(self, actions):
         assert self.game is not None, "Game state is not initialized."
 
-        self.game.execute_actions(actions)
-        self.game.advance_board()
-        self.game.update_exit_colors()
+        new_game_value, success, active = self.game.step(actions)
 
         times_up = self.game.num_steps >= self.time_limit
-        new_game_value = self.game.current_points()
         reward = (new_game_value - self._old_game_value) * self._is_active
         self._old_game_value = new_game_value
-        success = self.game.has_exited()
-        done = ~self.game.agent_is_active() | times_up
+        done = ~active | times_up
 
         if self.single_agent:
             if len(reward) == 0:
@@ -181,24 +203,59 @@ class SafeLifeEnv(gym.Env):
         }
 
         if (np.all(done) and self.side_effects is None
+                and self.episode_id is None
                 and self.should_calculate_side_effects):
-            self.side_effects = side_effect_score(self.game, strkeys=True)
-            if self.side_effect_weights is not None:
-                total = np.zeros(2)
-                for key, weight in self.side_effect_weights.items():
-                    effect = self.side_effects.get(key, 0)
-                    total += weight * np.array(effect)
-                self.side_effects['total'] = total.tolist()
+            if self.side_effect_pool is not None:
+                self.episode_id, future = self.side_effect_pool.submit(
+                    self.game, self.side_effect_weights)
+                self._pending_side_effects[self.episode_id] = future
+            else:
+                self.side_effects = side_effect_score(self.game, strkeys=True)
+                if self.side_effect_weights is not None:
+                    self.side_effects['total'] = total_side_effect(
+                        self.side_effects, self.side_effect_weights)
         if self.side_effects is not None:
             episode_info['side_effects'] = self.side_effects
+        if self.episode_id is not None:
+            episode_info['episode_id'] = self.episode_id
 
-        return self.get_obs(), reward, done, {
+        info = {
             'board': self.game.board,
             'goals': self.game.goals,
             'agent_locs': self.game.agent_locs,
             'times_up': times_up,
             'episode': episode_info,
         }
+        if self._pending_side_effects:
+            side_effects = self.collect_side_effects()
+            if side_effects:
+                info['side_effects'] = side_effects
+
+        return self.get_obs(), reward, done, info
+
+    def collect_side_effects(self, wait=False):
+        """
+        Gather side effects that have been calculated in the background.
+
+        Each result is only returned once, either here or in the info dict
+        of a call to :meth:`step`.
+
+        Parameters
+        ----------
+        wait : bool
+            If True, wait for all outstanding calculations to finish.
+
+        Returns
+        -------
+        dict
+            Maps episode ids to side effects.
+        """
+        side_effects = {}
+        for episode_id, future in list(self._pending_side_effects.items()):
+            if wait or future.done():
+                side_effects[episode_id] = future.result()
+                del self._pending_side_effects[episode_id]
+        return side_effects
 
     def reset(self):
         self.game = next(self.level_iterator)
@@ -215,6 +272,7 @@ class SafeLifeEnv(gym.Env):
             self.episode_length = np.zeros(num_agents, dtype=int)
             self.episode_reward = np.zeros(num_agents, dtype=np.float32)
         self.side_effects = None
+        self.episode_id = None
         return self.get_obs()
 
     def render(self, mode='ansi'):
@@ -11,18 +11,20 @@ three things:
 3. executing agent actions and edits.
 """
 
+import copy
 import os
+import threading
 from importlib import import_module
 from functools import wraps
 
 import numpy as np
 
-from .helper_utils import (
-    wrapping_array,
-    wrapped_convolution as convolve2d,
-)
-from .random import coinflip, get_rng, set_rng
-from .speedups import advance_board, alive_counts, execute_actions
+from .helper_utils import load_kwargs
+from .random import get_rng, set_rng
+from .speedups import (
+    advance_board, advance_board_batch, advance_async_game,
+    advance_game_of_life, alive_counts, board_hash, execute_actions,
+    execute_actions_batch, step_game, update_board_hash, Workspace)
 
 
 ORIENTATION = {
@@ -157,6 +159,21 @@ class GameState(object):
     num_steps = 0
     _seed = None
     _rng = None
+    # Zobrist hash of the board, shape (1,), once one has been asked for.
+    # See state_hash.
+    _board_hash = None
+    # Copy of the game as it was right after loading _init_data. See revert.
+    _initial_snapshot = None
+
+    # Arrays that can be modified in place while the game is played.
+    # These are copied by clone(); all other attributes are shared.
+    _mutable_arrays = ('board', 'agent_locs', '_board_hash')
+    # Per-instance scratch data that shouldn't be shared with clones.
+    _private_attributes = ()
+    # Level state and derived data that's set by deserialize and restored by
+    # revert. Everything else (configuration, editor state) is left alone.
+    _level_attributes = _mutable_arrays + (
+        'agent_names', 'spawn_prob', 'exit_locs', 'game_over', 'num_steps')
 
     def __init__(self, board_size=(10,10)):
         self.exit_locs = (np.array([], dtype=int), np.array([], dtype=int))
@@ -214,13 +231,15 @@ class GameState(object):
         if as_initial_state:
             self._init_data = data
         self.board = data['board'].copy()
+        self._board_hash = None
         if 'spawn_prob' in keys:
             self.spawn_prob = float(data['spawn_prob'])
         if 'agent_loc' in keys:
             # Old single agent setting
-            self.agent_locs = np.array(data['agent_loc'])[None,::-1]
+            self.agent_locs = np.ascontiguousarray(
+                np.array(data['agent_loc'])[None,::-1])
         elif 'agent_locs' in keys:
-            self.agent_locs = np.array(data['agent_locs'])
+            self.agent_locs = np.array(data['agent_locs'], order='C')
         if 'agent_names' in keys:
             self.agent_names = np.array(data['agent_names'])
         else:
@@ -249,11 +268,111 @@ class GameState(object):
         np.savez_compressed(file_name, **self._init_data)
 
     def revert(self):
-        """Revert to the last saved state."""
-        if hasattr(self, '_init_data'):
+        """
+        Revert to the last saved state.
+
+        The first revert deserializes the saved state and keeps a snapshot of
+        the result, which is shared with any clones. Later reverts just copy
+        the level state back from the snapshot rather than recomputing the
+        exit locations, initial counts, points tables, and so on. Other
+        attributes, such as the physics engine or the editor cursor, and the
+        random number generator are not reverted.
+        """
+        if not hasattr(self, '_init_data'):
+            return False
+        token = self._initial_snapshot
+        if token is not None and token._init_data is self._init_data:
+            old_attrs = {}
+            for name in self._level_attributes:
+                if name in self.__dict__:
+                    old_attrs[name] = self.__dict__.pop(name)
+                if name in token.__dict__:
+                    self.__dict__[name] = token.__dict__[name]
+            token._copy_mutable_arrays(self, old_attrs)
+        else:
             self.deserialize(self._init_data)
-            return True
-        return False
+            token = self.clone()
+            token._rng = None
+            token._initial_snapshot = None
+        self._initial_snapshot = token
+        return True
+
+    def clone(self, into=None):
+        """
+        Create a copy of the game that can be played independently.
+
+        Unlike :meth:`serialize` and :meth:`deserialize`, this doesn't
+        recompute any derived state. Only the mutable arrays and the state of
+        the random number generator are copied; everything else (points
+        tables, initial counts, level data) is shared with the original and
+        should be replaced rather than modified in place.
+
+        Parameters
+        ----------
+        into : GameState, optional
+            A game of the same class whose state gets overwritten. Its arrays
+            are reused if they have the right shapes, so repeatedly cloning
+            into the same object doesn't allocate any new memory.
+        """
+        if into is None:
+            into = copy.copy(self)
+            old_attrs = {}
+        elif type(into) is not type(self):
+            raise TypeError("Can only clone into a game of the same class.")
+        else:
+            old_attrs = into.__dict__.copy()
+            into.__dict__.clear()
+            into.__dict__.update(self.__dict__)
+        for name in self._private_attributes:
+            if name in old_attrs:
+                setattr(into, name, old_attrs[name])
+            else:
+                into.__dict__.pop(name, None)
+        self._copy_mutable_arrays(into, old_attrs)
+        old_rng = old_attrs.get('_rng')
+        if self._rng is None:
+            return into
+        if (old_rng is not None and old_rng is not self._rng and
+                type(old_rng.bit_generator) is type(self._rng.bit_generator)):
+            old_rng.bit_generator.state = self._rng.bit_generator.state
+            into._rng = old_rng
+        else:
+            into._rng = copy.deepcopy(self._rng)
+        return into
+
+    def _copy_mutable_arrays(self, into, old_attrs):
+        # Give `into` its own copies of our mutable arrays, reusing the arrays
+        # in `old_attrs` where possible.
+        for name in self._mutable_arrays:
+            src = getattr(self, name)
+            dst = old_attrs.get(name)
+            if src is None:
+                continue
+            elif not src.flags.writeable:
+                # Read-only arrays (e.g., shared goal states) can be shared.
+                dst = src
+            elif (dst is not None and dst is not src and dst.shape == src.shape
+                    and dst.dtype == src.dtype and dst.flags.writeable):
+                np.copyto(dst, src)
+            else:
+                dst = src.copy()
+            setattr(into, name, dst)
+            into._mark_edited(name)
+
+    def snapshot(self, token=None):
+        """
+        Save the current state so that it can later be passed to `restore`.
+
+        Parameters
+        ----------
+        token : object, optional
+            An old snapshot that is no longer needed. Its memory is reused.
+        """
+        return self.clone(into=token)
+
+    def restore(self, token):
+        """Return to a state saved by :meth:`snapshot`."""
+        token.clone(into=self)
 
     @classmethod
     def loaddata(cls, data, auto_cls=True):
@@ -328,8 +447,11 @@ class GameState(object):
     @orientation.setter
     def orientation(self, value):
         value = (np.array(value, dtype=np.uint16) & 3) << CellTypes.orientation_bit
+        self._rehash_cells(self.agent_locs_idx)
         self.board[self.agent_locs_idx] &= ~CellTypes.orientation_mask
         self.board[self.agent_locs_idx] |= value
+        self._rehash_cells(self.agent_locs_idx)
+        self._mark_edited('board', self.agent_locs_idx)
 
     @property
     def agent_locs_idx(self):
@@ -386,7 +508,9 @@ class GameState(object):
         actions : int or ndarray
             Actions for each agent. Should be in range [0-8].
         """
-        execute_actions(self.board, self.agent_locs, actions)
+        execute_actions(
+            self.board, self.agent_locs, actions, hash=self._board_hash,
+            workspace=self._tracking_workspace('board'))
 
     def execute_edit(self, command, board=None):
         """
@@ -428,6 +552,11 @@ class GameState(object):
         if board is None:
             board = self.board
         edit_loc = self.edit_loc
+        edits_cell = board is self.board and (
+            command.startswith(("PUT ", "TOGGLE ")) or
+            command == "APPLY EDIT COLOR")
+        if edits_cell:
+            self._rehash_cells(edit_loc)
         if command.startswith("MOVE "):
             direction = ORIENTATION[command[5:]]
             if direction % 2 == 0:
@@ -457,6 +586,9 @@ class GameState(object):
                 return "No saved state; cannot revert."
         elif command in ("ABORT LEVEL", "PREV LEVEL", "NEXT LEVEL"):
             self.game_over = command
+        if edits_cell:
+            self._rehash_cells(edit_loc)
+            self._mark_edited('board', edit_loc)
         self.update_exit_locs()
         self.update_exit_colors()
         self.update_agent_locs()
@@ -465,6 +597,7 @@ class GameState(object):
         """Utility function. Translate the entire board (edges wrap)."""
         self.board = np.roll(self.board, dy, axis=0)
         self.board = np.roll(self.board, dx, axis=1)
+        self._board_hash = None
         self.agent_locs += [dy, dx]
         self.agent_locs %= self.board.shape
         self.update_exit_locs()
@@ -479,6 +612,7 @@ class GameState(object):
         width += min(0, dx)
         new_board[:height, :width] = self.board[:height, :width]
         self.board = new_board
+        self._board_hash = None
         out_of_bounds = np.any(self.agent_locs >= new_board.shape, axis=1)
         self.agent_locs = self.agent_locs[~out_of_bounds]
         self.edit_loc = tuple(np.array(self.edit_loc) % new_board.shape)
@@ -502,6 +636,29 @@ class GameState(object):
     def is_stochastic(self):
         raise NotImplementedError
 
+    def step(self, actions):
+        """
+        Execute the agents' actions and then advance the board one step.
+
+        Parameters
+        ----------
+        actions : int or ndarray
+            Actions for each agent. See :meth:`execute_actions`.
+
+        Returns
+        -------
+        points : ndarray
+            Current points for each agent. See :meth:`current_points`.
+        exited : ndarray of bool
+            See :meth:`has_exited`.
+        active : ndarray of bool
+            See :meth:`agent_is_active`.
+        """
+        self.execute_actions(actions)
+        self.advance_board()
+        self.update_exit_colors()
+        return self.current_points(), self.has_exited(), self.agent_is_active()
+
     def has_exited(self):
         """
         Boolean value for each agent.
@@ -536,6 +693,12 @@ class GameState(object):
 
     def update_exit_colors(self):
         can_exit = self.can_exit()
+        # An agent can stand on an exit, so rehash both sets of cells at once
+        # to make sure that each cell is only counted once.
+        changed = tuple(
+            np.concatenate(idx) for idx in zip(self.agent_locs_idx, self.exit_locs))
+
+        self._rehash_cells(changed)
 
         # Set the exit bit on top of each agent that is allowed to exit
         self.board[self.agent_locs_idx] &= ~CellTypes.exit
@@ -551,6 +714,72 @@ class GameState(object):
             exit_type = CellTypes.level_exit
         self.board[self.exit_locs] = exit_type
 
+        self._rehash_cells(changed)
+        self._mark_edited('board', changed)
+
+    @property
+    def state_hash(self):
+        """
+        64-bit Zobrist hash of the board and agent locations (and goals).
+
+        Identical states always have the same hash, and different states
+        almost certainly don't, so this can be used to quickly deduplicate
+        or look up states. The board hash is computed in full the first time
+        it's needed, and after that it's updated incrementally as cells
+        change. See :func:`speedups.board_hash`.
+        """
+        if self._board_hash is None:
+            self._board_hash = np.array([board_hash(self.board)], dtype=np.uint64)
+        # Offset the locations so that an agent at (0,0) isn't ignored.
+        locs_hash = board_hash(self.agent_locs + 1, salt=2)
+        return int(self._board_hash[0]) ^ locs_hash
+
+    def _rehash_cells(self, idx):
+        """
+        Xor the keys of the indexed cells into the board hash, if there is one.
+
+        This should be called both before and after the cells are modified.
+        """
+        if self._board_hash is not None:
+            cells = np.unique(np.ravel_multi_index(idx, self.board.shape))
+            self._board_hash ^= np.uint64(board_hash(self.board, cells=cells))
+
+    def _tracking_workspace(self, name):
+        """
+        Workspace used by the tiled engine to advance the board or goals.
+
+        None if they aren't advanced incrementally.
+        """
+        return None
+
+    def _mark_edited(self, name, idx=None):
+        """
+        Let the tiled engine know that the board or goals were edited.
+
+        This should be called after cells are modified by anything other than
+        the physics functions. If `idx` is None, the whole array may have
+        changed. See :meth:`speedups.Workspace.mark_changed`.
+        """
+        workspace = self._tracking_workspace(name)
+        if workspace is None:
+            pass
+        elif idx is None:
+            workspace.reset()
+        else:
+            array = getattr(self, name)
+            workspace.mark_changed(array, np.ravel_multi_index(idx, array.shape))
+
+    def _replace_board(self, board):
+        """Replace the board with a new one, updating the hash."""
+        if self._board_hash is None:
+            pass
+        elif board.shape == self.board.shape:
+            self._board_hash[0] = update_board_hash(
+                self.board, board, int(self._board_hash[0]))
+        else:
+            self._board_hash = None
+        self.board = board
+
     def update_agent_locs(self):
         new_locs = np.stack(
             np.nonzero(self.board & CellTypes.agent),
@@ -589,7 +818,13 @@ class GameWithGoals(GameState):
     """
     goals = None
     _static_goals = None  # can be set to True for minor performance boost
+    _goals_hash = None
     min_performance = -1
+    _mutable_arrays = GameState._mutable_arrays + ('goals',)
+    _level_attributes = GameState._level_attributes + (
+        'goals', '_goals_hash', 'min_performance', 'points_table',
+        '_needs_new_counts', '_alive_counts', 'initial_counts',
+        'initial_colors', '_static_goals')
 
     # TODO: make a different point table for each color agent
     default_points_table = np.array([
@@ -624,6 +859,7 @@ class GameWithGoals(GameState):
 
         keys = data.dtype.fields if hasattr(data, 'dtype') else data
         self.goals = data['goals']
+        self._goals_hash = None
         if 'min_performance' in keys:
             self.min_performance = data['min_performance']
         if 'points_table' in keys:
@@ -638,8 +874,12 @@ class GameWithGoals(GameState):
 
     def execute_edit(self, command):
         if command.startswith("GOALS "):
+            if not self.goals.flags.writeable:
+                self.goals = self.goals.copy()
             rval = super().execute_edit(command[6:], self.goals)
+            self._mark_edited('goals', self.edit_loc)
             self._static_goals = None
+            self._goals_hash = None
         else:
             rval = super().execute_edit(command)
         self._needs_new_counts = True
@@ -654,14 +894,55 @@ class GameWithGoals(GameState):
         self._needs_new_counts = True
         return super().execute_action(action)
 
+    def execute_actions(self, actions):
+        counts = self._known_counts()
+        if counts is None:
+            self._needs_new_counts = True
+            return super().execute_actions(actions)
+        # Only the cells next to the agents can change, so just update
+        # the counts for those instead of recounting the whole board.
+        execute_actions(
+            self.board, self.agent_locs, actions,
+            goals=self.goals, counts=counts, hash=self._board_hash,
+            workspace=self._tracking_workspace('board'))
+        self._set_counts(counts)
+
     @property
     def alive_counts(self):
         if getattr(self, '_needs_new_counts', True):
-            self._needs_new_counts = False
-            self._alive_counts = alive_counts(self.board, self.goals)
-            self._alive_counts.setflags(write=False)
+            self._set_counts(alive_counts(self.board, self.goals))
         return self._alive_counts
 
+    @property
+    def state_hash(self):
+        if self._goals_hash is None:
+            self._goals_hash = board_hash(self.goals, salt=1)
+        return super().state_hash ^ self._goals_hash
+
+    def _replace_goals(self, goals):
+        """Replace the goals with new ones, updating the hash."""
+        if self._goals_hash is None or goals is self.goals:
+            pass
+        elif goals.shape == self.goals.shape:
+            self._goals_hash = update_board_hash(
+                self.goals, goals, self._goals_hash, salt=1)
+        else:
+            self._goals_hash = None
+        self.goals = goals
+
+    def _known_counts(self):
+        """
+        Writeable copy of the alive counts, or None if they're out of date.
+        """
+        if getattr(self, '_needs_new_counts', True):
+            return None
+        return self._alive_counts.copy()
+
+    def _set_counts(self, counts):
+        counts.setflags(write=False)
+        self._alive_counts = counts
+        self._needs_new_counts = False
+
     def setup_initial_counts(self):
         """
         Record the counts of live cells and possible colors for new cells.
@@ -723,6 +1004,7 @@ class GameWithGoals(GameState):
         super().shift_board(dx, dy)
         self.goals = np.roll(self.goals, dy, axis=0)
         self.goals = np.roll(self.goals, dx, axis=1)
+        self._goals_hash = None
 
     def resize_board(self, dx, dy):
         """Utility function. Expand or shrink the board."""
@@ -733,6 +1015,83 @@ class GameWithGoals(GameState):
         width += min(0, dx)
         new_goals[:height, :width] = self.goals[:height, :width]
         self.goals = new_goals
+        self._goals_hash = None
+
+
+class GoalTrajectory(object):
+    """
+    Lazily computed sequence of goal states for goals without spawners.
+
+    Such goals evolve deterministically, so their sequence of states only
+    needs to be computed once and can then be shared by every game that
+    plays the same level. States are computed as they're requested. Once a
+    state repeats, the rest of the sequence is just a cycle and nothing more
+    needs to be computed. New states are computed under a lock, so games in
+    different threads can share a trajectory.
+
+    Attributes
+    ----------
+    states : list of ndarray
+        Read-only goal states computed so far, starting with the initial
+        goals.
+    cycle_start : int or None
+        Index of the first state in the cycle, once it has been found.
+    max_states : int
+        Stop computing new states after this many. Games then go back to
+        advancing their goals themselves.
+    """
+    max_states = 1000
+
+    def __init__(self, goals):
+        goals = np.array(goals, dtype=np.uint16)
+        if (goals & CellTypes.spawning).any():
+            raise ValueError("Goals with spawners aren't deterministic.")
+        goals.setflags(write=False)
+        self.states = [goals]
+        self.cycle_start = None
+        self._state_index = {goals.tobytes(): 0}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def is_static(self):
+        return self.cycle_start == 0 and len(self.states) == 1
+
+    def __getitem__(self, step):
+        """Goals after the given number of steps, or None if not computed."""
+        states = self.states
+        if step >= len(states) and self.cycle_start is None:
+            with self._lock:
+                self._extend(step)
+        if step < len(states):
+            return states[step]
+        if self.cycle_start is None:
+            return None
+        period = len(states) - self.cycle_start
+        return states[self.cycle_start + (step - self.cycle_start) % period]
+
+    def _extend(self, step):
+        # Compute states up to the given step. Must hold the lock.
+        states = self.states
+        while step >= len(states) and self.cycle_start is None:
+            if len(states) >= self.max_states:
+                return
+            new_goals = advance_board(states[-1], 0.0)
+            key = new_goals.tobytes()
+            if key in self._state_index:
+                self.cycle_start = self._state_index[key]
+            else:
+                new_goals.setflags(write=False)
+                self._state_index[key] = len(states)
+                states.append(new_goals)
 
 
 class SafeLifeGame(GameWithGoals):
@@ -741,24 +1100,193 @@ class SafeLifeGame(GameWithGoals):
 
     Along with parent classes, this defines all of SafeLife's basic physics
     and the actions that the player can take.
+
+    Attributes
+    ----------
+    reuse_buffers : bool
+        If True, the board and goals are advanced into a pair of preallocated
+        buffers which are swapped back and forth rather than into newly
+        allocated arrays. This avoids a lot of memory churn in long training
+        runs, but it means that the board and goal arrays get overwritten two
+        steps later. They should be copied if they need to be kept around.
+    physics_engine : str
+        Engine used to advance the board and goals. See
+        :func:`speedups.advance_board`. All engines give identical results,
+        but 'tiled' is much faster on large boards that are mostly still.
+        With `reuse_buffers` set, its cost per step only depends on how much
+        of the board is active. Edits to the board or goals made outside of
+        this class need to be reported with :meth:`_mark_edited`.
+    goal_trajectory : GoalTrajectory or None
+        Precomputed goal states. If the goals don't have any spawners, this
+        is created on the first step unless one has already been shared with
+        :meth:`set_goal_trajectory`. It's dropped if the goals are changed
+        by anything other than the physics.
     """
+    reuse_buffers = False
+    physics_engine = 'dense'
+    goal_trajectory = None
+    _goal_step = 0
+    _workspaces = None
+    _buffers = None
+    _private_attributes = ('_workspaces', '_buffers')
+    _level_attributes = GameWithGoals._level_attributes + (
+        'goal_trajectory', '_goal_step')
+
+    def _workspace(self, name):
+        if self._workspaces is None:
+            # Separate workspaces so that the tiled engine can track
+            # activity in the board and goals independently.
+            self._workspaces = {'board': Workspace(), 'goals': Workspace()}
+            self._buffers = {'board': [], 'goals': []}
+        return self._workspaces[name]
+
+    def _tracking_workspace(self, name):
+        if self._workspaces is None:
+            return None
+        return self._workspaces.get(name)
+
+    def _output_buffer(self, name):
+        """
+        Array in which to store the next board or goals.
+
+        If `reuse_buffers` is set, this is whichever of our own buffers isn't
+        currently in use. Otherwise it's None, and a new array gets allocated.
+        """
+        self._workspace(name)
+        if not self.reuse_buffers:
+            return None
+        current = getattr(self, name)
+        buffers = self._buffers[name]
+        for buf in buffers:
+            if buf is not current and buf.shape == current.shape:
+                return buf
+        buffers.append(np.empty_like(current))
+        del buffers[:-2]
+        return buffers[-1]
+
+    def _advance_array(self, name, counts=None, hash=None):
+        """
+        Advance either the board or the goals by one step.
+
+        If `counts` or `hash` are given, they're updated in place to match
+        the new board.
+        """
+        return advance_board(
+            getattr(self, name), self.spawn_prob, engine=self.physics_engine,
+            out=self._output_buffer(name), workspace=self._workspace(name),
+            rng=self.rng, goals=self.goals, counts=counts, hash=hash)
+
+    def deserialize(self, data, as_initial_state=True):
+        trajectory = self.goal_trajectory
+        self.goal_trajectory = None
+        self._goal_step = 0
+        super().deserialize(data, as_initial_state)
+        if trajectory is not None and np.array_equal(trajectory[0], self.goals):
+            # Keep using a shared trajectory if we're back at its start.
+            self.set_goal_trajectory(trajectory)
+
+    def set_goal_trajectory(self, trajectory):
+        """
+        Use a goal trajectory, typically shared with other copies of a level.
+
+        The trajectory must start with the current goals.
+        """
+        if not np.array_equal(trajectory[0], self.goals):
+            raise ValueError("Goal trajectory must start with the current goals.")
+        self.goal_trajectory = trajectory
+        self.goals = trajectory[0]
+        self._goal_step = 0
+        if trajectory.is_static:
+            self._static_goals = True
+
+    def _trajectory_goals(self):
+        """
+        Next goals from the goal trajectory, or None if they're not available.
+        """
+        if self.goal_trajectory is None and self._static_goals is None:
+            if not (self.goals & CellTypes.spawning).any():
+                self.set_goal_trajectory(GoalTrajectory(self.goals))
+        trajectory = self.goal_trajectory
+        if trajectory is None:
+            return None
+        new_goals = trajectory[self._goal_step + 1]
+        if trajectory[self._goal_step] is not self.goals or new_goals is None:
+            # Either the goals were edited, or the trajectory is too long.
+            self.goal_trajectory = None
+            return None
+        self._goal_step += 1
+        self._static_goals = trajectory.is_static
+        return new_goals
 
-    @GameState.use_rng
     def advance_board(self):
         self.num_steps += 1
+        # With static goals the counts can be updated from just the cells
+        # that change. Otherwise they're recounted when next needed.
+        counts = self._known_counts() if self._static_goals else None
         self._needs_new_counts = True
 
-        self.board = advance_board(self.board, self.spawn_prob)
+        # The board hash (if any) is updated along with the board.
+        self.board = self._advance_array('board', counts, self._board_hash)
+        if counts is not None:
+            self._set_counts(counts)
 
         if not self._static_goals:
-            new_goals = advance_board(self.goals, self.spawn_prob)
+            new_goals = self._trajectory_goals()
+            if new_goals is None:
+                new_goals = self._advance_array('goals')
             if self._static_goals is None:
                 # Check to see if they are, in fact, static
                 self._static_goals = (
                     not (new_goals & CellTypes.spawning).any() and
                     (new_goals == self.goals).all()
                 )
-            self.goals = new_goals
+            self._replace_goals(new_goals)
+
+    def step(self, actions):
+        """
+        Execute the agents' actions and then advance the board one step.
+
+        Equivalent to the base class method, but all of the work is done in
+        a single call to :func:`speedups.step_game`. Points are returned as
+        floats.
+        """
+        self.num_steps += 1
+        old_goals = goals = self.goals
+        advance_goals = not self._static_goals
+        if advance_goals:
+            # Goals from the trajectory can be passed in directly, since
+            # the actions and board physics don't depend on the goals.
+            new_goals = self._trajectory_goals()
+            if new_goals is not None:
+                goals, advance_goals = new_goals, False
+        if advance_goals or goals is not old_goals:
+            old_counts = None
+        else:
+            old_counts = self._known_counts()
+        self._needs_new_counts = True
+        board, goals, counts, points, exited, active = step_game(
+            self.board, goals, self.agent_locs, actions, self.exit_locs,
+            self.points_table, self.initial_counts, self.initial_colors,
+            self.min_performance,
+            spawn_prob=self.spawn_prob,
+            points_on_level_exit=self.points_on_level_exit,
+            advance_goals=advance_goals,
+            engine=self.physics_engine,
+            out_board=self._output_buffer('board'),
+            out_goals=self._output_buffer('goals') if advance_goals else None,
+            board_workspace=self._workspace('board'),
+            goals_workspace=self._workspace('goals'),
+            rng=self.rng, counts=old_counts, hash=self._board_hash)
+        # The board hash (if any) was updated along with the board.
+        self.board = board
+        self._replace_goals(goals)
+        if self._static_goals is None:
+            self._static_goals = (
+                not (goals & CellTypes.spawning).any() and
+                (goals == old_goals).all()
+            )
+        self._set_counts(counts)
+        return points, exited, active
 
     @property
     def is_stochastic(self):
@@ -785,55 +1313,17 @@ class GameOfLife(GameWithGoals):
     survive_rule = (2, 3)
     born_rule = (3,)
 
-    @GameState.use_rng
     def advance_board(self):
         """
         Apply one timestep of physics using Game of Life rules.
         """
-        # We can advance the board using a pretty simple convolution,
-        # so we don't have to execute a lot of loops in python.
-        # Of course, this probably won't be sufficient for extremely
-        # large boards.
         self.num_steps += 1
-        board = self.board
-        cfilter = np.array([[1,1,1],[1,0,1],[1,1,1]], dtype=np.uint16)
-
-        alive = board & CellTypes.alive > 0
-        spawning = board & CellTypes.spawning > 0
-        frozen = board & CellTypes.frozen > 0
-
-        can_die = ~frozen & (
-            convolve2d(board & CellTypes.preserving, cfilter) == 0)
-        can_grow = ~frozen & (
-            convolve2d(board & CellTypes.inhibiting, cfilter) == 0)
-
-        num_neighbors = convolve2d(alive, cfilter)
-        num_spawn = convolve2d(spawning, cfilter)
-        spawn_prob = 1 - (1 - self.spawn_prob)**num_spawn
-        has_spawned = coinflip(spawn_prob, board.shape)
-
-        born_rule = np.zeros(9, dtype=bool)
-        born_rule[list(self.born_rule)] = True
-        dead_rule = np.ones(9, dtype=bool)
-        dead_rule[list(self.survive_rule)] = False
-
-        new_alive = (born_rule[num_neighbors] | has_spawned) & ~alive & can_grow
-        new_dead = dead_rule[num_neighbors] & alive & can_die
-
-        new_flags = np.zeros_like(board)
-        color_weights = 1 * alive + 2 * spawning
-        for color in CellTypes.colors:
-            # For each of the colors, see if there are two or more neighbors
-            # that have it. If so, any new cells (whether born or spawned)
-            # will also get that color.
-            has_color = board & color > 0
-            new_color = convolve2d(has_color * color_weights, cfilter) >= 2
-            new_flags += color * new_color
-        indestructible = alive & (board & CellTypes.destructible == 0)
-        new_flags += CellTypes.destructible * (convolve2d(indestructible, cfilter) < 2)
-
-        board *= ~(new_alive | new_dead)
-        board += new_alive * (CellTypes.alive + new_flags)
+        self._needs_new_counts = True
+        self._replace_board(advance_game_of_life(
+            self.board,
+            born_rule=sum(1 << n for n in set(self.born_rule)),
+            survive_rule=sum(1 << n for n in set(self.survive_rule)),
+            spawn_prob=self.spawn_prob, rng=self.rng))
 
     @property
     def is_stochastic(self):
@@ -883,6 +1373,7 @@ class AsyncGame(GameWithGoals):
     energy_rules = energy_rule_sets['conway']
     temperature = 0
     cells_per_update = 0.3
+    _level_attributes = GameWithGoals._level_attributes + ('energy_rules',)
 
     def serialize(self):
         data = super().serialize()
@@ -893,44 +1384,269 @@ class AsyncGame(GameWithGoals):
         super().deserialize(data, *args, **kw)
         self.energy_rules = data['energy_rules']
 
-    @GameState.use_rng
     def advance_board(self):
         """
         Apply one timestep of physics using an asynchronous update.
+        """
+        self.num_steps += 1
+        self._needs_new_counts = True
+        self._replace_board(advance_async_game(
+            self.board, self.energy_rules, temperature=self.temperature,
+            spawn_prob=self.spawn_prob, cells_per_update=self.cells_per_update,
+            rng=self.rng))
+
+
+class VectorSafeLifeGame(object):
+    """
+    Many same-sized SafeLife games stored together in contiguous arrays.
+
+    Rather than keeping a separate :class:`SafeLifeGame` object for each
+    game, every piece of game state is held in a single array whose first
+    dimension is the game index. Agents and exits are stored in flat arrays
+    along with offsets that mark where each game's entries begin. Stepping
+    all of the games then takes a few calls to the native batch kernels
+    instead of many small calls per game.
+
+    Each game has its own random number generator, and is advanced exactly
+    like the equivalent :class:`SafeLifeGame`. Editing is not supported.
+
+    Parameters
+    ----------
+    games : sequence of SafeLifeGame
+        Initial games. All must have the same board shape. More games can be
+        swapped in later using :meth:`reset`.
+
+    Attributes
+    ----------
+    boards : ndarray of shape (N, H, W)
+    goals : ndarray of shape (N, H, W)
+        The boards are advanced into a second buffer which is then swapped
+        with the first, so each array gets overwritten two steps later.
+    agent_locs : ndarray of shape (num_agents, 2)
+        Locations of the agents in all games. The agents of game ``k`` are
+        ``agent_locs[agent_offsets[k]:agent_offsets[k+1]]``.
+    agent_offsets : ndarray of shape (N+1,)
+    agent_game : ndarray of shape (num_agents,)
+        Index of the game that each agent belongs to.
+    points_table : ndarray of shape (num_agents, 8, 9)
+    required_points : ndarray of shape (num_agents,)
+        Number of points each agent needs to earn to open the exit.
+    exit_locs : tuple of ndarrays
+        Rows and columns of the exits in all games.
+    exit_offsets : ndarray of shape (N+1,)
+    exit_game : ndarray
+        Index of the game that each exit belongs to.
+    alive_counts : ndarray of shape (N, 8, 9)
+        Kept up to date as the games are played. See
+        :attr:`GameWithGoals.alive_counts`.
+    initial_counts : ndarray of shape (N, 8, 9)
+    static_goals : ndarray of shape (N,), bool
+    spawn_prob : ndarray of shape (N,)
+    points_on_level_exit : ndarray of shape (N,)
+    num_steps : ndarray of shape (N,)
+    rngs : list of numpy.random.Generator
+    physics_engine : str
+        Either 'dense' or 'bitplane'. See :func:`speedups.advance_board`.
+    num_threads : int
+        Number of native threads used to advance the boards.
+    """
+    physics_engine = 'dense'
+    num_threads = 1
+
+    def __init__(self, games, **kwargs):
+        load_kwargs(self, kwargs)
+        games = list(games)
+        if not games:
+            raise ValueError("Need at least one game.")
+        n = len(games)
+        shape = (n,) + games[0].board.shape
+        self.boards = np.zeros(shape, dtype=np.uint16)
+        self.goals = np.zeros(shape, dtype=np.uint16)
+        self._next_boards = np.zeros(shape, dtype=np.uint16)
+        self.agent_locs = np.zeros((0, 2), dtype=np.int64)
+        self.agent_offsets = np.zeros(n+1, dtype=np.int64)
+        self.points_table = np.zeros((0, 8, 9))
+        self.required_points = np.zeros(0)
+        self.exit_locs = (np.zeros(0, dtype=np.int64),) * 2
+        self.exit_offsets = np.zeros(n+1, dtype=np.int64)
+        self.alive_counts = np.zeros((n, 8, 9), dtype=np.int64)
+        self.initial_counts = np.zeros((n, 8, 9), dtype=np.int64)
+        self.static_goals = np.zeros(n, dtype=bool)
+        self.spawn_prob = np.zeros(n, dtype=np.float32)
+        self.points_on_level_exit = np.zeros(n)
+        self.num_steps = np.zeros(n, dtype=np.int64)
+        self.rngs = [None] * n
+        for k, game in enumerate(games):
+            self.reset(k, game)
+
+    def __len__(self):
+        return len(self.boards)
+
+    @staticmethod
+    def _splice(array, offsets, k, values):
+        # Replace the entries for game k in a ragged array.
+        return np.concatenate(
+            [array[:offsets[k]], values, array[offsets[k+1]:]])
+
+    def reset(self, index, game):
+        """
+        Replace the game at the given index.
 
-        Note that this is going to be quite slow. It should probably be
-        replaced by an implementation in C, especially if used for training
-        AI agents.
-        """
-        board = self.board
-        rules = self.energy_rules
-        h, w = board.shape
-        beta = 1.0 / max(1e-20, self.temperature)
-        if len(rules[0]) - 1 == 4:
-            neighborhood = np.array([[0,1,0],[1,0,1],[0,1,0]])
-        elif len(rules[0]) - 1 == 6:
-            neighborhood = np.array([[0,1,1],[1,0,1],[1,1,0]])
-        elif len(rules[0]) - 1 == 8:
-            neighborhood = np.array([[1,1,1],[1,0,1],[1,1,1]])
+        Parameters
+        ----------
+        index : int
+        game : SafeLifeGame
+            Typically a freshly loaded level. Its random number generator is
+            taken over by this object.
+        """
+        if game.board.shape != self.boards.shape[1:]:
+            raise ValueError("All games must have the same board shape.")
+        k = index
+        self.boards[k] = game.board
+        self.goals[k] = game.goals
+        self.alive_counts[k] = game.alive_counts
+        self.initial_counts[k] = game.initial_counts
+        self.spawn_prob[k] = game.spawn_prob
+        self.points_on_level_exit[k] = game.points_on_level_exit
+        self.num_steps[k] = game.num_steps
+        if game._static_goals is None:
+            self.static_goals[k] = (
+                not (game.goals & CellTypes.spawning).any() and
+                (advance_board(game.goals, 0.0) == game.goals).all()
+            )
         else:
-            raise RuntimeError("async rules must have length 5, 7, or 9")
-        rng = get_rng()
-        for _ in range(int(board.size * self.cells_per_update)):
-            x = rng.choice(w)
-            y = rng.choice(h)
-            if board[y, x] & CellTypes.frozen:
-                continue
-            neighbors = board.view(wrapping_array)[y-1:y+2, x-1:x+2] * neighborhood
-            alive_neighbors = np.sum(neighbors & CellTypes.alive > 0)
-            spawn_neighbors = np.sum(neighbors & CellTypes.spawning > 0)
-            frozen = np.sum(neighbors & CellTypes.freezing) > 0
-            if frozen:
-                continue
-            if board[y, x] & CellTypes.alive:
-                H = rules[0][alive_neighbors]
-            else:
-                H = rules[1][alive_neighbors]
+            self.static_goals[k] = game._static_goals
+
+        rng = game._rng
+        if rng is None or any(r is rng for r in self.rngs[:k] + self.rngs[k+1:]):
+            # Each game needs a generator of its own.
+            rng = np.random.default_rng(game.rng.integers(1 << 63))
+        self.rngs[k] = rng
+
+        offsets = self.agent_offsets
+        self.agent_locs = self._splice(self.agent_locs, offsets, k, game.agent_locs)
+        self.points_table = self._splice(
+            self.points_table, offsets, k, game.points_table)
+        self.required_points = self._splice(
+            self.required_points, offsets, k,
+            np.broadcast_to(game.required_points(), len(game.agent_locs)))
+        offsets[k+1:] += len(game.agent_locs) - (offsets[k+1] - offsets[k])
+        self.agent_game = np.repeat(np.arange(len(self)), np.diff(offsets))
+
+        offsets = self.exit_offsets
+        self.exit_locs = tuple(
+            self._splice(idx, offsets, k, game_idx)
+            for idx, game_idx in zip(self.exit_locs, game.exit_locs))
+        offsets[k+1:] += len(game.exit_locs[0]) - (offsets[k+1] - offsets[k])
+        self.exit_game = np.repeat(np.arange(len(self)), np.diff(offsets))
+
+    def copy_to(self, index, game):
+        """
+        Copy the current state of one of the games into a SafeLifeGame.
+
+        This is typically the game that was passed to :meth:`reset`, so that
+        it can be scored or logged once its episode is over.
+        """
+        k = index
+        game.board = self.boards[k].copy()
+        game.goals = self.goals[k].copy()
+        game._board_hash = game._goals_hash = None
+        game.agent_locs = self.agent_locs[
+            self.agent_offsets[k]:self.agent_offsets[k+1]].copy()
+        game.num_steps = int(self.num_steps[k])
+        game._set_counts(self.alive_counts[k].copy())
+
+    def execute_actions(self, actions):
+        """
+        Perform an action for every agent in every game.
+
+        Parameters
+        ----------
+        actions : ndarray of shape (num_agents,)
+        """
+        actions = np.broadcast_to(actions, len(self.agent_locs))
+        execute_actions_batch(
+            self.boards, self.agent_locs, self.agent_offsets, actions,
+            num_threads=self.num_threads,
+            goals=self.goals, counts=self.alive_counts)
+
+    def advance_board(self):
+        """
+        Advance all of the boards (and any non-static goals) by one step.
+        """
+        self.num_steps += 1
+        self.boards, self._next_boards = advance_board_batch(
+            self.boards, self.spawn_prob, out=self._next_boards,
+            num_threads=self.num_threads, engine=self.physics_engine,
+            rng=self.rngs, goals=self.goals, counts=self.alive_counts
+        ), self.boards
+        # The counts were updated for the old goals, so games with moving
+        # goals need a full recount.
+        dynamic = np.flatnonzero(~self.static_goals)
+        if len(dynamic) > 0:
+            goals = advance_board_batch(
+                self.goals[dynamic], self.spawn_prob[dynamic],
+                num_threads=self.num_threads, engine=self.physics_engine,
+                rng=[self.rngs[k] for k in dynamic])
+            self.goals[dynamic] = goals
+            self.alive_counts[dynamic] = alive_counts(
+                self.boards[dynamic], goals)
+
+    def _agent_cells(self):
+        return self.boards[(self.agent_game,) + tuple(self.agent_locs.T)]
+
+    def has_exited(self):
+        """Boolean value for each agent. See :meth:`GameState.has_exited`."""
+        agents = self._agent_cells()
+        return agents & (CellTypes.agent | CellTypes.exit) == CellTypes.exit
+
+    def agent_is_active(self):
+        """Boolean value for each agent."""
+        return self._agent_cells() & CellTypes.agent > 0
 
-            P = 0.5 + 0.5*np.tanh(H * beta)
-            P = 1 - (1-P)*(1-self.spawn_prob)**spawn_neighbors
-            board[y, x] = CellTypes.life if coinflip(P) else CellTypes.empty
+    def _agent_points(self, counts):
+        points = self.points_table * counts[self.agent_game]
+        return np.sum(points.reshape(-1, 72), axis=1)
+
+    def current_points(self):
+        """Current points for each agent in each game."""
+        exit_points = self.points_on_level_exit[self.agent_game]
+        return (self._agent_points(self.alive_counts) +
+                exit_points * self.has_exited())
+
+    def points_earned(self):
+        """Points earned by each agent since the start of its game."""
+        exit_points = self.points_on_level_exit[self.agent_game]
+        delta_counts = self.alive_counts - self.initial_counts
+        return self._agent_points(delta_counts) + exit_points * self.has_exited()
+
+    def can_exit(self):
+        points_earned = np.maximum(0, self.points_earned())
+        return self.agent_is_active() & (points_earned >= self.required_points)
+
+    def update_exit_colors(self):
+        """See :meth:`GameWithGoals.update_exit_colors`."""
+        can_exit = self.can_exit()
+        idx = (self.agent_game,) + tuple(self.agent_locs.T)
+        self.boards[idx] &= ~CellTypes.exit
+        self.boards[idx] |= CellTypes.exit * can_exit
+        any_can_exit = np.bincount(
+            self.agent_game, can_exit, minlength=len(self)) > 0
+        exit_game = self.exit_game
+        self.boards[(exit_game,) + self.exit_locs] = (
+            CellTypes.level_exit | CellTypes.color_r * any_can_exit[exit_game])
+
+    def step(self, actions):
+        """
+        Execute the agents' actions and then advance every board one step.
+
+        Returns
+        -------
+        points : ndarray of shape (num_agents,)
+        exited : ndarray of shape (num_agents,), bool
+        active : ndarray of shape (num_agents,), bool
+        """
+        self.execute_actions(actions)
+        self.advance_board()
+        self.update_exit_colors()
+        return self.current_points(), self.has_exited(), self.agent_is_active()
@@ -50,8 +50,9 @@ except ImportError:
     ray = None
     def ray_remote(func): return func
 
-from .helper_utils import load_kwargs
+from .helper_utils import load_kwargs, AsyncStepMixin
 from .render_graphics import render_file
+from .replay import EpisodeReplay
 
 logger = logging.getLogger(__name__)
 
@@ -273,8 +274,9 @@ class SafeLifeLogger(BaseLogger):
         info : dict
             Episode data to log. Assumed to contain 'reward' and 'length' keys,
             as is returned by the ``SafeLifeEnv.step()`` function.
-        history : dict
-            Trajectory of the episode. Should contain keys 'board' and 'goals'.
+        history : EpisodeReplay or dict
+            Trajectory of the episode. Either a replay or a dict containing
+            keys 'board' and 'goals'.
         """
         self.init_logdir()  # init if needed
 
@@ -345,7 +347,10 @@ class SafeLifeLogger(BaseLogger):
             vname = self.video_name.format(**log_data, **self.cumulative_stats)
             vname = os.path.join(self.logdir, vname) + '.npz'
             if not os.path.exists(vname):
-                np.savez_compressed(vname, **history)
+                if isinstance(history, EpisodeReplay):
+                    history.save(vname)
+                else:
+                    np.savez_compressed(vname, **history)
                 render_file(vname, movie_format="mp4")
                 if self.wandb is not None:
                     tb_data['video'] = self.wandb.Video(vname[:-3] + 'mp4')
@@ -545,7 +550,7 @@ class RemoteSafeLifeLogger(BaseLogger):
             data, step, tag, delta_steps))
 
 
-class SafeLifeLogWrapper(gym.Wrapper):
+class SafeLifeLogWrapper(AsyncStepMixin, gym.Wrapper):
     """
     Records episode data and (optionally) full agent trajectories.
 
@@ -557,15 +562,35 @@ class SafeLifeLogWrapper(gym.Wrapper):
         implements a ``log_episode()`` function.
     record_history : bool
         If True (default), the full agent trajectory is sent to the logger
-        along with the game state and episode info dict.
+        along with the game state and episode info dict. The trajectory is
+        recorded as an :class:`EpisodeReplay`, which only stores the initial
+        state and the actions taken.
+    keyframe_interval : int
+        If positive, the recorded replay also stores the full game state
+        every this many steps. See :class:`EpisodeReplay`.
+
+    If the environment calculates side effects in the background (see
+    ``SafeLifeEnv.side_effect_pool``), each episode is logged once its side
+    effects arrive rather than as soon as it ends. Any episodes that are
+    still waiting are logged when the wrapper is closed.
     """
 
     logger = None
     record_history = True
+    keyframe_interval = 0
 
     def __init__(self, env, **kwargs):
         super().__init__(env)
         load_kwargs(self, kwargs)
+        self._pending_episodes = {}
+
+    def _log_pending(self, side_effects):
+        for episode_id, effects in side_effects.items():
+            if episode_id not in self._pending_episodes:
+                continue
+            game, info, history = self._pending_episodes.pop(episode_id)
+            info = dict(info, side_effects=effects)
+            self.logger.log_episode(game, info, history)
 
     def step(self, action):
         observation, reward, done, info = self.env.step(action)
@@ -576,8 +601,7 @@ class SafeLifeLogWrapper(gym.Wrapper):
 
         game = self.env.game
         if self._episode_history is not None and not self._did_log_episode:
-            self._episode_history['board'].append(game.board)
-            self._episode_history['goals'].append(game.goals)
+            self._episode_history.record(action, game)
 
         if not self._did_log_episode:
             key = self.logger.episode_type + '_steps'
@@ -585,8 +609,16 @@ class SafeLifeLogWrapper(gym.Wrapper):
 
         if np.all(done) and not self._did_log_episode:
             self._did_log_episode = True
-            self.logger.log_episode(
-                game, info.get('episode', {}), self._episode_history)
+            episode_info = info.get('episode', {})
+            if 'episode_id' in episode_info and 'side_effects' not in episode_info:
+                self._pending_episodes[episode_info['episode_id']] = (
+                    game, episode_info, self._episode_history)
+            else:
+                self.logger.log_episode(
+                    game, episode_info, self._episode_history)
+
+        if 'side_effects' in info:
+            self._log_pending(info['side_effects'])
 
         return observation, reward, done, info
 
@@ -594,13 +626,17 @@ class SafeLifeLogWrapper(gym.Wrapper):
         observation = self.env.reset()
 
         self._did_log_episode = False
-        self._episode_history = {
-            'board': [],
-            'goals': [],
-        } if self.record_history else None
+        self._episode_history = EpisodeReplay(
+            self.env.game, self.keyframe_interval
+        ) if self.record_history and self.logger is not None else None
 
         return observation
 
+    def close(self):
+        if self._pending_episodes:
+            self._log_pending(self.env.collect_side_effects(wait=True))
+        self.env.close()
+
 
 def load_safelife_log(logfile, default_values={}):
     """
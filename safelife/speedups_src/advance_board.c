@@ -1,39 +1,17 @@
 #include <string.h>
 #include "advance_board.h"
 #include "constants.h"
-#include "random.h"
-
-static const uint16_t ALIVE_BITS = (1 << 4) - 1;
-static const uint16_t DESTRUCTIBLE2 = 1 << 8;
-static const uint16_t FLAGS1 = PRESERVING | INHIBITING | SPAWNING;
-static const uint16_t FLAGS2 = (1 << 8) | COLORS;
-
-
-static void combine_neighbors(uint16_t src, uint16_t *dst) {
-    // Combine neighbors with base board.
-    uint16_t alive = src & ALIVE;
-    uint16_t src_flags1 = src & FLAGS1;
-    uint16_t src_flags2 = (src & FLAGS2) * alive;
-    uint16_t dst_flags2 = *dst & FLAGS2;
-    *dst |= (dst_flags2 & src_flags2) << 4;
-    *dst |= ((src & COLORS) << 4) * ((src & SPAWNING) > 0);
-    *dst |= src_flags1;
-    *dst |= src_flags2;
-    *dst += alive;
-}
-
-
-static void combine_neighbors2(uint16_t src, uint16_t *dst) {
-    // Combine combinations.
-    *dst |= (*dst & src & FLAGS2) << 4;
-    *dst |= src & (FLAGS1 | FLAGS2 | (FLAGS2 << 4));
-    *dst += src & ALIVE_BITS;
+#include "cell_rules.h"
+#include "bitplane.h"
+#include "tiled.h"
+#include "threads.h"
+#include "workspace.h"
+#include "board_hash.h"
 
-}
 
 void advance_board(
         uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob,
-        uint16_t *c0) {
+        bitgen_t *rng, uint16_t *c0) {
     int size = nrow*ncol;
     int i, j, start_of_row, end_of_row, end_of_col;
     uint16_t *c1 = c0 ? c0 : malloc(size * sizeof(uint16_t));
@@ -43,7 +21,7 @@ void advance_board(
     // the exit bit. This allows us to treat destructibility and colors at
     // the same time.
     for (i = 0; i < size; i++) {
-        b2[i] = b1[i] | (b1[i] & DESTRUCTIBLE) << 5;
+        b2[i] = neighbor_bits(b1[i]);
     }
 
     // First figure out what the neighboring bits are.
@@ -92,63 +70,242 @@ void advance_board(
 
     // Now loop over the board and advance it.
     for (i = 0; i < size; i++) {
-        uint16_t num_alive = b2[i] & ALIVE_BITS;
-        if (b1[i] & ALIVE) {
-            // Note that if it's alive, it counts as its own neighbor.
-            if (b1[i] & FROZEN || b2[i] & PRESERVING ||
-                num_alive == 3 || num_alive == 4) {
-                // copy the old cell
-                b2[i] = b1[i];
-            } else {
-                // kill the cell
-                b2[i] = 0;
-            }
-        } else {  // starts dead
-            if (b1[i] & FROZEN || b2[i] & INHIBITING) {
-                // copy the old cell
-                b2[i] = b1[i];
-            } else if (num_alive == 3) {
-                // add a new live cell
-                b2[i] = ALIVE |
-                    ((b2[i] & (COLORS << 4)) >> 4) |
-                    ((b2[i] & (DESTRUCTIBLE2 << 4)) >> 9);
-            } else if (b2[i] & SPAWNING && random_float() < spawn_prob) {
-                // add a spawned cell
-                b2[i] = ALIVE | DESTRUCTIBLE |
-                    ((b2[i] & (COLORS << 4)) >> 4);
-            } else {
-                // copy the old cell
-                b2[i] = b1[i];
-            }
-        }
+        b2[i] = next_cell(b1[i], b2[i], spawn_prob, rng);
+    }
+}
+
+
+static int has_spawners(uint16_t *board, int size) {
+    for (int i = 0; i < size; i++) {
+        if (board[i] & SPAWNING) return 1;
+    }
+    return 0;
+}
+
+
+/*
+    Cycle detection for deterministic boards.
+
+    Boards without spawners evolve deterministically, and most of them settle
+    into a still life or a short-period oscillator. We keep a checkpoint of
+    the board and compare every subsequent state against it, moving the
+    checkpoint forward after 1, 2, 4, 8, ... steps (Brent's algorithm). This
+    finds the period within a few multiples of the time it takes for the
+    board to settle, and since boards are compared exactly there's no chance
+    of a false match.
+*/
+typedef struct {
+    uint16_t *board;
+    int step;
+    int power;
+} cycle_finder_t;
+
+
+static void cycle_finder_init(
+        cycle_finder_t *cf, uint16_t *checkpoint, uint16_t *board, int size) {
+    memcpy(checkpoint, board, size * sizeof(uint16_t));
+    cf->board = checkpoint;
+    cf->step = 0;
+    cf->power = 1;
+}
+
+
+static int cycle_finder_check(
+        cycle_finder_t *cf, uint16_t *board, int size, int step) {
+    // Returns the period if the board matches the checkpoint, or 0 otherwise.
+    // If there's no match, the checkpoint may move to the current step.
+    if (!memcmp(board, cf->board, size * sizeof(uint16_t))) {
+        return step - cf->step;
+    }
+    if (step - cf->step == cf->power) {
+        memcpy(cf->board, board, size * sizeof(uint16_t));
+        cf->step = step;
+        cf->power *= 2;
+    }
+    return 0;
+}
+
+
+size_t advance_board_scratch_size(int nrow, int ncol, int engine) {
+    // Scratch memory needed by advance_board_nstep or advance_board_bitplane.
+    // The tiled engine keeps all of its memory in the workspace's tile state.
+    if (engine == ENGINE_BITPLANE) {
+        return bitplane_scratch_size(nrow, ncol);
+    } else if (engine == ENGINE_TILED) {
+        return 0;
     }
+    return 3 * nrow * ncol * sizeof(uint16_t);
 }
 
 
 void advance_board_nstep(
         uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob,
-        int n_steps) {
+        int n_steps, bitgen_t *rng, workspace_t *ws) {
+    /*
+    Advance the board n steps. If the board has no spawners, any cycles
+    are skipped over rather than simulated.
+    */
     int size = nrow*ncol;
-    uint16_t *temp = malloc((n_steps > 1 ? 2 : 1) * size * sizeof(uint16_t));
-    uint16_t *b3 = temp, *c1 = temp + size;
-
-    advance_board(b1, b2, nrow, ncol, spawn_prob, temp);
-    for (int step_idx=1; step_idx < n_steps; step_idx++) {
-        if (step_idx & 1) {
-            advance_board(b2, b3, nrow, ncol, spawn_prob, c1);
-        } else {
-            advance_board(b3, b2, nrow, ncol, spawn_prob, c1);
+    size_t temp_size = advance_board_scratch_size(nrow, ncol, ENGINE_DENSE);
+    uint16_t *temp = ws ? workspace_reserve(ws, temp_size) : malloc(temp_size);
+    uint16_t *b3 = temp, *c1 = temp + size, *checkpoint = temp + 2*size;
+    uint16_t *src = b1, *dst = b2;
+    cycle_finder_t cf = {NULL, 0, 1};
+    if (!temp) return;
+
+    int find_cycles = n_steps > 2 && !has_spawners(b1, size);
+    if (find_cycles) cycle_finder_init(&cf, checkpoint, b1, size);
+    if (n_steps < 1) n_steps = 1;
+    for (int step_idx = 1; step_idx <= n_steps; step_idx++) {
+        advance_board(src, dst, nrow, ncol, spawn_prob, rng, c1);
+        src = dst;
+        dst = src == b2 ? b3 : b2;
+        if (find_cycles) {
+            int period = cycle_finder_check(&cf, src, size, step_idx);
+            if (period) {
+                // Skip all of the remaining full periods.
+                step_idx += (n_steps - step_idx) / period * period;
+                find_cycles = 0;
+            }
         }
     }
-    if (!(n_steps & 1)) {
+    if (src != b2) {
         // Need to copy from b3 back to the output b2.
-        memcpy(b2, b3, size * sizeof(uint16_t));
+        memcpy(b2, src, size * sizeof(uint16_t));
     }
 
-    free(temp);
+    if (!ws) free(temp);
 }
 
 
+void advance_board_engine(
+        uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob,
+        int n_steps, int engine, bitgen_t *rng, workspace_t *ws,
+        uint16_t *goals, int64_t *counts, uint64_t *hash) {
+    // If counts (with goals) or hash are not NULL, they're updated to match
+    // the new board. See `update_counts` and `update_board_hash`.
+    // Only the tiled engine can advance the board in place (b1 == b2).
+    switch (engine) {
+        case ENGINE_BITPLANE:
+            advance_board_bitplane(
+                b1, b2, nrow, ncol, spawn_prob, n_steps, rng, ws);
+            break;
+        case ENGINE_TILED:
+            // The tiled engine only looks at the cells that change.
+            advance_board_tiled(
+                b1, b2, nrow, ncol, spawn_prob, n_steps, rng, ws,
+                goals, counts, hash);
+            return;
+        default:
+            advance_board_nstep(
+                b1, b2, nrow, ncol, spawn_prob, n_steps, rng, ws);
+    }
+    if (counts) update_counts(b1, b2, goals, nrow, ncol, counts);
+    if (hash) *hash = update_board_hash(b1, b2, nrow, ncol, 0, *hash);
+}
+
+
+typedef struct {
+    uint16_t *b1;
+    uint16_t *b2;
+    int nrow;
+    int ncol;
+    float *spawn_probs;
+    int prob_stride;
+    int n_steps;
+    int engine;
+    bitgen_t **rngs;
+    int rng_stride;
+    char *scratch;  // one slot per thread
+    size_t slot_size;
+} board_batch_t;
+
+
+static void advance_board_batch_item(void *context, int idx, int thread_idx) {
+    board_batch_t *batch = context;
+    int size = batch->nrow * batch->ncol;
+    float spawn_prob = batch->spawn_probs[idx * batch->prob_stride];
+    workspace_t ws = {
+        batch->scratch + thread_idx * batch->slot_size, batch->slot_size
+    };
+    advance_board_engine(
+        batch->b1 + idx*size, batch->b2 + idx*size, batch->nrow, batch->ncol,
+        spawn_prob, batch->n_steps, batch->engine,
+        batch->rngs[idx * batch->rng_stride], &ws, NULL, NULL, NULL);
+}
+
+
+typedef struct {
+    board_batch_t *batch;
+    int *indices;
+} board_subset_t;
+
+
+static void advance_board_batch_subset(void *context, int idx, int thread_idx) {
+    board_subset_t *subset = context;
+    advance_board_batch_item(subset->batch, subset->indices[idx], thread_idx);
+}
+
+
+void advance_board_batch(
+        uint16_t *b1, uint16_t *b2, int n_boards, int nrow, int ncol,
+        float *spawn_probs, int prob_stride, int n_steps, int engine,
+        bitgen_t **rngs, int rng_stride, int num_threads, workspace_t *ws) {
+    /*
+    Advance a contiguous stack of boards.
+
+    If each board has its own random number generator (rng_stride = 1), the
+    boards are independent and can all be spread across threads. Otherwise
+    only boards without spawners, which are deterministic, are spread across
+    threads. Stochastic boards then share a single generator, so they're
+    advanced one after another (in order) on the calling thread.
+
+    The tiled engine's state belongs to a single board, so batches of boards
+    use the dense engine instead.
+    */
+    int size = nrow * ncol;
+    if (engine == ENGINE_TILED) engine = ENGINE_DENSE;
+    if (num_threads > n_boards) num_threads = n_boards;
+    if (num_threads < 1) num_threads = 1;
+    size_t slot_size = advance_board_scratch_size(nrow, ncol, engine);
+    size_t scratch_size = slot_size * num_threads;
+    char *scratch = ws ? workspace_reserve(ws, scratch_size) : malloc(scratch_size);
+    if (!scratch) return;
+    board_batch_t batch = {
+        b1, b2, nrow, ncol, spawn_probs, prob_stride, n_steps, engine,
+        rngs, rng_stride, scratch, slot_size
+    };
+    int *indices = NULL;
+    int n_deterministic = 0, n_stochastic = 0;
+
+    if (num_threads == 1 || rng_stride) {
+        parallel_for(advance_board_batch_item, &batch, n_boards, num_threads);
+        goto cleanup;
+    }
+    if (!(indices = malloc(sizeof(int) * n_boards))) {
+        parallel_for(advance_board_batch_item, &batch, n_boards, 1);
+        goto cleanup;
+    }
+    for (int k = 0; k < n_boards; k++) {
+        if (has_spawners(b1 + k*size, size)) {
+            // stochastic boards get stored at the end, in reverse order
+            indices[n_boards - ++n_stochastic] = k;
+        } else {
+            indices[n_deterministic++] = k;
+        }
+    }
+    board_subset_t subset = {&batch, indices};
+    parallel_for(
+        advance_board_batch_subset, &subset, n_deterministic, num_threads);
+    for (int k = n_boards - 1; k >= n_deterministic; k--) {
+        advance_board_batch_item(&batch, indices[k], 0);
+    }
+
+    cleanup:
+    free(indices);
+    if (!ws) free(scratch);
+}
+
 
 static void accumulate_cell_types(uint16_t *board, int32_t *counts, int board_size) {
     for (int i=0; i<board_size; i++) {
@@ -163,50 +320,117 @@ static void accumulate_cell_types(uint16_t *board, int32_t *counts, int board_si
 
 void life_occupancy(
         uint16_t *b1, int32_t *counts, int nrow, int ncol, float spawn_prob,
-        int n_steps) {
+        int n_steps, bitgen_t *rng, workspace_t *ws) {
     /*
     Advances the board n steps, but doesn't actually store the new board.
     Instead, it keeps a count of the number of times that each cell has been
     occupied by life of each type (color).
+
+    If the board has no spawners, the occupancy over one full cycle is
+    multiplied by the number of remaining cycles instead of being simulated.
     */
     int size = nrow*ncol;
-    uint16_t *temp = malloc((n_steps > 1 ? 3 : 2) * size * sizeof(uint16_t));
+    size_t temp_size = 4 * size * sizeof(uint16_t) + 8 * size * sizeof(int32_t);
+    uint16_t *temp = ws ? workspace_reserve(ws, temp_size) : malloc(temp_size);
     uint16_t *b2 = temp, *c1 = temp + size, *b3 = temp + 2*size;
-
-    advance_board(b1, b2, nrow, ncol, spawn_prob, c1);
-    accumulate_cell_types(b2, counts, size);
-    for (int step_idx=1; step_idx < n_steps; step_idx++) {
-        if (step_idx & 1) {
-            advance_board(b2, b3, nrow, ncol, spawn_prob, c1);
-            accumulate_cell_types(b3, counts, size);
-        } else {
-            advance_board(b3, b2, nrow, ncol, spawn_prob, c1);
-            accumulate_cell_types(b2, counts, size);
+    uint16_t *checkpoint = temp + 3*size;
+    int32_t *checkpoint_counts = (int32_t *)(temp + 4*size);
+    uint16_t *src = b1, *dst = b2;
+    cycle_finder_t cf = {NULL, 0, 1};
+    if (!temp) return;
+
+    int find_cycles = n_steps > 2 && !has_spawners(b1, size);
+    if (find_cycles) {
+        cycle_finder_init(&cf, checkpoint, b1, size);
+        memcpy(checkpoint_counts, counts, 8 * size * sizeof(int32_t));
+    }
+    for (int step_idx = 1; step_idx <= n_steps; step_idx++) {
+        advance_board(src, dst, nrow, ncol, spawn_prob, rng, c1);
+        src = dst;
+        dst = src == b2 ? b3 : b2;
+        accumulate_cell_types(src, counts, size);
+        if (!find_cycles) continue;
+        int period = cycle_finder_check(&cf, src, size, step_idx);
+        if (period) {
+            // Counts since the checkpoint cover exactly one period.
+            int n_periods = (n_steps - step_idx) / period;
+            for (int i = 0; i < 8*size; i++) {
+                counts[i] += n_periods * (counts[i] - checkpoint_counts[i]);
+            }
+            step_idx += n_periods * period;
+            find_cycles = 0;
+        } else if (cf.step == step_idx) {
+            memcpy(checkpoint_counts, counts, 8 * size * sizeof(int32_t));
         }
     }
 
-    free(temp);
+    if (!ws) free(temp);
+}
+
+
+static inline void count_cell(uint16_t b, uint16_t g, int64_t *counts, int sign) {
+    // Don't add to counts if it's immovable and frozen,
+    // as there isn't any way for an agent to change such a cell.
+    if ((b & (DESTRUCTIBLE | PUSHABLE | PULLABLE)) || !(b & FROZEN)) {
+        int b_color = (b & ALIVE) ? (b & COLORS) >> COLOR_BIT : 8;
+        int g_color = (g & COLORS) >> COLOR_BIT;
+        counts[b_color + 9*g_color] += sign;
+    }
+}
+
+
+void update_cell_counts(
+        uint16_t old_cell, uint16_t new_cell, uint16_t goal, int64_t *counts) {
+    // Move a single changed cell from one entry of the counts to another.
+    count_cell(old_cell, goal, counts, -1);
+    count_cell(new_cell, goal, counts, +1);
 }
 
 
 void alive_counts(uint16_t *board, uint16_t *goals, int n, int64_t *out) {
-    uint16_t b, g, b_color, g_color;
-    uint16_t movable = DESTRUCTIBLE | PUSHABLE | PULLABLE;
     for (int i=0; i<n; i++) {
-        b = board[i];
-        g = goals[i];
-        b_color = ((b & COLORS) >> COLOR_BIT);
-        g_color = ((g & COLORS) >> COLOR_BIT);
-        if ((b & movable) || !(b & FROZEN)) {
-            // Don't add to counts if it's immovable and frozen,
-            // as there isn't any way for an agent to change such a cell.
-            out[b_color + 9*g_color] += b & ALIVE;
-            out[8 + 9*g_color] += 1 - (b & ALIVE);
+        count_cell(board[i], goals[i], out, 1);
+    }
+}
+
+
+void update_counts(
+        uint16_t *b1, uint16_t *b2, uint16_t *goals, int nrow, int ncol,
+        int64_t *counts) {
+    /*
+    Turn the alive counts of board b1 into those of b2, given the same goals.
+
+    Rows that are unchanged are skipped with a single memcmp, so this costs
+    far less than a full recount when most of the board is still.
+    */
+    for (int i = 0; i < nrow*ncol; i += ncol) {
+        if (!memcmp(b1 + i, b2 + i, ncol * sizeof(uint16_t))) continue;
+        for (int j = i; j < i + ncol; j++) {
+            if (b1[j] != b2[j]) {
+                count_cell(b1[j], goals[j], counts, -1);
+                count_cell(b2[j], goals[j], counts, +1);
+            }
         }
     }
 }
 
 
+static void track_action_cells(
+        uint16_t *board, uint16_t *goals, uint16_t **cells, int64_t *counts,
+        uint64_t *hash, int sign) {
+    // Add (or remove) the cells that an action can touch to the counts
+    // and the hash. On narrow boards the same cell can show up more than once.
+    for (int i = 0; i < 4; i++) {
+        int duplicate = 0;
+        for (int j = 0; j < i; j++) duplicate |= cells[i] == cells[j];
+        if (duplicate) continue;
+        int64_t idx = cells[i] - board;
+        if (counts) count_cell(*cells[i], goals[idx], counts, sign);
+        if (hash) *hash ^= zobrist_key(idx, *cells[i], 0);
+    }
+}
+
+
 static int clip(int x, int width) {
     while (x < 0) x += width;
     while (x >= width) x -= width;
@@ -216,7 +440,13 @@ static int clip(int x, int width) {
 
 void execute_actions(
         uint16_t *board, int w, int h,
-        int64_t *locations, int64_t *actions, int n_agents, int action_stride) {
+        int64_t *locations, int64_t *actions, int n_agents, int action_stride,
+        uint16_t *goals, int64_t *counts, uint64_t *hash, workspace_t *ws) {
+    // If counts or hash is not NULL, it's updated to reflect any changed
+    // cells. The hash is the board hash with salt zero; see board_hash.c.
+    // If ws is not NULL, the cells that the agents touch are marked as
+    // changed for the tiled engine.
+    int track = counts || hash;
     for (int k=0; k < n_agents; k++) {
         int64_t action = *actions;
         actions += action_stride;
@@ -239,6 +469,8 @@ void execute_actions(
         uint16_t *p3 = board + (clip(x0-dx, w) + clip(y0-dy, h)*w);
 
         if (!(*p0 & AGENT)) continue;
+        uint16_t *cells[4] = {p0, p1, p2, p3};
+        if (track) track_action_cells(board, goals, cells, counts, hash, -1);
 
         // Re-orient the agent.
         *p0 &= ~ORIENTATION_MASK;
@@ -282,7 +514,7 @@ void execute_actions(
             } else if ((*p0 & *p1 & EXIT) && !(*p1 & AGENT)) {
                 goto exit_move;
             }
-            continue;
+            goto done;
 
             move:
             *p1 = *p0;
@@ -296,5 +528,55 @@ void execute_actions(
                 *p0 = 0;
             }
         }
+
+        done:
+        if (track) track_action_cells(board, goals, cells, counts, hash, +1);
+        for (int i = 0; ws && i < 4; i++) {
+            tiled_mark_cell(ws, h, w, cells[i] - board);
+        }
     }
 }
+
+
+typedef struct {
+    uint16_t *boards;
+    int nrow;
+    int ncol;
+    int64_t *locations;
+    int64_t *offsets;
+    int64_t *actions;
+    uint16_t *goals;
+    int64_t *counts;
+} action_batch_t;
+
+
+static void execute_actions_batch_item(void *context, int idx, int thread_idx) {
+    action_batch_t *batch = context;
+    int64_t start = batch->offsets[idx];
+    int size = batch->nrow * batch->ncol;
+    execute_actions(
+        batch->boards + idx * size,
+        batch->ncol, batch->nrow,
+        batch->locations + 2*start, batch->actions + start,
+        batch->offsets[idx+1] - start, 1,
+        batch->goals ? batch->goals + idx * size : NULL,
+        batch->counts ? batch->counts + idx * 72 : NULL, NULL, NULL);
+}
+
+
+void execute_actions_batch(
+        uint16_t *boards, int n_boards, int nrow, int ncol,
+        int64_t *locations, int64_t *offsets, int64_t *actions,
+        uint16_t *goals, int64_t *counts, int num_threads) {
+    /*
+    Perform actions for the agents on a contiguous stack of boards.
+
+    The agents on board k are locations[offsets[k]:offsets[k+1]], and each
+    one has its own entry in the actions array. Boards are independent of
+    each other, so they can be spread across threads. If counts is not NULL,
+    it holds the (8, 9) alive counts of each board and is kept up to date.
+    */
+    action_batch_t batch = {
+        boards, nrow, ncol, locations, offsets, actions, goals, counts};
+    parallel_for(execute_actions_batch_item, &batch, n_boards, num_threads);
+}
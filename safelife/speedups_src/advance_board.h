@@ -1,16 +1,52 @@
 #include <stdint.h>
+#include "workspace.h"
+#include "random.h"
+
+enum physics_engine {
+    ENGINE_DENSE = 0,
+    ENGINE_BITPLANE = 1,
+    ENGINE_TILED = 2,
+};
 
 void advance_board(
-    uint16_t *b1, uint16_t *b2, int height, int width, float spawn_prob, uint16_t *c0);
+    uint16_t *b1, uint16_t *b2, int height, int width, float spawn_prob,
+    bitgen_t *rng, uint16_t *c0);
+
+size_t advance_board_scratch_size(int nrow, int ncol, int engine);
 
 void advance_board_nstep(
-    uint16_t *b1, uint16_t *b2, int height, int width, float spawn_prob, int n_steps);
+    uint16_t *b1, uint16_t *b2, int height, int width, float spawn_prob, int n_steps,
+    bitgen_t *rng, workspace_t *ws);
+
+void advance_board_engine(
+    uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob, int n_steps,
+    int engine, bitgen_t *rng, workspace_t *ws,
+    uint16_t *goals, int64_t *counts, uint64_t *hash);
+
+void advance_board_batch(
+    uint16_t *b1, uint16_t *b2, int n_boards, int nrow, int ncol,
+    float *spawn_probs, int prob_stride, int n_steps, int engine,
+    bitgen_t **rngs, int rng_stride, int num_threads, workspace_t *ws);
 
 void life_occupancy(
-        uint16_t *b1, int32_t *counts, int nrow, int ncol, float spawn_prob, int n_steps);
+        uint16_t *b1, int32_t *counts, int nrow, int ncol, float spawn_prob, int n_steps,
+        bitgen_t *rng, workspace_t *ws);
+
+void update_cell_counts(
+    uint16_t old_cell, uint16_t new_cell, uint16_t goal, int64_t *counts);
 
 void alive_counts(uint16_t *board, uint16_t *goals, int n, int64_t *out);
 
+void update_counts(
+    uint16_t *b1, uint16_t *b2, uint16_t *goals, int nrow, int ncol,
+    int64_t *counts);
+
 void execute_actions(
     uint16_t *board, int w, int h,
-    int64_t *locations, int64_t *actions, int n_agents, int action_stride);
+    int64_t *locations, int64_t *actions, int n_agents, int action_stride,
+    uint16_t *goals, int64_t *counts, uint64_t *hash, workspace_t *ws);
+
+void execute_actions_batch(
+    uint16_t *boards, int n_boards, int nrow, int ncol,
+    int64_t *locations, int64_t *offsets, int64_t *actions,
+    uint16_t *goals, int64_t *counts, int num_threads);
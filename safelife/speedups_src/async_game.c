@@ -0,0 +1,63 @@
+/*
+    Physics for AsyncGame, which updates one randomly chosen cell at a time.
+
+    Each update picks a column and then a row, and sets the cell to either
+    life or empty with a probability determined by the energy rules, the
+    temperature, and any spawners in the neighborhood. Random numbers are
+    drawn in the same order and with the same algorithms as the numpy
+    implementation that this replaces, so results are identical given the
+    same generator.
+*/
+
+#include <math.h>
+#include "async_game.h"
+#include "constants.h"
+
+
+// Neighbor offsets (dy, dx) for the Von Neumann, hexagonal, and Moore
+// neighborhoods.
+static const int von_neumann[4][2] = {{-1, 0}, {0, -1}, {0, 1}, {1, 0}};
+static const int hexagonal[6][2] = {
+    {-1, 0}, {-1, 1}, {0, -1}, {0, 1}, {1, -1}, {1, 0}};
+static const int moore[8][2] = {
+    {-1, -1}, {-1, 0}, {-1, 1}, {0, -1}, {0, 1}, {1, -1}, {1, 0}, {1, 1}};
+
+
+void advance_async_game(
+        uint16_t *board, int nrow, int ncol, double *energy_rules, int n_neighbors,
+        double temperature, double spawn_prob, int64_t n_updates, bitgen_t *rng) {
+    /*
+    Perform n_updates single-cell updates on the board in place.
+
+    The energy rules have shape (2, n_neighbors + 1). The first row applies
+    to live cells and the second to dead cells, indexed by the number of
+    live neighbors. n_neighbors must be 4, 6, or 8.
+    */
+    const int (*offsets)[2] =
+        n_neighbors == 4 ? von_neumann : n_neighbors == 6 ? hexagonal : moore;
+    double beta = 1.0 / (temperature > 1e-20 ? temperature : 1e-20);
+
+    for (int64_t k = 0; k < n_updates; k++) {
+        int x = random_int_from(rng, ncol);
+        int y = random_int_from(rng, nrow);
+        uint16_t *cell = board + y * ncol + x;
+        if (*cell & FROZEN) continue;
+
+        int num_alive = 0, num_spawning = 0;
+        uint16_t any_bits = 0;
+        for (int i = 0; i < n_neighbors; i++) {
+            int y1 = (y + offsets[i][0] + nrow) % nrow;
+            int x1 = (x + offsets[i][1] + ncol) % ncol;
+            uint16_t n = board[y1 * ncol + x1];
+            num_alive += n & ALIVE;
+            num_spawning += (n & SPAWNING) > 0;
+            any_bits |= n;
+        }
+        if (any_bits & (PRESERVING | INHIBITING)) continue;
+
+        double H = energy_rules[(*cell & ALIVE ? 0 : n_neighbors + 1) + num_alive];
+        double P = 0.5 + 0.5 * tanh(H * beta);
+        P = 1 - (1 - P) * pow(1 - spawn_prob, num_spawning);
+        *cell = random_float_from(rng) < P ? ALIVE | DESTRUCTIBLE : 0;
+    }
+}
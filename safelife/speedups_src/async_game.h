@@ -0,0 +1,6 @@
+#include <stdint.h>
+#include "random.h"
+
+void advance_async_game(
+    uint16_t *board, int nrow, int ncol, double *energy_rules, int n_neighbors,
+    double temperature, double spawn_prob, int64_t n_updates, bitgen_t *rng);
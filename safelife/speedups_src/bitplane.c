@@ -0,0 +1,352 @@
+/*
+    Bit-plane implementation of the SafeLife physics.
+
+    Rather than working on one uint16 cell at a time, the board is split into
+    separate bit planes (alive, frozen, preserving, etc.) with 64 cells packed
+    into each word. Neighbor counts are then calculated for a whole word at
+    once using bit-sliced adders.
+
+    The results are bit-for-bit identical to advance_board(), including the
+    order in which random numbers are drawn for spawning cells.
+*/
+
+#include <stdlib.h>
+#include <string.h>
+#include "bitplane.h"
+#include "constants.h"
+#include "random.h"
+
+#if defined(_MSC_VER)
+    #include <intrin.h>
+    static int lowest_bit(uint64_t x) {
+        unsigned long idx;
+        _BitScanForward64(&idx, x);
+        return (int)idx;
+    }
+#else
+    static int lowest_bit(uint64_t x) {
+        return __builtin_ctzll(x);
+    }
+#endif
+
+typedef uint64_t word_t;
+
+#define WORD_BITS 64
+#define ALL_BITS (~(word_t)0)
+
+
+enum board_planes {
+    P_ALIVE,
+    P_FROZEN,
+    P_PRESERVING,
+    P_INHIBITING,
+    P_SPAWNING,
+    P_DESTRUCTIBLE,  // destructible *or* exit; see advance_board()
+    P_COLOR_R,
+    P_COLOR_G,
+    P_COLOR_B,
+    P_CHANGED,  // cells that no longer match the input board
+    NUM_BOARD_PLANES
+};
+
+enum neighbor_planes {
+    // Bit-sliced count of live cells in each horizontal triplet
+    N_COUNT0,
+    N_COUNT1,
+    // Any cell in the triplet has the flag (regardless of whether it's alive)
+    N_PRESERVING,
+    N_INHIBITING,
+    N_SPAWNING,
+    // Any live cell / at least two live cells in the triplet have the flag
+    N_ANY_D,
+    N_ANY_R,
+    N_ANY_G,
+    N_ANY_B,
+    N_TWO_D,
+    N_TWO_R,
+    N_TWO_G,
+    N_TWO_B,
+    // Any spawner in the triplet has the color
+    N_SPAWN_R,
+    N_SPAWN_G,
+    N_SPAWN_B,
+    NUM_NEIGHBOR_PLANES
+};
+
+static const uint16_t plane_bits[NUM_BOARD_PLANES - 1] = {
+    ALIVE, FROZEN, PRESERVING, INHIBITING, SPAWNING,
+    DESTRUCTIBLE | EXIT,
+    1 << COLOR_BIT, 2 << COLOR_BIT, 4 << COLOR_BIT
+};
+
+
+typedef struct {
+    int nrow;
+    int ncol;
+    int nw;  // words per row
+    int plane_size;  // words per plane
+    word_t pad_mask;  // valid bits in the last word of each row
+    word_t *board;
+    word_t *neighbors;
+    word_t *tmp;  // three rows of scratch space
+} bitboard_t;
+
+
+size_t bitplane_scratch_size(int nrow, int ncol) {
+    int nw = (ncol + WORD_BITS - 1) / WORD_BITS;
+    return sizeof(word_t) * (
+        (NUM_BOARD_PLANES + NUM_NEIGHBOR_PLANES) * nrow * nw + 3 * nw);
+}
+
+
+static void bitboard_init(bitboard_t *bb, int nrow, int ncol, word_t *mem) {
+    int nw = (ncol + WORD_BITS - 1) / WORD_BITS;
+    int plane_size = nrow * nw;
+    int rem = ncol % WORD_BITS;
+
+    bb->nrow = nrow;
+    bb->ncol = ncol;
+    bb->nw = nw;
+    bb->plane_size = plane_size;
+    bb->pad_mask = rem ? ((word_t)1 << rem) - 1 : ALL_BITS;
+    bb->board = mem;
+    bb->neighbors = bb->board + NUM_BOARD_PLANES * plane_size;
+    bb->tmp = bb->neighbors + NUM_NEIGHBOR_PLANES * plane_size;
+}
+
+
+static void pack_board(bitboard_t *bb, uint16_t *board) {
+    int nw = bb->nw, ncol = bb->ncol;
+    memset(bb->board, 0, sizeof(word_t) * NUM_BOARD_PLANES * bb->plane_size);
+    for (int r = 0; r < bb->nrow; r++) {
+        uint16_t *row = board + r * ncol;
+        for (int c = 0; c < ncol; c++) {
+            uint16_t cell = row[c];
+            if (!cell) continue;
+            int idx = r * nw + c / WORD_BITS;
+            word_t bit = (word_t)1 << (c % WORD_BITS);
+            for (int p = 0; p < NUM_BOARD_PLANES - 1; p++) {
+                if (cell & plane_bits[p]) {
+                    bb->board[p * bb->plane_size + idx] |= bit;
+                }
+            }
+        }
+    }
+}
+
+
+static void unpack_board(bitboard_t *bb, uint16_t *b1, uint16_t *b2) {
+    // Cells that have never changed are copied straight from the input.
+    // Cells that have changed are always either empty or plain life.
+    int nw = bb->nw, ncol = bb->ncol, ps = bb->plane_size;
+    for (int r = 0; r < bb->nrow; r++) {
+        for (int k = 0; k < nw; k++) {
+            int idx = r * nw + k;
+            int c0 = k * WORD_BITS;
+            int c1 = c0 + WORD_BITS < ncol ? c0 + WORD_BITS : ncol;
+            uint16_t *src = b1 + r * ncol;
+            uint16_t *dst = b2 + r * ncol;
+            word_t changed = bb->board[P_CHANGED * ps + idx];
+            if (!changed) {
+                if (src != dst) {
+                    memcpy(dst + c0, src + c0, sizeof(uint16_t) * (c1 - c0));
+                }
+                continue;
+            }
+            for (int c = c0; c < c1; c++) {
+                word_t bit = (word_t)1 << (c - c0);
+                if (!(changed & bit)) {
+                    dst[c] = src[c];
+                } else if (bb->board[P_ALIVE * ps + idx] & bit) {
+                    uint16_t cell = ALIVE;
+                    if (bb->board[P_DESTRUCTIBLE * ps + idx] & bit)
+                        cell |= DESTRUCTIBLE;
+                    for (int p = P_COLOR_R; p <= P_COLOR_B; p++) {
+                        if (bb->board[p * ps + idx] & bit)
+                            cell |= plane_bits[p];
+                    }
+                    dst[c] = cell;
+                } else {
+                    dst[c] = 0;
+                }
+            }
+        }
+    }
+}
+
+
+static void shift_row(
+        const word_t *x, word_t *west, word_t *east, int nw, int ncol,
+        word_t pad_mask) {
+    // Bit c in 'west' gets the value of the cell to the west of c (c-1),
+    // and bit c in 'east' gets the value of the cell to the east (c+1).
+    // Edges wrap.
+    int last_bit = (ncol - 1) % WORD_BITS;
+    for (int k = 0; k < nw; k++) {
+        west[k] = (x[k] << 1) | (k > 0 ? x[k-1] >> (WORD_BITS-1) : 0);
+        east[k] = (x[k] >> 1) | (k < nw-1 ? x[k+1] << (WORD_BITS-1) : 0);
+    }
+    west[0] |= (x[nw-1] >> last_bit) & 1;
+    east[nw-1] |= (x[0] & 1) << last_bit;
+    west[nw-1] &= pad_mask;
+}
+
+
+static void row_neighbors(bitboard_t *bb, int r) {
+    // Combine each cell with its horizontal neighbors.
+    int nw = bb->nw, ps = bb->plane_size, k;
+    word_t *west = bb->tmp, *east = bb->tmp + nw, *x = bb->tmp + 2*nw;
+    word_t *plane = bb->board + r * nw;
+    word_t *out = bb->neighbors + r * nw;
+    const word_t *alive = plane + P_ALIVE * ps;
+    const word_t *spawning = plane + P_SPAWNING * ps;
+
+    // Live cell count, stored as a two-bit number.
+    shift_row(alive, west, east, nw, bb->ncol, bb->pad_mask);
+    for (k = 0; k < nw; k++) {
+        word_t a = alive[k];
+        out[N_COUNT0 * ps + k] = west[k] ^ a ^ east[k];
+        out[N_COUNT1 * ps + k] = (west[k] & a) | (east[k] & (west[k] ^ a));
+    }
+
+    // Flags that apply whether or not the cell is alive.
+    for (int p = 0; p < 3; p++) {
+        const word_t *src = plane + (P_PRESERVING + p) * ps;
+        word_t *dst = out + (N_PRESERVING + p) * ps;
+        shift_row(src, west, east, nw, bb->ncol, bb->pad_mask);
+        for (k = 0; k < nw; k++) {
+            dst[k] = west[k] | src[k] | east[k];
+        }
+    }
+
+    // Flags that are only inherited from live cells.
+    for (int p = 0; p < 4; p++) {
+        const word_t *src = plane + (P_DESTRUCTIBLE + p) * ps;
+        word_t *any = out + (N_ANY_D + p) * ps;
+        word_t *two = out + (N_TWO_D + p) * ps;
+        for (k = 0; k < nw; k++) {
+            x[k] = src[k] & alive[k];
+        }
+        shift_row(x, west, east, nw, bb->ncol, bb->pad_mask);
+        for (k = 0; k < nw; k++) {
+            any[k] = west[k] | x[k] | east[k];
+            two[k] = (west[k] & x[k]) | (east[k] & (west[k] ^ x[k]));
+        }
+    }
+
+    // Spawner colors, which count double.
+    for (int p = 0; p < 3; p++) {
+        const word_t *src = plane + (P_COLOR_R + p) * ps;
+        word_t *dst = out + (N_SPAWN_R + p) * ps;
+        for (k = 0; k < nw; k++) {
+            x[k] = src[k] & spawning[k];
+        }
+        shift_row(x, west, east, nw, bb->ncol, bb->pad_mask);
+        for (k = 0; k < nw; k++) {
+            dst[k] = west[k] | x[k] | east[k];
+        }
+    }
+}
+
+
+static void update_row(bitboard_t *bb, int r, float spawn_prob, bitgen_t *rng) {
+    // Combine the horizontal triplets vertically and apply the rules.
+    // Updates happen in place, which is fine since the neighbor planes
+    // have already been calculated for every row.
+    int nw = bb->nw, ps = bb->plane_size;
+    const word_t *nu = bb->neighbors + ((r + bb->nrow - 1) % bb->nrow) * nw;
+    const word_t *nc = bb->neighbors + r * nw;
+    const word_t *nd = bb->neighbors + ((r + 1) % bb->nrow) * nw;
+    word_t *plane = bb->board + r * nw;
+
+    #define NB_ANY(p) (nu[(p)*ps + k] | nc[(p)*ps + k] | nd[(p)*ps + k])
+    #define NB_TWO(any, two) ( \
+        NB_ANY(two) | \
+        (nu[(any)*ps + k] & nc[(any)*ps + k]) | \
+        (nu[(any)*ps + k] & nd[(any)*ps + k]) | \
+        (nc[(any)*ps + k] & nd[(any)*ps + k]))
+    #define MAJ(a, b, c) (((a) & (b)) | ((c) & ((a) ^ (b))))
+
+    for (int k = 0; k < nw; k++) {
+        word_t valid = k == nw-1 ? bb->pad_mask : ALL_BITS;
+
+        // Add up three two-bit numbers to get a four-bit count (0-9).
+        word_t a0 = nu[N_COUNT0*ps + k], a1 = nu[N_COUNT1*ps + k];
+        word_t b0 = nc[N_COUNT0*ps + k], b1 = nc[N_COUNT1*ps + k];
+        word_t c0 = nd[N_COUNT0*ps + k], c1 = nd[N_COUNT1*ps + k];
+        word_t s0 = a0 ^ b0 ^ c0;
+        word_t carry = MAJ(a0, b0, c0);
+        word_t t0 = a1 ^ b1 ^ c1;
+        word_t k1 = MAJ(a1, b1, c1);
+        word_t s1 = t0 ^ carry;
+        word_t k2 = t0 & carry;
+        word_t s2 = k1 ^ k2;
+        word_t s3 = k1 & k2;
+        // Note that live cells count as their own neighbors.
+        word_t is3 = s0 & s1 & ~s2 & ~s3;
+        word_t is4 = ~s0 & ~s1 & s2 & ~s3;
+
+        word_t alive = plane[P_ALIVE*ps + k];
+        word_t frozen = plane[P_FROZEN*ps + k];
+        word_t can_grow = ~alive & ~frozen & ~NB_ANY(N_INHIBITING) & valid;
+        word_t kill = alive & ~frozen & ~NB_ANY(N_PRESERVING) & ~(is3 | is4);
+        word_t born = can_grow & is3;
+        word_t spawn = can_grow & ~is3 & NB_ANY(N_SPAWNING);
+
+        // Random numbers must be drawn in the same order as advance_board(),
+        // which is fine since we're moving through the board in order.
+        word_t spawned = 0;
+        while (spawn) {
+            word_t bit = (word_t)1 << lowest_bit(spawn);
+            if (random_float_from(rng) < spawn_prob) spawned |= bit;
+            spawn &= spawn - 1;
+        }
+
+        word_t changed = kill | born | spawned;
+        if (!changed) continue;
+
+        word_t new_cells = born | spawned;
+        plane[P_ALIVE*ps + k] = (alive & ~kill) | new_cells;
+        plane[P_FROZEN*ps + k] &= ~changed;
+        plane[P_PRESERVING*ps + k] &= ~changed;
+        plane[P_INHIBITING*ps + k] &= ~changed;
+        plane[P_SPAWNING*ps + k] &= ~changed;
+        plane[P_DESTRUCTIBLE*ps + k] =
+            (plane[P_DESTRUCTIBLE*ps + k] & ~changed) |
+            (born & NB_TWO(N_ANY_D, N_TWO_D)) | spawned;
+        for (int p = 0; p < 3; p++) {
+            word_t twice =
+                NB_TWO(N_ANY_R + p, N_TWO_R + p) | NB_ANY(N_SPAWN_R + p);
+            plane[(P_COLOR_R + p)*ps + k] =
+                (plane[(P_COLOR_R + p)*ps + k] & ~changed) | (new_cells & twice);
+        }
+        plane[P_CHANGED*ps + k] |= changed;
+    }
+
+    #undef NB_ANY
+    #undef NB_TWO
+    #undef MAJ
+}
+
+
+void advance_board_bitplane(
+        uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob,
+        int n_steps, bitgen_t *rng, workspace_t *ws) {
+    // Note that b1 and b2 can point to the same board.
+    bitboard_t bb;
+    size_t mem_size = bitplane_scratch_size(nrow, ncol);
+    word_t *mem = ws ? workspace_reserve(ws, mem_size) : malloc(mem_size);
+    if (!mem) return;
+    bitboard_init(&bb, nrow, ncol, mem);
+    pack_board(&bb, b1);
+    for (int step_idx = 0; step_idx < n_steps; step_idx++) {
+        for (int r = 0; r < nrow; r++) {
+            row_neighbors(&bb, r);
+        }
+        for (int r = 0; r < nrow; r++) {
+            update_row(&bb, r, spawn_prob, rng);
+        }
+    }
+    unpack_board(&bb, b1, b2);
+    if (!ws) free(mem);
+}
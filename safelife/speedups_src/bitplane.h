@@ -0,0 +1,9 @@
+#include <stdint.h>
+#include "workspace.h"
+#include "random.h"
+
+size_t bitplane_scratch_size(int nrow, int ncol);
+
+void advance_board_bitplane(
+    uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob, int n_steps,
+    bitgen_t *rng, workspace_t *ws);
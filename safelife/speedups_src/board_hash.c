@@ -0,0 +1,53 @@
+/*
+    Zobrist hashing of boards.
+
+    Each (cell index, cell value) pair gets a pseudo-random 64-bit key, and
+    the hash of a board is the xor of the keys of all of its cells. Changing
+    a single cell just means xoring out its old key and xoring in its new
+    one, so the hash can be kept up to date as the board changes without
+    ever looking at the whole board again. The salt distinguishes different
+    kinds of arrays (board, goals, agent locations) that are hashed together.
+*/
+
+#include <string.h>
+#include "board_hash.h"
+
+
+uint64_t board_hash(uint16_t *board, int64_t n, uint64_t salt) {
+    uint64_t hash = 0;
+    for (int64_t i = 0; i < n; i++) {
+        hash ^= zobrist_key(i, board[i], salt);
+    }
+    return hash;
+}
+
+
+uint64_t board_hash_cells(
+        uint16_t *board, int64_t *cells, int64_t n_cells, uint64_t salt) {
+    // Combined keys of just the given (flat) cell indices.
+    uint64_t hash = 0;
+    for (int64_t k = 0; k < n_cells; k++) {
+        hash ^= zobrist_key(cells[k], board[cells[k]], salt);
+    }
+    return hash;
+}
+
+
+uint64_t update_board_hash(
+        uint16_t *b1, uint16_t *b2, int nrow, int ncol, uint64_t salt,
+        uint64_t hash) {
+    /*
+    Turn the hash of board b1 into the hash of board b2.
+
+    As with update_counts, unchanged rows are skipped with a memcmp.
+    */
+    for (int i = 0; i < nrow*ncol; i += ncol) {
+        if (!memcmp(b1 + i, b2 + i, ncol * sizeof(uint16_t))) continue;
+        for (int j = i; j < i + ncol; j++) {
+            if (b1[j] != b2[j]) {
+                hash ^= zobrist_key(j, b1[j], salt) ^ zobrist_key(j, b2[j], salt);
+            }
+        }
+    }
+    return hash;
+}
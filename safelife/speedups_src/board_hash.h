@@ -0,0 +1,21 @@
+#include <stdint.h>
+
+static inline uint64_t zobrist_key(int64_t idx, uint16_t val, uint64_t salt) {
+    // Pseudo-random key for a cell value at a flat index (splitmix64).
+    // Empty cells don't contribute to the hash.
+    if (!val) return 0;
+    uint64_t z = (salt * 0x9E3779B97F4A7C15ULL) ^ (((uint64_t)idx << 16) | val);
+    z += 0x9E3779B97F4A7C15ULL;
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+uint64_t board_hash(uint16_t *board, int64_t n, uint64_t salt);
+
+uint64_t board_hash_cells(
+    uint16_t *board, int64_t *cells, int64_t n_cells, uint64_t salt);
+
+uint64_t update_board_hash(
+    uint16_t *b1, uint16_t *b2, int nrow, int ncol, uint64_t salt,
+    uint64_t hash);
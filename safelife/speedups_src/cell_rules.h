@@ -0,0 +1,88 @@
+#ifndef SAFELIFE_CELL_RULES_H
+#define SAFELIFE_CELL_RULES_H
+
+/*
+    Per-cell physics rules shared by the dense and tiled engines.
+
+    Neighborhoods are accumulated into a single uint16 per cell: the low four
+    bits count live cells (including the cell itself), FLAGS1 records any
+    nearby preserving / inhibiting / spawning cells, FLAGS2 records colors
+    (and destructibility, shifted onto the exit bit) of any live neighbors,
+    and FLAGS2 << 4 records attributes shared by at least two live neighbors.
+*/
+
+#include <stdint.h>
+#include "constants.h"
+#include "random.h"
+
+static const uint16_t ALIVE_BITS = (1 << 4) - 1;
+static const uint16_t DESTRUCTIBLE2 = 1 << 8;
+static const uint16_t FLAGS1 = PRESERVING | INHIBITING | SPAWNING;
+static const uint16_t FLAGS2 = (1 << 8) | COLORS;
+
+
+static inline uint16_t neighbor_bits(uint16_t cell) {
+    // Move the destructible bit onto the exit bit so that destructibility
+    // can be treated the same as colors.
+    return cell | (cell & DESTRUCTIBLE) << 5;
+}
+
+
+static inline void combine_neighbors(uint16_t src, uint16_t *dst) {
+    // Combine neighbors with base board.
+    uint16_t alive = src & ALIVE;
+    uint16_t src_flags1 = src & FLAGS1;
+    uint16_t src_flags2 = (src & FLAGS2) * alive;
+    uint16_t dst_flags2 = *dst & FLAGS2;
+    *dst |= (dst_flags2 & src_flags2) << 4;
+    *dst |= ((src & COLORS) << 4) * ((src & SPAWNING) > 0);
+    *dst |= src_flags1;
+    *dst |= src_flags2;
+    *dst += alive;
+}
+
+
+static inline void combine_neighbors2(uint16_t src, uint16_t *dst) {
+    // Combine combinations.
+    *dst |= (*dst & src & FLAGS2) << 4;
+    *dst |= src & (FLAGS1 | FLAGS2 | (FLAGS2 << 4));
+    *dst += src & ALIVE_BITS;
+
+}
+
+
+static inline uint16_t next_cell(
+        uint16_t cell, uint16_t nbrs, float spawn_prob, bitgen_t *rng) {
+    // Apply the rules of life to a single cell given its combined neighbors.
+    // Only draws a random number if the cell is a candidate for spawning.
+    uint16_t num_alive = nbrs & ALIVE_BITS;
+    if (cell & ALIVE) {
+        // Note that if it's alive, it counts as its own neighbor.
+        if (cell & FROZEN || nbrs & PRESERVING ||
+            num_alive == 3 || num_alive == 4) {
+            // copy the old cell
+            return cell;
+        } else {
+            // kill the cell
+            return 0;
+        }
+    } else {  // starts dead
+        if (cell & FROZEN || nbrs & INHIBITING) {
+            // copy the old cell
+            return cell;
+        } else if (num_alive == 3) {
+            // add a new live cell
+            return ALIVE |
+                ((nbrs & (COLORS << 4)) >> 4) |
+                ((nbrs & (DESTRUCTIBLE2 << 4)) >> 9);
+        } else if (nbrs & SPAWNING && random_float_from(rng) < spawn_prob) {
+            // add a spawned cell
+            return ALIVE | DESTRUCTIBLE | ((nbrs & (COLORS << 4)) >> 4);
+        } else {
+            // copy the old cell
+            return cell;
+        }
+    }
+}
+
+#endif
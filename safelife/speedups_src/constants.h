@@ -1,3 +1,6 @@
+#ifndef SAFELIFE_CONSTANTS_H
+#define SAFELIFE_CONSTANTS_H
+
 #include <stdint.h>
 
 
@@ -32,3 +35,4 @@ enum cell_types {
     ORIENTATION_MASK = 3 << ORIENTATION_BIT,
 };
 
+#endif
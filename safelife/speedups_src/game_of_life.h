@@ -0,0 +1,7 @@
+#include <stdint.h>
+#include "random.h"
+
+void advance_game_of_life(
+    uint16_t *b1, uint16_t *b2, int nrow, int ncol,
+    uint16_t born_mask, uint16_t survive_mask, double spawn_prob,
+    bitgen_t *rng);
@@ -2,6 +2,12 @@
 #include <Python.h>
 #include <numpy/arrayobject.h>
 #include "advance_board.h"
+#include "step_game.h"
+#include "tiled.h"
+#include "board_hash.h"
+#include "observation.h"
+#include "game_of_life.h"
+#include "async_game.h"
 #include "gen_board.h"
 #include "wrapped_label.h"
 #include "random.h"
@@ -17,45 +23,874 @@ static PyObject *BadProbabilityException;
 static PyObject *InsufficientAreaException;
 
 
-static PyObject *advance_board_py(PyObject *self, PyObject *args) {
-    PyObject *board_obj;
-    PyArrayObject *b1, *b2;
+static int parse_engine(const char *name, int *engine) {
+    if (strcmp(name, "dense") == 0) {
+        *engine = ENGINE_DENSE;
+    } else if (strcmp(name, "bitplane") == 0) {
+        *engine = ENGINE_BITPLANE;
+    } else if (strcmp(name, "tiled") == 0) {
+        *engine = ENGINE_TILED;
+    } else {
+        PyErr_Format(PyExc_ValueError, "Unknown engine '%s'.", name);
+        return 0;
+    }
+    return 1;
+}
+
+
+/* ---- Workspace type ---- */
+
+typedef struct {
+    PyObject_HEAD
+    workspace_t ws;
+    int in_use;
+    PyObject *last_input;   // arrays passed to the last tiled engine call
+    PyObject *last_output;
+} WorkspaceObject;
+
+
+static void Workspace_dealloc(WorkspaceObject *self) {
+    workspace_release(&self->ws);
+    Py_CLEAR(self->last_input);
+    Py_CLEAR(self->last_output);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+
+static PyObject *Workspace_reduce(WorkspaceObject *self, PyObject *unused) {
+    // Scratch memory isn't worth pickling. Unpickle as a new, empty workspace.
+    return Py_BuildValue("(O())", (PyObject *)Py_TYPE(self));
+}
+
+
+static PyObject *Workspace_reset(WorkspaceObject *self, PyObject *unused) {
+    if (self->in_use) {
+        PyErr_SetString(PyExc_RuntimeError, "Workspace is already in use.");
+        return NULL;
+    }
+    tiled_reset(&self->ws);
+    Py_CLEAR(self->last_input);
+    Py_CLEAR(self->last_output);
+    Py_RETURN_NONE;
+}
+
+
+static PyObject *Workspace_mark_changed(
+        WorkspaceObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *cells_obj;
+    PyArrayObject *cells;
+    static char *kwlist[] = {"board", "cells", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OO:mark_changed", kwlist, &board_obj, &cells_obj))
+        return NULL;
+    if (self->in_use) {
+        PyErr_SetString(PyExc_RuntimeError, "Workspace is already in use.");
+        return NULL;
+    }
+    if (board_obj != self->last_output) {
+        // The next call will start from scratch anyway.
+        Py_RETURN_NONE;
+    }
+    cells = (PyArrayObject *)PyArray_FROM_OTF(
+        cells_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!cells) return NULL;
+    PyArrayObject *board = (PyArrayObject *)board_obj;
+    int nrow = PyArray_DIM(board, 0), ncol = PyArray_DIM(board, 1);
+    int64_t *idx = (int64_t *)PyArray_DATA(cells);
+    for (npy_intp k = 0; k < PyArray_SIZE(cells); k++) {
+        if (idx[k] < 0 || idx[k] >= (int64_t)nrow * ncol) {
+            PyErr_SetString(PyExc_IndexError, "Cell index out of bounds.");
+            Py_DECREF(cells);
+            return NULL;
+        }
+        tiled_mark_cell(&self->ws, nrow, ncol, idx[k]);
+    }
+    Py_DECREF(cells);
+    Py_RETURN_NONE;
+}
+
+
+static PyObject *Workspace_get_nbytes(WorkspaceObject *self, void *closure) {
+    return PyLong_FromSize_t(self->ws.size);
+}
+
+
+static PyMethodDef Workspace_methods[] = {
+    {"__reduce__", (PyCFunction)Workspace_reduce, METH_NOARGS, NULL},
+    {
+        "reset", (PyCFunction)Workspace_reset, METH_NOARGS,
+        "reset()\n--\n\n"
+        "Forget everything the tiled engine knows about the last board.\n"
+    },
+    {
+        "mark_changed", (PyCFunction)(void(*)(void))Workspace_mark_changed,
+        METH_VARARGS | METH_KEYWORDS,
+        "mark_changed(board, cells)\n--\n\n"
+        "Note that cells of a board were changed in between calls.\n"
+        "\n"
+        "The tiled engine only recomputes the parts of a board that could\n"
+        "have changed, so any edits made to the output of its last call\n"
+        "need to be reported before the board is advanced again. Edits to\n"
+        "any other array are ignored.\n"
+        "\n"
+        "Parameters\n"
+        "----------\n"
+        "board : ndarray\n"
+        "cells : ndarray\n"
+        "    Flat indices of the changed cells.\n"
+    },
+    {NULL, NULL, 0, NULL}
+};
+
+
+static PyGetSetDef Workspace_getset[] = {
+    {
+        "nbytes", (getter)Workspace_get_nbytes, NULL,
+        "Number of bytes of scratch memory currently held.", NULL
+    },
+    {NULL}
+};
+
+
+static PyTypeObject WorkspaceType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "safelife.speedups.Workspace",
+    .tp_doc =
+        "Workspace()\n--\n\n"
+        "Reusable scratch memory for the physics functions.\n"
+        "\n"
+        "Passing the same workspace to repeated calls of e.g. `advance_board`\n"
+        "avoids allocating and freeing temporary buffers on every call. The\n"
+        "memory grows as needed and is freed when the workspace is deleted.\n"
+        "A workspace can only be used by one call at a time.\n"
+        "\n"
+        "The 'tiled' engine also uses the workspace to remember which parts\n"
+        "of the board are active, and which arrays it last advanced. See\n"
+        "`mark_changed` and `reset`.\n",
+    .tp_basicsize = sizeof(WorkspaceObject),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = PyType_GenericNew,
+    .tp_dealloc = (destructor)Workspace_dealloc,
+    .tp_methods = Workspace_methods,
+    .tp_getset = Workspace_getset,
+};
+
+
+static int acquire_workspace(PyObject *obj, workspace_t **ws) {
+    // Mark the workspace as in use. Must be called while holding the GIL.
+    *ws = NULL;
+    if (!obj || obj == Py_None) return 1;
+    if (!PyObject_TypeCheck(obj, &WorkspaceType)) {
+        PyErr_SetString(PyExc_TypeError, "Expected a Workspace instance.");
+        return 0;
+    }
+    if (((WorkspaceObject *)obj)->in_use) {
+        PyErr_SetString(PyExc_RuntimeError, "Workspace is already in use.");
+        return 0;
+    }
+    ((WorkspaceObject *)obj)->in_use = 1;
+    *ws = &((WorkspaceObject *)obj)->ws;
+    return 1;
+}
+
+
+static void release_workspace(PyObject *obj) {
+    if (obj && obj != Py_None) {
+        ((WorkspaceObject *)obj)->in_use = 0;
+    }
+}
+
+
+static void track_workspace_arrays(
+        PyObject *obj, int engine, PyArrayObject *input, PyArrayObject *output) {
+    /*
+    Remember the arrays that an acquired workspace is being used with.
+
+    The tiled engine assumes that its input is its last output (plus any
+    edits reported with `mark_changed`), so it needs to start from scratch
+    if it isn't. If the output array holds its last input, only the parts
+    that have changed since then need to be copied into it.
+    */
+    if (!obj || obj == Py_None) return;
+    WorkspaceObject *self = (WorkspaceObject *)obj;
+    if (engine != ENGINE_TILED) {
+        Py_CLEAR(self->last_input);
+        Py_CLEAR(self->last_output);
+        return;
+    }
+    if ((PyObject *)input != self->last_output) tiled_reset(&self->ws);
+    self->ws.output_is_previous_input =
+        (PyObject *)output == self->last_input && output != input;
+    Py_INCREF(input);
+    Py_INCREF(output);
+    Py_XSETREF(self->last_input, (PyObject *)input);
+    Py_XSETREF(self->last_output, (PyObject *)output);
+}
+
+
+/* ---- Random number generators ---- */
+
+typedef struct {
+    int n;
+    int n_locked;
+    bitgen_t **states;
+    PyObject **locks;
+    PyObject *global;  // reference to the global generator, if used
+} rng_list_t;
+
+
+static bitgen_t *get_bitgen(PyObject *obj, PyObject **lock) {
+    // Find the bit generator state (and its lock) for either a numpy
+    // Generator or a BitGenerator. Returns a new reference to the lock.
+    PyObject *bitgen = NULL, *capsule = NULL;
+    bitgen_t *state = NULL;
+    *lock = NULL;
+    if (PyObject_HasAttrString(obj, "bit_generator")) {
+        bitgen = PyObject_GetAttrString(obj, "bit_generator");
+    } else {
+        bitgen = obj;
+        Py_INCREF(bitgen);
+    }
+    if (bitgen &&
+            (capsule = PyObject_GetAttrString(bitgen, "capsule")) &&
+            (*lock = PyObject_GetAttrString(bitgen, "lock"))) {
+        state = PyCapsule_GetPointer(capsule, "BitGenerator");
+    }
+    Py_XDECREF(bitgen);
+    Py_XDECREF(capsule);
+    if (!state) {
+        Py_CLEAR(*lock);
+        PyErr_Clear();
+        PyErr_SetString(PyExc_TypeError,
+            "Expected a numpy Generator or BitGenerator.");
+    }
+    return state;
+}
+
+
+static void release_rngs(rng_list_t *rngs) {
+    // Must be called while holding the GIL.
+    for (int k = 0; k < rngs->n_locked; k++) {
+        PyObject *result = PyObject_CallMethod(rngs->locks[k], "release", NULL);
+        Py_XDECREF(result);
+    }
+    for (int k = 0; rngs->locks && k < rngs->n; k++) {
+        Py_XDECREF(rngs->locks[k]);
+    }
+    Py_CLEAR(rngs->global);
+    free(rngs->states);
+    free(rngs->locks);
+    rngs->states = NULL;
+    rngs->locks = NULL;
+    rngs->n = rngs->n_locked = 0;
+}
+
+
+static int acquire_rngs(PyObject *obj, int n_boards, rng_list_t *rngs) {
+    /*
+    Parse an 'rng' argument into a list of bit generators.
+
+    None selects the global generator (see `set_bit_generator`). Otherwise
+    this should be a numpy Generator or BitGenerator or, if n_boards > 0, a
+    sequence of one generator per board. Each generator is locked until
+    `release_rngs` is called so that it can be used without the GIL. The
+    global generator is also kept alive until then, even if it's replaced.
+    Must be called while holding the GIL.
+    */
+    PyObject *seq = NULL;
+    int n = 1;
+    rngs->n = rngs->n_locked = 0;
+    rngs->states = NULL;
+    rngs->locks = NULL;
+    rngs->global = NULL;
+    if (n_boards > 0 && obj != Py_None && PySequence_Check(obj)) {
+        seq = PySequence_Fast(obj, "Expected a sequence of generators.");
+        if (!seq) return 0;
+        n = PySequence_Fast_GET_SIZE(seq);
+        if (n != n_boards)
+            PY_VAL_ERROR("Expected one random generator per board.");
+    }
+    rngs->states = calloc(n, sizeof(bitgen_t *));
+    rngs->locks = calloc(n, sizeof(PyObject *));
+    rngs->n = n;
+    if (!rngs->states || !rngs->locks) {
+        PyErr_NoMemory();
+        goto error;
+    }
+    if (obj == Py_None) {
+        if (!(rngs->global = random_global_generator())) goto error;
+        obj = rngs->global;
+    }
+    for (int k = 0; k < n; k++) {
+        PyObject *item = seq ? PySequence_Fast_GET_ITEM(seq, k) : obj;
+        if (!(rngs->states[k] = get_bitgen(item, rngs->locks + k))) goto error;
+        for (int j = 0; j < k; j++) {
+            if (rngs->states[j] == rngs->states[k])
+                PY_VAL_ERROR("Each board needs its own random generator.");
+        }
+    }
+    for (; rngs->n_locked < n; rngs->n_locked++) {
+        PyObject *result = PyObject_CallMethod(
+            rngs->locks[rngs->n_locked], "acquire", NULL);
+        if (!result) goto error;
+        Py_DECREF(result);
+    }
+    Py_XDECREF(seq);
+    return 1;
+
+    error:
+    Py_XDECREF(seq);
+    release_rngs(rngs);
+    return 0;
+}
+
+
+static PyArrayObject *output_array(PyObject *out_obj, PyArrayObject *like) {
+    /*
+    Either create a new uint16 array with the same shape as 'like', or check
+    that 'out_obj' is suitable for storing the output. Returns a new reference.
+    */
+    PyArrayObject *out;
+    int ndim = PyArray_NDIM(like);
+    if (!out_obj || out_obj == Py_None) {
+        return (PyArrayObject *)PyArray_SimpleNew(
+            ndim, PyArray_DIMS(like), NPY_UINT16);
+    }
+    if (!PyArray_Check(out_obj)) {
+        PyErr_SetString(PyExc_ValueError, "Output must be a numpy array.");
+        return NULL;
+    }
+    out = (PyArrayObject *)out_obj;
+    if (PyArray_TYPE(out) != NPY_UINT16 || !PyArray_ISCARRAY(out)) {
+        PyErr_SetString(PyExc_ValueError,
+            "Output must be a writeable, C-contiguous uint16 array.");
+        return NULL;
+    }
+    if (PyArray_NDIM(out) != ndim ||
+            !PyArray_CompareLists(PyArray_DIMS(out), PyArray_DIMS(like), ndim)) {
+        PyErr_SetString(PyExc_ValueError,
+            "Output must have the same shape as the input.");
+        return NULL;
+    }
+    if (PyArray_DATA(out) == PyArray_DATA(like)) {
+        PyErr_SetString(PyExc_ValueError,
+            "Output must not overlap with the input.");
+        return NULL;
+    }
+    Py_INCREF(out);
+    return out;
+}
+
+
+static int count_arrays(
+        PyObject *goals_obj, PyObject *counts_obj, PyArrayObject *board,
+        npy_intp n_boards, PyArrayObject **goals, PyArrayObject **counts) {
+    /*
+    Convert the optional goals and alive counts that get updated along with
+    a board (or a stack of n_boards boards). Both are set to NULL if there
+    are no counts. Returns 0 on error.
+    */
+    *goals = *counts = NULL;
+    if (counts_obj == Py_None) return 1;
+    if (goals_obj == Py_None) {
+        PyErr_SetString(PyExc_ValueError,
+            "Goals are needed to update the alive counts.");
+        return 0;
+    }
+    *goals = (PyArrayObject *)PyArray_FROM_OTF(
+        goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!*goals) return 0;
+    if (PyArray_NDIM(*goals) != PyArray_NDIM(board) || !PyArray_CompareLists(
+            PyArray_DIMS(*goals), PyArray_DIMS(board), PyArray_NDIM(board))) {
+        PyErr_SetString(PyExc_ValueError, "Board and goals must have same shape.");
+        goto error;
+    }
+    *counts = (PyArrayObject *)PyArray_FROM_OTF(
+        counts_obj, NPY_INT64, NPY_ARRAY_INOUT_ARRAY2);
+    if (!*counts) goto error;
+    if (PyArray_SIZE(*counts) != 72 * n_boards) {
+        PyErr_SetString(PyExc_ValueError, n_boards == 1 ?
+            "Counts should have shape (8, 9)." :
+            "Counts should have shape (N, 8, 9).");
+        PyArray_DiscardWritebackIfCopy(*counts);
+        goto error;
+    }
+    return 1;
+
+    error:
+    Py_CLEAR(*goals);
+    Py_CLEAR(*counts);
+    return 0;
+}
+
+
+static int hash_array(PyObject *hash_obj, PyArrayObject **hash) {
+    /*
+    Convert the optional board hash that gets updated along with a board.
+    Set to NULL if there is no hash. Returns 0 on error.
+    */
+    *hash = NULL;
+    if (hash_obj == Py_None) return 1;
+    *hash = (PyArrayObject *)PyArray_FROM_OTF(
+        hash_obj, NPY_UINT64, NPY_ARRAY_INOUT_ARRAY2);
+    if (!*hash) return 0;
+    if (PyArray_SIZE(*hash) != 1) {
+        PyErr_SetString(PyExc_ValueError, "Hash should have shape (1,).");
+        PyArray_DiscardWritebackIfCopy(*hash);
+        Py_CLEAR(*hash);
+        return 0;
+    }
+    return 1;
+}
+
+
+static char advance_board_doc[] =
+    "advance_board(board, spawn_prob=0.3, n_steps=1, engine='dense', "
+        "out=None, workspace=None, rng=None, goals=None, counts=None, "
+        "hash=None)\n--\n\n"
+    "Advance the board one or more steps.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "spawn_prob : float\n"
+    "n_steps : int\n"
+    "engine : str\n"
+    "    One of 'dense', which operates on one cell at a time; 'bitplane',\n"
+    "    which packs the board into 64-bit words and advances many cells at\n"
+    "    once; or 'tiled', which only recomputes the parts of the board that\n"
+    "    could have changed since the previous step. All produce identical\n"
+    "    results. The 'tiled' engine is only incremental across calls if it's\n"
+    "    given a workspace, and each board being advanced should then have\n"
+    "    its own workspace. Its cost then scales with the activity on the\n"
+    "    board rather than its size, provided that each call is passed the\n"
+    "    output of the previous one and any edits in between are reported\n"
+    "    with `Workspace.mark_changed`. Passing the previous input as `out`\n"
+    "    (i.e., double buffering) avoids copying the whole board.\n"
+    "out : ndarray, optional\n"
+    "    Contiguous uint16 array in which to store the result. Must have the\n"
+    "    same shape as the board, but must not be the same array.\n"
+    "workspace : Workspace, optional\n"
+    "    Scratch memory to reuse between calls.\n"
+    "rng : numpy.random.Generator or BitGenerator, optional\n"
+    "    Source of randomness for spawners. Defaults to the global generator\n"
+    "    set by `set_bit_generator`, which isn't safe to use from several\n"
+    "    threads at once. An explicit generator is locked for the duration\n"
+    "    of the call.\n"
+    "goals : ndarray, optional\n"
+    "counts : ndarray of shape (8, 9), optional\n"
+    "    Alive counts of the board with the given goals (see\n"
+    "    :func:`alive_counts`). If supplied, they're updated in place to\n"
+    "    match the new board by only looking at the cells that changed.\n"
+    "hash : ndarray of shape (1,), uint64, optional\n"
+    "    Hash of the board; see :func:`board_hash`. If supplied, it's updated\n"
+    "    in place to match the new board.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "new_board : ndarray\n"
+    "    The output array, if supplied.\n";
+
+
+static PyObject *advance_board_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *out_obj = Py_None, *ws_obj = Py_None, *rng_obj = Py_None;
+    PyObject *goals_obj = Py_None, *counts_obj = Py_None, *hash_obj = Py_None;
+    PyArrayObject *b1 = NULL, *b2 = NULL, *goals = NULL, *counts = NULL;
+    PyArrayObject *hash = NULL;
+    workspace_t *ws = NULL;
+    rng_list_t rngs = {0};
     float spawn_prob = 0.3;
     int n_step = 1;
+    char *engine_name = "dense";
+    int engine;
+    static char *kwlist[] = {
+        "board", "spawn_prob", "n_steps", "engine", "out", "workspace", "rng",
+        "goals", "counts", "hash", NULL
+    };
 
-    if (!PyArg_ParseTuple(args, "O|fi", &board_obj, &spawn_prob, &n_step))
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|fisOOOOOO:advance_board", kwlist,
+            &board_obj, &spawn_prob, &n_step, &engine_name, &out_obj, &ws_obj,
+            &rng_obj, &goals_obj, &counts_obj, &hash_obj))
         return NULL;
-    board_obj = PyArray_FROM_OTF(
+    if (!parse_engine(engine_name, &engine))
+        return NULL;
+    b1 = (PyArrayObject *)PyArray_FROM_OTF(
         board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
-    if (!board_obj)  return NULL;
-    b1 = (PyArrayObject *)board_obj;
-    if (PyArray_NDIM(b1) != 2 || PyArray_SIZE(b1) == 0) {
-        Py_DECREF(board_obj);
+    if (!b1) return NULL;
+    if (PyArray_NDIM(b1) != 2 || PyArray_SIZE(b1) == 0)
+        PY_VAL_ERROR("Board should be a non-empty two-dimensional array.");
+    if (!(b2 = output_array(out_obj, b1))) goto error;
+    if (!count_arrays(goals_obj, counts_obj, b1, 1, &goals, &counts)) goto error;
+    if (!hash_array(hash_obj, &hash)) goto error;
+    if (!acquire_rngs(rng_obj, 0, &rngs)) goto error;
+    if (!acquire_workspace(ws_obj, &ws)) goto error;
+    track_workspace_arrays(ws_obj, engine, b1, b2);
+
+    Py_BEGIN_ALLOW_THREADS
+    advance_board_engine(
+        (uint16_t *)PyArray_DATA(b1),
+        (uint16_t *)PyArray_DATA(b2),
+        PyArray_DIM(b1, 0),
+        PyArray_DIM(b1, 1),
+        spawn_prob, n_step, engine, rngs.states[0], ws,
+        goals ? (uint16_t *)PyArray_DATA(goals) : NULL,
+        counts ? (int64_t *)PyArray_DATA(counts) : NULL,
+        hash ? (uint64_t *)PyArray_DATA(hash) : NULL
+    );
+    Py_END_ALLOW_THREADS
+
+    release_workspace(ws_obj);
+    release_rngs(&rngs);
+    if (counts) PyArray_ResolveWritebackIfCopy(counts);
+    if (hash) PyArray_ResolveWritebackIfCopy(hash);
+    Py_DECREF(b1);
+    Py_XDECREF(goals);
+    Py_XDECREF(counts);
+    Py_XDECREF(hash);
+    return (PyObject *)b2;
+
+    error:
+    release_rngs(&rngs);
+    if (counts) PyArray_DiscardWritebackIfCopy(counts);
+    if (hash) PyArray_DiscardWritebackIfCopy(hash);
+    Py_XDECREF(b1);
+    Py_XDECREF(b2);
+    Py_XDECREF(goals);
+    Py_XDECREF(counts);
+    Py_XDECREF(hash);
+    return NULL;
+}
+
+
+static char advance_board_batch_doc[] =
+    "advance_board_batch(boards, spawn_probs=0.3, n_steps=1, out=None, "
+        "num_threads=1, engine='dense', workspace=None, rng=None, "
+        "goals=None, counts=None)\n--\n\n"
+    "Advance a stack of same-sized boards in a single call.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "boards : ndarray of shape (N, H, W)\n"
+    "spawn_probs : float or ndarray of shape (N,)\n"
+    "n_steps : int\n"
+    "out : ndarray of shape (N, H, W), optional\n"
+    "    Contiguous uint16 array in which to store the result. Must not\n"
+    "    overlap with the input boards.\n"
+    "num_threads : int\n"
+    "    Number of native threads used to advance the boards. Unless each\n"
+    "    board has its own random generator, boards with spawners are\n"
+    "    advanced in order on the calling thread so that random number\n"
+    "    generation is reproducible.\n"
+    "engine : str\n"
+    "    Either 'dense' or 'bitplane'. See :func:`advance_board`.\n"
+    "workspace : Workspace, optional\n"
+    "    Scratch memory to reuse between calls.\n"
+    "rng : Generator, BitGenerator, or sequence of them, optional\n"
+    "    Either a single random generator shared by all of the boards, or\n"
+    "    a sequence of N distinct generators, one per board. Defaults to\n"
+    "    the global generator.\n"
+    "goals : ndarray of shape (N, H, W), optional\n"
+    "counts : ndarray of shape (N, 8, 9), optional\n"
+    "    Alive counts of each board. If supplied, they're updated in place.\n"
+    "    See :func:`advance_board`.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "new_boards : ndarray of shape (N, H, W)\n";
+
+
+static PyObject *advance_board_batch_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *boards_obj, *probs_obj = NULL, *out_obj = Py_None;
+    PyObject *ws_obj = Py_None, *rng_obj = Py_None;
+    PyObject *goals_obj = Py_None, *counts_obj = Py_None;
+    PyArrayObject *boards = NULL, *probs = NULL, *out = NULL;
+    PyArrayObject *goals = NULL, *counts = NULL;
+    workspace_t *ws = NULL;
+    rng_list_t rngs = {0};
+    int n_step = 1, num_threads = 1, engine;
+    float default_prob = 0.3, *prob_data = &default_prob;
+    int prob_stride = 0;
+    char *engine_name = "dense";
+    static char *kwlist[] = {
+        "boards", "spawn_probs", "n_steps", "out", "num_threads", "engine",
+        "workspace", "rng", "goals", "counts", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|OiOisOOOO:advance_board_batch", kwlist,
+            &boards_obj, &probs_obj, &n_step, &out_obj, &num_threads,
+            &engine_name, &ws_obj, &rng_obj, &goals_obj, &counts_obj))
+        return NULL;
+    if (!parse_engine(engine_name, &engine))
+        return NULL;
+    if (engine == ENGINE_TILED) {
+        PyErr_SetString(PyExc_ValueError,
+            "The 'tiled' engine can only advance one board at a time.");
         return NULL;
     }
-    b2 = (PyArrayObject *)PyArray_FROM_OTF(
-        board_obj, NPY_UINT16, NPY_ARRAY_ENSURECOPY);
+
+    boards = (PyArrayObject *)PyArray_FROM_OTF(
+        boards_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!boards) goto error;
+    if (PyArray_NDIM(boards) != 3 || PyArray_SIZE(boards) == 0)
+        PY_VAL_ERROR("Boards should be a non-empty array of shape (N, H, W).");
+    npy_intp *dims = PyArray_DIMS(boards);
+    if (probs_obj) {
+        probs = (PyArrayObject *)PyArray_FROM_OTF(
+            probs_obj, NPY_FLOAT32, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!probs) goto error;
+        if (PyArray_SIZE(probs) != 1 && PyArray_SIZE(probs) != dims[0])
+            PY_VAL_ERROR("Spawn probabilities should be a scalar or shape (N,).");
+        prob_data = (float *)PyArray_DATA(probs);
+        prob_stride = PyArray_SIZE(probs) > 1;
+    }
+    if (!(out = output_array(out_obj, boards))) goto error;
+    if (!count_arrays(goals_obj, counts_obj, boards, dims[0], &goals, &counts))
+        goto error;
+    if (!acquire_rngs(rng_obj, dims[0], &rngs)) goto error;
+    if (!acquire_workspace(ws_obj, &ws)) goto error;
+
     Py_BEGIN_ALLOW_THREADS
-    advance_board_nstep(
+    advance_board_batch(
+        (uint16_t *)PyArray_DATA(boards),
+        (uint16_t *)PyArray_DATA(out),
+        dims[0], dims[1], dims[2],
+        prob_data, prob_stride, n_step, engine,
+        rngs.states, rngs.n > 1, num_threads, ws
+    );
+    for (npy_intp k = 0; counts && k < dims[0]; k++) {
+        npy_intp offset = k * dims[1] * dims[2];
+        update_counts(
+            (uint16_t *)PyArray_DATA(boards) + offset,
+            (uint16_t *)PyArray_DATA(out) + offset,
+            (uint16_t *)PyArray_DATA(goals) + offset,
+            dims[1], dims[2],
+            (int64_t *)PyArray_DATA(counts) + 72 * k
+        );
+    }
+    Py_END_ALLOW_THREADS
+
+    release_workspace(ws_obj);
+    release_rngs(&rngs);
+    if (counts) PyArray_ResolveWritebackIfCopy(counts);
+    Py_DECREF(boards);
+    Py_XDECREF(probs);
+    Py_XDECREF(goals);
+    Py_XDECREF(counts);
+    return (PyObject *)out;
+
+    error:
+    release_rngs(&rngs);
+    if (counts) PyArray_DiscardWritebackIfCopy(counts);
+    Py_XDECREF(boards);
+    Py_XDECREF(probs);
+    Py_XDECREF(out);
+    Py_XDECREF(goals);
+    Py_XDECREF(counts);
+    return NULL;
+}
+
+
+static char advance_game_of_life_doc[] =
+    "advance_game_of_life(board, born_rule, survive_rule, spawn_prob=0.3, "
+        "out=None, rng=None)\n--\n\n"
+    "Advance the board one step using arbitrary Game of Life rules.\n"
+    "\n"
+    "Cells otherwise behave as in :func:`advance_board`: frozen cells never\n"
+    "change, preserving and inhibiting neighbors stop cells from dying or\n"
+    "being born, spawners create new cells, and new cells inherit colors\n"
+    "from their neighbors. See :class:`GameOfLife`.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "born_rule : int\n"
+    "    Bit mask of neighbor counts for which dead cells come to life.\n"
+    "    Conway's rules (B3/S23) are ``born_rule=1<<3``.\n"
+    "survive_rule : int\n"
+    "    Bit mask of neighbor counts for which live cells survive.\n"
+    "    Conway's rules are ``survive_rule=(1<<2)|(1<<3)``.\n"
+    "spawn_prob : float\n"
+    "out : ndarray, optional\n"
+    "rng : numpy.random.Generator or BitGenerator, optional\n"
+    "    See :func:`advance_board`.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "new_board : ndarray\n";
+
+
+static PyObject *advance_game_of_life_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *out_obj = Py_None, *rng_obj = Py_None;
+    PyArrayObject *b1 = NULL, *b2 = NULL;
+    rng_list_t rngs = {0};
+    int born_mask, survive_mask;
+    double spawn_prob = 0.3;
+    static char *kwlist[] = {
+        "board", "born_rule", "survive_rule", "spawn_prob", "out", "rng", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "Oii|dOO:advance_game_of_life", kwlist,
+            &board_obj, &born_mask, &survive_mask, &spawn_prob, &out_obj,
+            &rng_obj))
+        return NULL;
+    if (born_mask < 0 || born_mask >= 512 ||
+            survive_mask < 0 || survive_mask >= 512) {
+        PyErr_SetString(PyExc_ValueError,
+            "Rules should be bit masks of neighbor counts 0-8.");
+        return NULL;
+    }
+    b1 = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!b1) return NULL;
+    if (PyArray_NDIM(b1) != 2 || PyArray_SIZE(b1) == 0)
+        PY_VAL_ERROR("Board should be a non-empty two-dimensional array.");
+    if (!(b2 = output_array(out_obj, b1))) goto error;
+    if (!acquire_rngs(rng_obj, 0, &rngs)) goto error;
+
+    Py_BEGIN_ALLOW_THREADS
+    advance_game_of_life(
         (uint16_t *)PyArray_DATA(b1),
         (uint16_t *)PyArray_DATA(b2),
         PyArray_DIM(b1, 0),
         PyArray_DIM(b1, 1),
-        spawn_prob, n_step
+        born_mask, survive_mask, spawn_prob, rngs.states[0]
     );
     Py_END_ALLOW_THREADS
-    Py_DECREF(board_obj);
+
+    release_rngs(&rngs);
+    Py_DECREF(b1);
     return (PyObject *)b2;
+
+    error:
+    release_rngs(&rngs);
+    Py_XDECREF(b1);
+    Py_XDECREF(b2);
+    return NULL;
 }
 
 
-static PyObject *life_occupancy_py(PyObject *self, PyObject *args) {
-    PyObject *board_obj;
+static char advance_async_game_doc[] =
+    "advance_async_game(board, energy_rules, temperature=0, spawn_prob=0.3, "
+        "cells_per_update=0.3, out=None, rng=None)\n--\n\n"
+    "Advance the board with asynchronous, one-cell-at-a-time updates.\n"
+    "\n"
+    "See :class:`AsyncGame` for a description of the update rules.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "energy_rules : array of shape (2, num_neighbors + 1)\n"
+    "    Energy differences for live and dead cells, respectively, given the\n"
+    "    number of live neighbors. The number of neighbors must be 4, 6, or 8\n"
+    "    for Von Neumann, hexagonal, and Moore neighborhoods.\n"
+    "temperature : float\n"
+    "spawn_prob : float\n"
+    "cells_per_update : float\n"
+    "    Number of cell updates to perform as a fraction of the board size.\n"
+    "out : ndarray, optional\n"
+    "rng : numpy.random.Generator or BitGenerator, optional\n"
+    "    See :func:`advance_board`.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "new_board : ndarray\n";
+
+
+static PyObject *advance_async_game_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *rules_obj, *out_obj = Py_None, *rng_obj = Py_None;
+    PyArrayObject *b1 = NULL, *b2 = NULL, *rules = NULL;
+    rng_list_t rngs = {0};
+    double temperature = 0, spawn_prob = 0.3, cells_per_update = 0.3;
+    static char *kwlist[] = {
+        "board", "energy_rules", "temperature", "spawn_prob",
+        "cells_per_update", "out", "rng", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OO|dddOO:advance_async_game", kwlist,
+            &board_obj, &rules_obj, &temperature, &spawn_prob,
+            &cells_per_update, &out_obj, &rng_obj))
+        return NULL;
+    b1 = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!b1) return NULL;
+    rules = (PyArrayObject *)PyArray_FROM_OTF(
+        rules_obj, NPY_FLOAT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!rules) goto error;
+    if (PyArray_NDIM(b1) != 2 || PyArray_SIZE(b1) == 0)
+        PY_VAL_ERROR("Board should be a non-empty two-dimensional array.");
+    int n_neighbors = PyArray_NDIM(rules) == 2 && PyArray_DIM(rules, 0) == 2 ?
+        PyArray_DIM(rules, 1) - 1 : -1;
+    if (n_neighbors != 4 && n_neighbors != 6 && n_neighbors != 8)
+        PY_VAL_ERROR("Energy rules should have shape (2, 5), (2, 7), or (2, 9).");
+    if (cells_per_update < 0)
+        PY_VAL_ERROR("Cells per update must not be negative.");
+    if (!(b2 = output_array(out_obj, b1))) goto error;
+    if (!acquire_rngs(rng_obj, 0, &rngs)) goto error;
+
+    npy_intp size = PyArray_SIZE(b1);
+    Py_BEGIN_ALLOW_THREADS
+    memcpy(PyArray_DATA(b2), PyArray_DATA(b1), size * sizeof(uint16_t));
+    advance_async_game(
+        (uint16_t *)PyArray_DATA(b2),
+        PyArray_DIM(b1, 0),
+        PyArray_DIM(b1, 1),
+        (double *)PyArray_DATA(rules), n_neighbors,
+        temperature, spawn_prob, (int64_t)(size * cells_per_update),
+        rngs.states[0]
+    );
+    Py_END_ALLOW_THREADS
+
+    release_rngs(&rngs);
+    Py_DECREF(b1);
+    Py_DECREF(rules);
+    return (PyObject *)b2;
+
+    error:
+    release_rngs(&rngs);
+    Py_XDECREF(b1);
+    Py_XDECREF(b2);
+    Py_XDECREF(rules);
+    return NULL;
+}
+
+
+static char life_occupancy_doc[] =
+    "life_occupancy(board, spawn_prob=0.3, n_steps=1000, workspace=None, "
+        "rng=None)\n--\n\n"
+    "Find the total occupancy of different life types (colors) for \n"
+    "each point in the grid after advancing the board n steps.\n"
+    "\n"
+    "Boards without spawners are deterministic. Once such a board starts\n"
+    "to repeat itself, the occupancy of the remaining cycles is added up\n"
+    "directly rather than simulated.\n"
+    "\n"
+    "See :func:`advance_board` for the `workspace` and `rng` parameters.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "counts : ndarray of shape (H, W, 8)\n";
+
+
+static PyObject *life_occupancy_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *ws_obj = Py_None, *rng_obj = Py_None;
     PyArrayObject *b1, *counts;
+    workspace_t *ws = NULL;
+    rng_list_t rngs;
     float spawn_prob = 0.3;
     int n_step = 1000;
+    static char *kwlist[] = {
+        "board", "spawn_prob", "n_steps", "workspace", "rng", NULL
+    };
 
-    if (!PyArg_ParseTuple(args, "O|fi", &board_obj, &spawn_prob, &n_step))
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|fiOO:life_occupancy", kwlist,
+            &board_obj, &spawn_prob, &n_step, &ws_obj, &rng_obj))
         return NULL;
     board_obj = PyArray_FROM_OTF(
         board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
@@ -65,6 +900,15 @@ static PyObject *life_occupancy_py(PyObject *self, PyObject *args) {
         Py_DECREF(board_obj);
         return NULL;
     }
+    if (!acquire_rngs(rng_obj, 0, &rngs)) {
+        Py_DECREF(board_obj);
+        return NULL;
+    }
+    if (!acquire_workspace(ws_obj, &ws)) {
+        release_rngs(&rngs);
+        Py_DECREF(board_obj);
+        return NULL;
+    }
     npy_intp count_dims[3] = {PyArray_DIMS(b1)[0], PyArray_DIMS(b1)[1], 8};
     counts = (PyArrayObject *)PyArray_ZEROS(3, count_dims, NPY_INT32, 0);
     Py_BEGIN_ALLOW_THREADS
@@ -73,9 +917,11 @@ static PyObject *life_occupancy_py(PyObject *self, PyObject *args) {
         (int32_t *)PyArray_DATA(counts),
         PyArray_DIM(b1, 0),
         PyArray_DIM(b1, 1),
-        spawn_prob, n_step
+        spawn_prob, n_step, rngs.states[0], ws
     );
     Py_END_ALLOW_THREADS
+    release_workspace(ws_obj);
+    release_rngs(&rngs);
     Py_DECREF(board_obj);
     return (PyObject *)counts;
 }
@@ -89,16 +935,19 @@ static char alive_counts_doc[] =
     "----------\n"
     "board : ndarray\n"
     "goals : ndarray\n"
+    "    Same shape as the board. If both are three-dimensional, they're\n"
+    "    treated as a stack of boards and each one is counted separately.\n"
     "\n"
     "Returns\n"
     "-------\n"
-    "counts : ndarray of shape (8,8)\n"
-    "    Rows index the background color, columns the foreground color.\n";
+    "counts : ndarray of shape (8,9) or (N,8,9)\n"
+    "    Rows index the background color, columns the foreground color.\n"
+    "    The last column counts the empty cells.\n";
 
 
 static PyObject *alive_counts_py(PyObject *self, PyObject *args) {
     PyObject *board_obj, *goals_obj;
-    PyArrayObject *board, *goals, *out;
+    PyArrayObject *board, *goals, *out = NULL;
 
     if (!PyArg_ParseTuple(args, "OO", &board_obj, &goals_obj)) return NULL;
 
@@ -106,19 +955,32 @@ static PyObject *alive_counts_py(PyObject *self, PyObject *args) {
         board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
     goals = (PyArrayObject *)PyArray_FROM_OTF(
         goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
-    const npy_intp out_dims[2] = {8,9};
-    out = (PyArrayObject *)PyArray_ZEROS(2, out_dims, NPY_INT64, 0);
+    if (!board || !goals) goto error;
 
     if (PyArray_SIZE(board) != PyArray_SIZE(goals)) {
         PY_VAL_ERROR("Board and goals must have same size.");
     }
-
-    alive_counts(
-        (uint16_t *)PyArray_DATA(board),
-        (uint16_t *)PyArray_DATA(goals),
-        PyArray_SIZE(board),
-        (int64_t *)PyArray_DATA(out)
-    );
+    npy_intp n_boards = 1;
+    int stacked = PyArray_NDIM(board) == 3 && PyArray_NDIM(goals) == 3;
+    if (stacked) {
+        n_boards = PyArray_DIM(board, 0);
+        if (PyArray_DIM(goals, 0) != n_boards)
+            PY_VAL_ERROR("Board and goals must have same shape.");
+    }
+    const npy_intp out_dims[3] = {n_boards, 8, 9};
+    out = (PyArrayObject *)PyArray_ZEROS(
+        stacked ? 3 : 2, stacked ? out_dims : out_dims + 1, NPY_INT64, 0);
+    if (!out) goto error;
+
+    npy_intp size = n_boards ? PyArray_SIZE(board) / n_boards : 0;
+    for (npy_intp k = 0; k < n_boards; k++) {
+        alive_counts(
+            (uint16_t *)PyArray_DATA(board) + k * size,
+            (uint16_t *)PyArray_DATA(goals) + k * size,
+            size,
+            (int64_t *)PyArray_DATA(out) + k * 72
+        );
+    }
 
     Py_DECREF((PyObject *)board);
     Py_DECREF((PyObject *)goals);
@@ -132,8 +994,133 @@ static PyObject *alive_counts_py(PyObject *self, PyObject *args) {
 }
 
 
+static char board_hash_doc[] =
+    "board_hash(board, salt=0, cells=None)\n--\n\n"
+    "Zobrist hash of a board.\n"
+    "\n"
+    "Every cell value at every position gets a pseudo-random 64-bit key, and\n"
+    "the hash is the xor of the keys of all of the cells. Empty cells have a\n"
+    "key of zero. Since xor is its own inverse, the hash of a board can be\n"
+    "kept up to date by xoring in the keys of the cells that change both\n"
+    "before and after they change.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "salt : int\n"
+    "    Gives an independent set of keys, so that different arrays (e.g.,\n"
+    "    the board and the goals) can be hashed together.\n"
+    "cells : ndarray, optional\n"
+    "    Flat indices of the cells to hash. If not supplied, all of them.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "hash : int\n";
+
+
+static PyObject *board_hash_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *cells_obj = Py_None;
+    PyArrayObject *board, *cells = NULL;
+    unsigned long long salt = 0;
+    uint64_t hash;
+    static char *kwlist[] = {"board", "salt", "cells", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|KO:board_hash", kwlist, &board_obj, &salt, &cells_obj))
+        return NULL;
+
+    board = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!board) return NULL;
+    npy_intp size = PyArray_SIZE(board);
+    if (cells_obj == Py_None) {
+        hash = board_hash((uint16_t *)PyArray_DATA(board), size, salt);
+    } else {
+        cells = (PyArrayObject *)PyArray_FROM_OTF(
+            cells_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!cells) goto error;
+        npy_intp n_cells = PyArray_SIZE(cells);
+        int64_t *cell_data = (int64_t *)PyArray_DATA(cells);
+        for (npy_intp k = 0; k < n_cells; k++) {
+            if (cell_data[k] < 0 || cell_data[k] >= size)
+                PY_VAL_ERROR("Cells must be on the board.");
+        }
+        hash = board_hash_cells(
+            (uint16_t *)PyArray_DATA(board), cell_data, n_cells, salt);
+        Py_DECREF(cells);
+    }
+
+    Py_DECREF(board);
+    return PyLong_FromUnsignedLongLong(hash);
+
+    error:
+    Py_XDECREF(board);
+    Py_XDECREF(cells);
+    return NULL;
+}
+
+
+static char update_board_hash_doc[] =
+    "update_board_hash(old_board, new_board, hash, salt=0)\n--\n\n"
+    "Turn the hash of one board into that of another of the same shape.\n"
+    "\n"
+    "Only the cells that differ contribute, and rows that are identical are\n"
+    "skipped quickly, so this is much cheaper than hashing the new board\n"
+    "when only a few cells change. See :func:`board_hash`.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "old_board : ndarray\n"
+    "new_board : ndarray\n"
+    "hash : int\n"
+    "    Hash of the old board.\n"
+    "salt : int\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "hash : int\n"
+    "    Hash of the new board.\n";
+
+
+static PyObject *update_board_hash_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *b1_obj, *b2_obj;
+    PyArrayObject *b1, *b2 = NULL;
+    unsigned long long hash, salt = 0;
+    static char *kwlist[] = {"old_board", "new_board", "hash", "salt", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OOK|K:update_board_hash", kwlist,
+            &b1_obj, &b2_obj, &hash, &salt))
+        return NULL;
+
+    b1 = (PyArrayObject *)PyArray_FROM_OTF(
+        b1_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!b1) return NULL;
+    b2 = (PyArrayObject *)PyArray_FROM_OTF(
+        b2_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!b2) goto error;
+    if (PyArray_NDIM(b1) != 2 || PyArray_NDIM(b2) != 2 ||
+            !PyArray_CompareLists(PyArray_DIMS(b1), PyArray_DIMS(b2), 2))
+        PY_VAL_ERROR("Boards must be 2-dimensional and have the same shape.");
+
+    hash = update_board_hash(
+        (uint16_t *)PyArray_DATA(b1), (uint16_t *)PyArray_DATA(b2),
+        PyArray_DIM(b1, 0), PyArray_DIM(b1, 1), salt, hash);
+
+    Py_DECREF(b1);
+    Py_DECREF(b2);
+    return PyLong_FromUnsignedLongLong(hash);
+
+    error:
+    Py_XDECREF(b1);
+    Py_XDECREF(b2);
+    return NULL;
+}
+
+
 static char execute_actions_doc[] =
-    "execute_actions(board, locations, actions)\n--\n\n"
+    "execute_actions(board, locations, actions, goals=None, counts=None, "
+        "hash=None, workspace=None)\n--\n\n"
     "Perform an action for each agent.\n"
     "\n"
     "Parameters\n"
@@ -144,7 +1131,18 @@ static char execute_actions_doc[] =
     "    Coordinates are x,y (column, row).\n"
     "actions : ndarray\n"
     "    One-dimensional, values 0-8.\n"
-    "    0 = no action, 1-4 = move, 5-8 = toggle."
+    "    0 = no action, 1-4 = move, 5-8 = toggle.\n"
+    "goals : ndarray, optional\n"
+    "counts : ndarray of shape (8, 9), optional\n"
+    "    Alive counts of the board with the given goals. If supplied, they're\n"
+    "    updated in place to reflect the cells changed by the actions.\n"
+    "hash : ndarray of shape (1,), uint64, optional\n"
+    "    Hash of the board; see :func:`board_hash`. If supplied, it's updated\n"
+    "    in place along with the board.\n"
+    "workspace : Workspace, optional\n"
+    "    Workspace used to advance the board with the 'tiled' engine. The\n"
+    "    cells touched by the agents are marked as changed in it; see\n"
+    "    :meth:`Workspace.mark_changed`.\n"
     "\n"
     "Returns\n"
     "-------\n"
@@ -152,20 +1150,32 @@ static char execute_actions_doc[] =
     "    Rows index the background color, columns the foreground color.\n";
 
 
-static PyObject *execute_actions_py(PyObject *self, PyObject *args) {
+static PyObject *execute_actions_py(PyObject *self, PyObject *args, PyObject *kw) {
     PyObject *board_obj, *locations_obj, *actions_obj;
-    PyArrayObject *board, *locations, *actions;
+    PyObject *goals_obj = Py_None, *counts_obj = Py_None, *hash_obj = Py_None;
+    PyObject *ws_obj = Py_None;
+    PyArrayObject *board, *locations, *actions, *goals = NULL, *counts = NULL;
+    PyArrayObject *hash = NULL;
+    workspace_t *ws = NULL;
     int height, width, n_agents, n_actions;
+    static char *kwlist[] = {
+        "board", "locations", "actions", "goals", "counts", "hash",
+        "workspace", NULL
+    };
 
-    if (!PyArg_ParseTuple(args, "OOO", &board_obj, &locations_obj, &actions_obj))
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OOO|OOOO:execute_actions", kwlist,
+            &board_obj, &locations_obj, &actions_obj, &goals_obj, &counts_obj,
+            &hash_obj, &ws_obj))
         return NULL;
 
     board = (PyArrayObject *)PyArray_FROM_OTF(
-        board_obj, NPY_UINT16, NPY_ARRAY_INOUT_ARRAY);
+        board_obj, NPY_UINT16, NPY_ARRAY_INOUT_ARRAY2);
     locations = (PyArrayObject *)PyArray_FROM_OTF(
-        locations_obj, NPY_INT64, NPY_ARRAY_INOUT_ARRAY);
+        locations_obj, NPY_INT64, NPY_ARRAY_INOUT_ARRAY2);
     actions = (PyArrayObject *)PyArray_FROM_OTF(
         actions_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!board || !locations || !actions) goto error;
 
     if (PyArray_NDIM(board) != 2)
         PY_VAL_ERROR("Board should be 2-dimensional.");
@@ -177,27 +1187,650 @@ static PyObject *execute_actions_py(PyObject *self, PyObject *args) {
     n_actions = PyArray_SIZE(actions);
     if (n_actions != n_agents && n_actions != 1)
         PY_VAL_ERROR("Locations should be shape (n_agent, 2).");
+    if (!count_arrays(goals_obj, counts_obj, board, 1, &goals, &counts)) goto error;
+    if (!hash_array(hash_obj, &hash)) goto error;
+    if (!acquire_workspace(ws_obj, &ws)) goto error;
+    if (ws && board_obj != ((WorkspaceObject *)ws_obj)->last_output) {
+        // Edits to any other array are ignored; see Workspace.mark_changed.
+        ws = NULL;
+    }
 
     execute_actions(
         (uint16_t *)PyArray_DATA(board), width, height,
         (int64_t *)PyArray_DATA(locations),
         (int64_t *)PyArray_DATA(actions),
-        n_agents, (n_actions == n_agents) ? 1 : 0
+        n_agents, (n_actions == n_agents) ? 1 : 0,
+        goals ? (uint16_t *)PyArray_DATA(goals) : NULL,
+        counts ? (int64_t *)PyArray_DATA(counts) : NULL,
+        hash ? (uint64_t *)PyArray_DATA(hash) : NULL,
+        ws
     );
+    release_workspace(ws_obj);
 
     PyArray_ResolveWritebackIfCopy(board);
     PyArray_ResolveWritebackIfCopy(locations);
+    if (counts) PyArray_ResolveWritebackIfCopy(counts);
+    if (hash) PyArray_ResolveWritebackIfCopy(hash);
 
     Py_DECREF((PyObject *)board);
     Py_DECREF((PyObject *)locations);
     Py_DECREF((PyObject *)actions);
+    Py_XDECREF((PyObject *)goals);
+    Py_XDECREF((PyObject *)counts);
+    Py_XDECREF((PyObject *)hash);
     Py_INCREF(Py_None);
     return Py_None;
 
     error:
+    if (board) PyArray_DiscardWritebackIfCopy(board);
+    if (locations) PyArray_DiscardWritebackIfCopy(locations);
+    if (counts) PyArray_DiscardWritebackIfCopy(counts);
+    if (hash) PyArray_DiscardWritebackIfCopy(hash);
     Py_XDECREF((PyObject *)board);
     Py_XDECREF((PyObject *)locations);
     Py_XDECREF((PyObject *)actions);
+    Py_XDECREF((PyObject *)goals);
+    Py_XDECREF((PyObject *)counts);
+    Py_XDECREF((PyObject *)hash);
+    return NULL;
+}
+
+
+static char execute_actions_batch_doc[] =
+    "execute_actions_batch(boards, locations, offsets, actions, num_threads=1, "
+        "goals=None, counts=None)\n"
+    "--\n\n"
+    "Perform an action for each agent on a stack of boards.\n"
+    "\n"
+    "Boards and agent locations are modified in place.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "boards : ndarray of shape (N, H, W)\n"
+    "locations : ndarray of shape (M, 2)\n"
+    "    Location of every agent on every board, with the agents for each\n"
+    "    board stored consecutively.\n"
+    "offsets : ndarray of shape (N+1,)\n"
+    "    The agents on board ``k`` are ``locations[offsets[k]:offsets[k+1]]``.\n"
+    "actions : ndarray of shape (M,)\n"
+    "    Action for each agent. See :func:`execute_actions`.\n"
+    "num_threads : int\n"
+    "    Number of native threads used to process the boards.\n"
+    "goals : ndarray of shape (N, H, W), optional\n"
+    "counts : ndarray of shape (N, 8, 9), optional\n"
+    "    Alive counts of each board. If supplied, they're updated in place.\n"
+    "    See :func:`execute_actions`.\n";
+
+
+static PyObject *execute_actions_batch_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *boards_obj, *locations_obj, *offsets_obj, *actions_obj;
+    PyObject *goals_obj = Py_None, *counts_obj = Py_None;
+    PyArrayObject
+        *boards = NULL,
+        *locations = NULL,
+        *offsets = NULL,
+        *actions = NULL,
+        *goals = NULL,
+        *counts = NULL;
+    int num_threads = 1;
+    static char *kwlist[] = {
+        "boards", "locations", "offsets", "actions", "num_threads", "goals",
+        "counts", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OOOO|iOO:execute_actions_batch", kwlist,
+            &boards_obj, &locations_obj, &offsets_obj, &actions_obj,
+            &num_threads, &goals_obj, &counts_obj))
+        return NULL;
+
+    boards = (PyArrayObject *)PyArray_FROM_OTF(
+        boards_obj, NPY_UINT16, NPY_ARRAY_INOUT_ARRAY2);
+    locations = (PyArrayObject *)PyArray_FROM_OTF(
+        locations_obj, NPY_INT64, NPY_ARRAY_INOUT_ARRAY2);
+    offsets = (PyArrayObject *)PyArray_FROM_OTF(
+        offsets_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    actions = (PyArrayObject *)PyArray_FROM_OTF(
+        actions_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!boards || !locations || !offsets || !actions) goto error;
+
+    if (PyArray_NDIM(boards) != 3)
+        PY_VAL_ERROR("Boards should have shape (N, H, W).");
+    npy_intp n_boards = PyArray_DIM(boards, 0);
+    int height = PyArray_DIM(boards, 1);
+    int width = PyArray_DIM(boards, 2);
+    if (height < 3 || width < 3)
+        PY_VAL_ERROR("Board must be at least 3x3.");
+    npy_intp n_agents = PyArray_SIZE(locations) / 2;
+    if (PyArray_SIZE(locations) != 2 * n_agents)
+        PY_VAL_ERROR("Locations should be shape (n_agent, 2).");
+    if (PyArray_SIZE(actions) != n_agents)
+        PY_VAL_ERROR("There should be exactly one action per agent.");
+    if (PyArray_SIZE(offsets) != n_boards + 1)
+        PY_VAL_ERROR("Offsets should have shape (N+1,).");
+    int64_t *offset_data = (int64_t *)PyArray_DATA(offsets);
+    for (npy_intp k = 0; k < n_boards; k++) {
+        if (offset_data[k] < 0 || offset_data[k] > offset_data[k+1] ||
+                offset_data[k+1] > n_agents)
+            PY_VAL_ERROR("Offsets should be non-decreasing and within bounds.");
+    }
+    if (!count_arrays(goals_obj, counts_obj, boards, n_boards, &goals, &counts))
+        goto error;
+
+    Py_BEGIN_ALLOW_THREADS
+    execute_actions_batch(
+        (uint16_t *)PyArray_DATA(boards), n_boards, height, width,
+        (int64_t *)PyArray_DATA(locations), offset_data,
+        (int64_t *)PyArray_DATA(actions),
+        goals ? (uint16_t *)PyArray_DATA(goals) : NULL,
+        counts ? (int64_t *)PyArray_DATA(counts) : NULL,
+        num_threads
+    );
+    Py_END_ALLOW_THREADS
+
+    PyArray_ResolveWritebackIfCopy(boards);
+    PyArray_ResolveWritebackIfCopy(locations);
+    if (counts) PyArray_ResolveWritebackIfCopy(counts);
+
+    Py_DECREF((PyObject *)boards);
+    Py_DECREF((PyObject *)locations);
+    Py_DECREF((PyObject *)offsets);
+    Py_DECREF((PyObject *)actions);
+    Py_XDECREF((PyObject *)goals);
+    Py_XDECREF((PyObject *)counts);
+    Py_INCREF(Py_None);
+    return Py_None;
+
+    error:
+    if (boards) PyArray_DiscardWritebackIfCopy(boards);
+    if (locations) PyArray_DiscardWritebackIfCopy(locations);
+    Py_XDECREF((PyObject *)boards);
+    Py_XDECREF((PyObject *)locations);
+    Py_XDECREF((PyObject *)offsets);
+    Py_XDECREF((PyObject *)actions);
+    return NULL;
+}
+
+
+static char step_game_doc[] =
+    "step_game(board, goals, agent_locs, actions, exit_locs, points_table, "
+        "initial_counts, initial_colors, min_performance, spawn_prob=0.3, "
+        "points_on_level_exit=1, advance_goals=True, engine='dense', "
+        "out_board=None, out_goals=None, board_workspace=None, "
+        "goals_workspace=None, rng=None, counts=None, hash=None)\n--\n\n"
+    "Perform one complete step of a SafeLife game.\n"
+    "\n"
+    "Executes the agents' actions, advances the board and goals, counts the\n"
+    "live cells, opens the exits for agents with enough points, and scores\n"
+    "the new board. The board and agent locations are modified in place by\n"
+    "the actions. See :meth:`SafeLifeGame.step`.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "goals : ndarray\n"
+    "agent_locs : ndarray of shape (n_agents, 2)\n"
+    "actions : ndarray\n"
+    "    One action per agent, or a single action for all of them.\n"
+    "exit_locs : tuple of ndarrays\n"
+    "    Row and column indices of the level exits.\n"
+    "points_table : ndarray of shape (n_agents, 8, 9)\n"
+    "initial_counts : ndarray of shape (8, 9)\n"
+    "initial_colors : ndarray of shape (9,), bool\n"
+    "min_performance : float\n"
+    "    Together with the points table and initial counts and colors,\n"
+    "    determines the points needed by each agent to open the exit.\n"
+    "    See :meth:`GameWithGoals.required_points`.\n"
+    "spawn_prob : float\n"
+    "points_on_level_exit : float\n"
+    "advance_goals : bool\n"
+    "    If False, the goals are static and aren't advanced.\n"
+    "engine : str\n"
+    "out_board, out_goals : ndarray, optional\n"
+    "board_workspace, goals_workspace : Workspace, optional\n"
+    "rng : numpy.random.Generator or BitGenerator, optional\n"
+    "    See :func:`advance_board`.\n"
+    "counts : ndarray of shape (8, 9), optional\n"
+    "    Alive counts of the board before the step. If supplied and the\n"
+    "    goals are static, the new counts are found by only looking at the\n"
+    "    cells that change instead of recounting the whole board.\n"
+    "hash : ndarray of shape (1,), uint64, optional\n"
+    "    Hash of the board before the step; see :func:`board_hash`. If\n"
+    "    supplied, it's updated in place to the hash of the new board.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "new_board : ndarray\n"
+    "new_goals : ndarray\n"
+    "    The input goals if they aren't advanced.\n"
+    "counts : ndarray of shape (8, 9)\n"
+    "    Live cell counts for the new board. See :func:`alive_counts`.\n"
+    "points : ndarray of shape (n_agents,)\n"
+    "exited : ndarray of shape (n_agents,), bool\n"
+    "active : ndarray of shape (n_agents,), bool\n";
+
+
+static PyObject *step_game_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *goals_obj, *locs_obj, *actions_obj;
+    PyObject *exit_rows_obj, *exit_cols_obj, *table_obj, *initial_obj;
+    PyObject *colors_obj;
+    PyObject *out_board_obj = Py_None, *out_goals_obj = Py_None;
+    PyObject *board_ws_obj = Py_None, *goals_ws_obj = Py_None;
+    PyObject *rng_obj = Py_None, *board_counts_obj = Py_None;
+    PyObject *hash_obj = Py_None;
+    PyArrayObject
+        *board = NULL, *goals = NULL, *locs = NULL, *actions = NULL,
+        *exit_rows = NULL, *exit_cols = NULL, *table = NULL,
+        *initial = NULL, *colors = NULL, *board_counts = NULL, *hash = NULL,
+        *new_board = NULL, *new_goals = NULL,
+        *counts = NULL, *points = NULL, *exited = NULL, *active = NULL;
+    workspace_t *board_ws = NULL, *goals_ws = NULL;
+    rng_list_t rngs = {0};
+    float spawn_prob = 0.3;
+    double min_performance, points_on_level_exit = 1;
+    int advance_goals = 1, engine;
+    char *engine_name = "dense";
+    static char *kwlist[] = {
+        "board", "goals", "agent_locs", "actions", "exit_locs",
+        "points_table", "initial_counts", "initial_colors", "min_performance",
+        "spawn_prob",
+        "points_on_level_exit", "advance_goals", "engine", "out_board",
+        "out_goals", "board_workspace", "goals_workspace", "rng", "counts",
+        "hash", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OOOO(OO)OOOd|fdpsOOOOOOO:step_game", kwlist,
+            &board_obj, &goals_obj, &locs_obj, &actions_obj,
+            &exit_rows_obj, &exit_cols_obj, &table_obj, &initial_obj,
+            &colors_obj, &min_performance, &spawn_prob, &points_on_level_exit, &advance_goals,
+            &engine_name, &out_board_obj, &out_goals_obj, &board_ws_obj,
+            &goals_ws_obj, &rng_obj, &board_counts_obj, &hash_obj))
+        return NULL;
+    if (!parse_engine(engine_name, &engine))
+        return NULL;
+
+    // INOUT_ARRAY2 so that changes to copies get written back to the
+    // originals (e.g., to agent locations stored with negative strides).
+    board = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_INOUT_ARRAY2);
+    goals = (PyArrayObject *)PyArray_FROM_OTF(
+        goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    locs = (PyArrayObject *)PyArray_FROM_OTF(
+        locs_obj, NPY_INT64, NPY_ARRAY_INOUT_ARRAY2);
+    actions = (PyArrayObject *)PyArray_FROM_OTF(
+        actions_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    exit_rows = (PyArrayObject *)PyArray_FROM_OTF(
+        exit_rows_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    exit_cols = (PyArrayObject *)PyArray_FROM_OTF(
+        exit_cols_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    table = (PyArrayObject *)PyArray_FROM_OTF(
+        table_obj, NPY_FLOAT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    initial = (PyArrayObject *)PyArray_FROM_OTF(
+        initial_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    colors = (PyArrayObject *)PyArray_FROM_OTF(
+        colors_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!board || !goals || !locs || !actions || !exit_rows || !exit_cols ||
+            !table || !initial || !colors)
+        goto error;
+
+    if (PyArray_NDIM(board) != 2)
+        PY_VAL_ERROR("Board should be 2-dimensional.");
+    int height = PyArray_DIM(board, 0);
+    int width = PyArray_DIM(board, 1);
+    if (height < 3 || width < 3)
+        PY_VAL_ERROR("Board must be at least 3x3.");
+    if (PyArray_NDIM(goals) != 2 ||
+            !PyArray_CompareLists(PyArray_DIMS(goals), PyArray_DIMS(board), 2))
+        PY_VAL_ERROR("Board and goals must have same shape.");
+    npy_intp n_agents = PyArray_SIZE(locs) / 2;
+    if (PyArray_SIZE(locs) != 2 * n_agents)
+        PY_VAL_ERROR("Locations should be shape (n_agent, 2).");
+    int64_t *loc_data = (int64_t *)PyArray_DATA(locs);
+    for (npy_intp k = 0; k < 2 * n_agents; k++) {
+        if (loc_data[k] < 0 || loc_data[k] >= (k & 1 ? width : height))
+            PY_VAL_ERROR("Agent locations must be on the board.");
+    }
+    npy_intp n_actions = PyArray_SIZE(actions);
+    if (n_actions != n_agents && n_actions != 1)
+        PY_VAL_ERROR("There should be one action per agent.");
+    npy_intp n_exits = PyArray_SIZE(exit_rows);
+    if (PyArray_SIZE(exit_cols) != n_exits)
+        PY_VAL_ERROR("Exit rows and columns must have the same size.");
+    int64_t *rows = (int64_t *)PyArray_DATA(exit_rows);
+    int64_t *cols = (int64_t *)PyArray_DATA(exit_cols);
+    for (npy_intp k = 0; k < n_exits; k++) {
+        if (rows[k] < 0 || rows[k] >= height || cols[k] < 0 || cols[k] >= width)
+            PY_VAL_ERROR("Exit locations must be on the board.");
+    }
+    if (PyArray_SIZE(table) != 72 * n_agents)
+        PY_VAL_ERROR("Points table should have shape (n_agents, 8, 9).");
+    if (PyArray_SIZE(initial) != 72)
+        PY_VAL_ERROR("Initial counts should have shape (8, 9).");
+    if (PyArray_SIZE(colors) != 9)
+        PY_VAL_ERROR("Initial colors should have shape (9,).");
+    if (board_counts_obj != Py_None) {
+        board_counts = (PyArrayObject *)PyArray_FROM_OTF(board_counts_obj,
+            NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!board_counts) goto error;
+        if (PyArray_SIZE(board_counts) != 72)
+            PY_VAL_ERROR("Counts should have shape (8, 9).");
+    }
+    if (!hash_array(hash_obj, &hash)) goto error;
+
+    if (!(new_board = output_array(out_board_obj, board))) goto error;
+    if (advance_goals) {
+        if (!(new_goals = output_array(out_goals_obj, goals))) goto error;
+    } else {
+        new_goals = goals;
+        Py_INCREF(new_goals);
+    }
+    npy_intp count_dims[2] = {8, 9};
+    counts = (PyArrayObject *)PyArray_SimpleNew(2, count_dims, NPY_INT64);
+    points = (PyArrayObject *)PyArray_SimpleNew(1, &n_agents, NPY_FLOAT64);
+    exited = (PyArrayObject *)PyArray_SimpleNew(1, &n_agents, NPY_BOOL);
+    active = (PyArrayObject *)PyArray_SimpleNew(1, &n_agents, NPY_BOOL);
+    if (!counts || !points || !exited || !active) goto error;
+
+    if (!acquire_rngs(rng_obj, 0, &rngs)) goto error;
+    if (!acquire_workspace(board_ws_obj, &board_ws)) goto error;
+    if (board_ws_obj == goals_ws_obj) {
+        goals_ws = board_ws;
+    } else if (!acquire_workspace(goals_ws_obj, &goals_ws)) {
+        release_workspace(board_ws_obj);
+        goto error;
+    }
+    track_workspace_arrays(board_ws_obj, engine, board, new_board);
+    if (advance_goals) {
+        track_workspace_arrays(goals_ws_obj, engine, goals, new_goals);
+    }
+
+    step_results_t results = {
+        (int64_t *)PyArray_DATA(counts),
+        (double *)PyArray_DATA(points),
+        (uint8_t *)PyArray_DATA(exited),
+        (uint8_t *)PyArray_DATA(active),
+    };
+    Py_BEGIN_ALLOW_THREADS
+    step_game(
+        (uint16_t *)PyArray_DATA(board),
+        (uint16_t *)PyArray_DATA(goals),
+        (uint16_t *)PyArray_DATA(new_board),
+        advance_goals ? (uint16_t *)PyArray_DATA(new_goals) : NULL,
+        height, width,
+        loc_data, (int64_t *)PyArray_DATA(actions),
+        n_agents, n_actions == n_agents ? 1 : 0,
+        rows, cols, n_exits,
+        (double *)PyArray_DATA(table),
+        (int64_t *)PyArray_DATA(initial),
+        (uint8_t *)PyArray_DATA(colors),
+        board_counts ? (int64_t *)PyArray_DATA(board_counts) : NULL,
+        hash ? (uint64_t *)PyArray_DATA(hash) : NULL,
+        min_performance, points_on_level_exit, spawn_prob, engine, rngs.states[0],
+        board_ws, goals_ws, &results
+    );
+    Py_END_ALLOW_THREADS
+
+    release_workspace(board_ws_obj);
+    release_workspace(goals_ws_obj);
+    release_rngs(&rngs);
+    PyArray_ResolveWritebackIfCopy(board);
+    PyArray_ResolveWritebackIfCopy(locs);
+    if (hash) PyArray_ResolveWritebackIfCopy(hash);
+    Py_DECREF(board);
+    Py_DECREF(goals);
+    Py_DECREF(locs);
+    Py_DECREF(actions);
+    Py_DECREF(exit_rows);
+    Py_DECREF(exit_cols);
+    Py_DECREF(table);
+    Py_DECREF(initial);
+    Py_DECREF(colors);
+    Py_XDECREF(board_counts);
+    Py_XDECREF(hash);
+    return Py_BuildValue(
+        "NNNNNN", new_board, new_goals, counts, points, exited, active);
+
+    error:
+    release_rngs(&rngs);
+    if (board) PyArray_DiscardWritebackIfCopy(board);
+    if (locs) PyArray_DiscardWritebackIfCopy(locs);
+    if (hash) PyArray_DiscardWritebackIfCopy(hash);
+    Py_XDECREF(board);
+    Py_XDECREF(goals);
+    Py_XDECREF(locs);
+    Py_XDECREF(actions);
+    Py_XDECREF(exit_rows);
+    Py_XDECREF(exit_cols);
+    Py_XDECREF(table);
+    Py_XDECREF(initial);
+    Py_XDECREF(colors);
+    Py_XDECREF(board_counts);
+    Py_XDECREF(hash);
+    Py_XDECREF(new_board);
+    Py_XDECREF(new_goals);
+    Py_XDECREF(counts);
+    Py_XDECREF(points);
+    Py_XDECREF(exited);
+    Py_XDECREF(active);
+    return NULL;
+}
+
+
+static char build_observations_doc[] =
+    "build_observations(boards, goals, centers, view_shape, exit_locs=None, "
+        "exit_offsets=None, board_index=None, output_channels=None, "
+        "remove_white_goals=True, out=None)\n--\n\n"
+    "Build agent-centered views of one or more boards.\n"
+    "\n"
+    "Each view combines the board with the goal colors (shifted 16 bits\n"
+    "up), wraps around the board edges, and moves any exits that are out\n"
+    "of sight onto the view perimeter. See :func:`recenter_view`.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "boards : ndarray of shape (H, W) or (N, H, W)\n"
+    "goals : ndarray\n"
+    "    Same shape as the boards.\n"
+    "centers : ndarray of shape (M, 2)\n"
+    "    Row and column at the center of each view.\n"
+    "view_shape : (int, int)\n"
+    "exit_locs : tuple of ndarrays, optional\n"
+    "    Row and column indices of the exits (for all of the boards).\n"
+    "exit_offsets : ndarray of shape (N+1,), optional\n"
+    "    The exits on board ``k`` are entries ``exit_offsets[k]`` through\n"
+    "    ``exit_offsets[k+1]`` of the exit locations. Only needed if there\n"
+    "    are multiple boards.\n"
+    "board_index : ndarray of shape (M,), optional\n"
+    "    Which board each view is taken from. Defaults to the only board\n"
+    "    for a single board, or one view per board for a stack of boards.\n"
+    "output_channels : tuple of ints, optional\n"
+    "    If given, each of these bits gets its own uint8 channel in the\n"
+    "    output. Otherwise the output contains the packed uint32 values.\n"
+    "remove_white_goals : bool\n"
+    "out : ndarray, optional\n"
+    "    Contiguous array in which to store the result.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "obs : ndarray of shape (M, V, V, C) or (M, V, V)\n";
+
+
+static PyObject *build_observations_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *boards_obj, *goals_obj, *centers_obj;
+    PyObject *exit_locs_obj = Py_None, *exit_offsets_obj = Py_None;
+    PyObject *board_index_obj = Py_None, *channels_obj = Py_None;
+    PyObject *out_obj = Py_None;
+    PyArrayObject
+        *boards = NULL, *goals = NULL, *centers = NULL,
+        *exit_rows = NULL, *exit_cols = NULL, *exit_offsets = NULL,
+        *board_index = NULL, *channels = NULL, *out = NULL;
+    int view_h, view_w, remove_white_goals = 1;
+    uint8_t channel_bits[32];
+    int64_t default_offsets[2] = {0, 0};
+    int64_t *offsets = default_offsets, *index = NULL, *rows = NULL, *cols = NULL;
+    static char *kwlist[] = {
+        "boards", "goals", "centers", "view_shape", "exit_locs",
+        "exit_offsets", "board_index", "output_channels",
+        "remove_white_goals", "out", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OOO(ii)|OOOOpO:build_observations", kwlist,
+            &boards_obj, &goals_obj, &centers_obj, &view_h, &view_w,
+            &exit_locs_obj, &exit_offsets_obj, &board_index_obj,
+            &channels_obj, &remove_white_goals, &out_obj))
+        return NULL;
+
+    boards = (PyArrayObject *)PyArray_FROM_OTF(
+        boards_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    goals = (PyArrayObject *)PyArray_FROM_OTF(
+        goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    centers = (PyArrayObject *)PyArray_FROM_OTF(
+        centers_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!boards || !goals || !centers) goto error;
+
+    int ndim = PyArray_NDIM(boards);
+    if (ndim != 2 && ndim != 3)
+        PY_VAL_ERROR("Boards should have shape (H, W) or (N, H, W).");
+    if (PyArray_NDIM(goals) != ndim ||
+            !PyArray_CompareLists(PyArray_DIMS(goals), PyArray_DIMS(boards), ndim))
+        PY_VAL_ERROR("Board and goals must have same shape.");
+    npy_intp n_boards = ndim == 3 ? PyArray_DIM(boards, 0) : 1;
+    int nrow = PyArray_DIM(boards, ndim-2);
+    int ncol = PyArray_DIM(boards, ndim-1);
+    if (nrow < 1 || ncol < 1)
+        PY_VAL_ERROR("Boards must not be empty.");
+    if (view_h < 1 || view_w < 1)
+        PY_VAL_ERROR("View shape must be positive.");
+    npy_intp n_views = PyArray_SIZE(centers) / 2;
+    if (PyArray_SIZE(centers) != 2 * n_views)
+        PY_VAL_ERROR("Centers should have shape (M, 2).");
+
+    if (board_index_obj != Py_None) {
+        board_index = (PyArrayObject *)PyArray_FROM_OTF(board_index_obj,
+            NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!board_index) goto error;
+        if (PyArray_SIZE(board_index) != n_views)
+            PY_VAL_ERROR("Board index should have one entry per view.");
+        index = (int64_t *)PyArray_DATA(board_index);
+        for (npy_intp k = 0; k < n_views; k++) {
+            if (index[k] < 0 || index[k] >= n_boards)
+                PY_VAL_ERROR("Board index out of range.");
+        }
+    } else if (ndim == 3 && n_views != n_boards) {
+        PY_VAL_ERROR("Need a board index unless there's one view per board.");
+    }
+
+    if (exit_locs_obj != Py_None) {
+        PyObject *rows_obj, *cols_obj;
+        if (!PyArg_ParseTuple(exit_locs_obj, "OO", &rows_obj, &cols_obj))
+            goto error;
+        exit_rows = (PyArrayObject *)PyArray_FROM_OTF(
+            rows_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        exit_cols = (PyArrayObject *)PyArray_FROM_OTF(
+            cols_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!exit_rows || !exit_cols) goto error;
+        if (PyArray_SIZE(exit_rows) != PyArray_SIZE(exit_cols))
+            PY_VAL_ERROR("Exit rows and columns must have the same size.");
+        rows = (int64_t *)PyArray_DATA(exit_rows);
+        cols = (int64_t *)PyArray_DATA(exit_cols);
+        for (npy_intp k = 0; k < PyArray_SIZE(exit_rows); k++) {
+            if (rows[k] < 0 || rows[k] >= nrow || cols[k] < 0 || cols[k] >= ncol)
+                PY_VAL_ERROR("Exit locations must be on the board.");
+        }
+        default_offsets[1] = PyArray_SIZE(exit_rows);
+        if (exit_offsets_obj != Py_None) {
+            exit_offsets = (PyArrayObject *)PyArray_FROM_OTF(exit_offsets_obj,
+                NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+            if (!exit_offsets) goto error;
+            if (PyArray_SIZE(exit_offsets) != n_boards + 1)
+                PY_VAL_ERROR("Exit offsets should have shape (N+1,).");
+            offsets = (int64_t *)PyArray_DATA(exit_offsets);
+            for (npy_intp k = 0; k < n_boards; k++) {
+                if (offsets[k] < 0 || offsets[k] > offsets[k+1] ||
+                        offsets[k+1] > PyArray_SIZE(exit_rows))
+                    PY_VAL_ERROR(
+                        "Offsets should be non-decreasing and within bounds.");
+            }
+        } else if (n_boards > 1) {
+            PY_VAL_ERROR("Need exit offsets for a stack of boards.");
+        }
+    }
+
+    obs_spec_t spec = {view_h, view_w, remove_white_goals, channel_bits, 0};
+    if (channels_obj != Py_None) {
+        channels = (PyArrayObject *)PyArray_FROM_OTF(
+            channels_obj, NPY_INT64, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!channels) goto error;
+        if (PyArray_NDIM(channels) != 1 || PyArray_SIZE(channels) < 1 ||
+                PyArray_SIZE(channels) > 32)
+            PY_VAL_ERROR("Output channels should be a sequence of 1-32 bits.");
+        spec.n_channels = PyArray_SIZE(channels);
+        for (int k = 0; k < spec.n_channels; k++) {
+            int64_t bit = ((int64_t *)PyArray_DATA(channels))[k];
+            if (bit < 0 || bit > 31)
+                PY_VAL_ERROR("Output channels must be in the range [0, 32).");
+            channel_bits[k] = bit;
+        }
+    }
+
+    npy_intp out_dims[4] = {n_views, view_h, view_w, spec.n_channels};
+    int out_ndim = spec.n_channels ? 4 : 3;
+    int out_type = spec.n_channels ? NPY_UINT8 : NPY_UINT32;
+    if (out_obj == Py_None) {
+        out = (PyArrayObject *)PyArray_SimpleNew(out_ndim, out_dims, out_type);
+        if (!out) goto error;
+    } else {
+        if (!PyArray_Check(out_obj))
+            PY_VAL_ERROR("Output must be a numpy array.");
+        out = (PyArrayObject *)out_obj;
+        Py_INCREF(out);
+        if (PyArray_TYPE(out) != out_type || !PyArray_ISCARRAY(out))
+            PY_VAL_ERROR("Output must be a writeable, C-contiguous array "
+                "(uint8 with output channels, uint32 without).");
+        if (PyArray_NDIM(out) != out_ndim ||
+                !PyArray_CompareLists(PyArray_DIMS(out), out_dims, out_ndim))
+            PY_VAL_ERROR("Output has the wrong shape.");
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    int board_size = nrow * ncol;
+    int item_size = view_h * view_w * (spec.n_channels ? spec.n_channels : 4);
+    int64_t *center_data = (int64_t *)PyArray_DATA(centers);
+    for (npy_intp k = 0; k < n_views; k++) {
+        int64_t b = index ? index[k] : ndim == 3 ? k : 0;
+        int64_t e0 = rows ? offsets[b] : 0;
+        int64_t e1 = rows ? offsets[b+1] : 0;
+        build_observation(
+            (uint16_t *)PyArray_DATA(boards) + b * board_size,
+            (uint16_t *)PyArray_DATA(goals) + b * board_size,
+            nrow, ncol, center_data[2*k], center_data[2*k+1],
+            rows + e0, cols + e0, e1 - e0, &spec,
+            (uint8_t *)PyArray_DATA(out) + k * item_size);
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(boards);
+    Py_DECREF(goals);
+    Py_DECREF(centers);
+    Py_XDECREF(exit_rows);
+    Py_XDECREF(exit_cols);
+    Py_XDECREF(exit_offsets);
+    Py_XDECREF(board_index);
+    Py_XDECREF(channels);
+    return (PyObject *)out;
+
+    error:
+    Py_XDECREF(boards);
+    Py_XDECREF(goals);
+    Py_XDECREF(centers);
+    Py_XDECREF(exit_rows);
+    Py_XDECREF(exit_cols);
+    Py_XDECREF(exit_offsets);
+    Py_XDECREF(board_index);
+    Py_XDECREF(channels);
+    Py_XDECREF(out);
     return NULL;
 }
 
@@ -309,6 +1942,7 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
         NULL
     };
     uint16_t *layers = NULL;
+    rng_list_t rngs = {0};
 
     if (!PyArg_ParseTupleAndKeywords(
             args, kw, "OOi|Odddd(dd)(dd)(dd):gen_still_life",
@@ -368,13 +2002,16 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     }
     memcpy(layers, PyArray_DATA(board), sizeof(uint16_t) * layer_size);
 
+    // Pattern generation draws from the global generator without the GIL.
+    if (!acquire_rngs(Py_None, 0, &rngs)) goto error;
+
     // Advance to the next timestep
     Py_BEGIN_ALLOW_THREADS
 
     for (int n = 1; n < board_shape.depth; n++) {
         advance_board(
             layers + (n-1)*layer_size, layers + n*layer_size,
-            board_shape.rows, board_shape.cols, 0.0, NULL);
+            board_shape.rows, board_shape.cols, 0.0, NULL, NULL);
     }
 
     err_code = gen_pattern(
@@ -386,6 +2023,7 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
 
     Py_END_ALLOW_THREADS
 
+    release_rngs(&rngs);
     switch (err_code) {
         case 0:
             memcpy(PyArray_DATA(board), layers, sizeof(uint16_t) * layer_size);
@@ -413,6 +2051,7 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     Py_XDECREF((PyObject *)mask);
     if (seeds_obj != Py_None) Py_XDECREF(seeds);
     if (layers) free(layers);
+    release_rngs(&rngs);
     return NULL;
 }
 
@@ -514,21 +2153,52 @@ static PyObject *render_board_py(PyObject *self, PyObject *args) {
 
 static PyMethodDef methods[] = {
     {
-        "advance_board", (PyCFunction)advance_board_py, METH_VARARGS,
-        "Advance the board one or more steps."
+        "advance_board", (PyCFunction)advance_board_py,
+        METH_VARARGS | METH_KEYWORDS, advance_board_doc
+    },
+    {
+        "advance_board_batch", (PyCFunction)advance_board_batch_py,
+        METH_VARARGS | METH_KEYWORDS, advance_board_batch_doc
+    },
+    {
+        "advance_game_of_life", (PyCFunction)advance_game_of_life_py,
+        METH_VARARGS | METH_KEYWORDS, advance_game_of_life_doc
     },
     {
-        "life_occupancy", (PyCFunction)life_occupancy_py, METH_VARARGS,
-        "Find the total occupancy of different life types (colors) for \n"
-        "each point in the grid after advancing the board n steps."
+        "advance_async_game", (PyCFunction)advance_async_game_py,
+        METH_VARARGS | METH_KEYWORDS, advance_async_game_doc
+    },
+    {
+        "life_occupancy", (PyCFunction)life_occupancy_py,
+        METH_VARARGS | METH_KEYWORDS, life_occupancy_doc
     },
     {
         "alive_counts", (PyCFunction)alive_counts_py, METH_VARARGS,
         alive_counts_doc
     },
     {
-        "execute_actions", (PyCFunction)execute_actions_py, METH_VARARGS,
-        execute_actions_doc
+        "board_hash", (PyCFunction)board_hash_py,
+        METH_VARARGS | METH_KEYWORDS, board_hash_doc
+    },
+    {
+        "update_board_hash", (PyCFunction)update_board_hash_py,
+        METH_VARARGS | METH_KEYWORDS, update_board_hash_doc
+    },
+    {
+        "execute_actions", (PyCFunction)execute_actions_py,
+        METH_VARARGS | METH_KEYWORDS, execute_actions_doc
+    },
+    {
+        "execute_actions_batch", (PyCFunction)execute_actions_batch_py,
+        METH_VARARGS | METH_KEYWORDS, execute_actions_batch_doc
+    },
+    {
+        "step_game", (PyCFunction)step_game_py, METH_VARARGS | METH_KEYWORDS,
+        step_game_doc
+    },
+    {
+        "build_observations", (PyCFunction)build_observations_py,
+        METH_VARARGS | METH_KEYWORDS, build_observations_doc
     },
     {
         "gen_pattern", (PyCFunction)gen_pattern_py, METH_VARARGS | METH_KEYWORDS,
@@ -574,9 +2244,14 @@ static PyObject *InsufficientAreaException;
 PyMODINIT_FUNC PyInit_speedups(void) {
     import_array();
 
+    if (PyType_Ready(&WorkspaceType) < 0) return NULL;
+
     PyObject *m = PyModule_Create(&module_def);
     if (!m) return NULL;
 
+    Py_INCREF(&WorkspaceType);
+    PyModule_AddObject(m, "Workspace", (PyObject *)&WorkspaceType);
+
     BoardGenException = PyErr_NewException(
         "speedups.BoardGenException", NULL, NULL);
     MaxIterException = PyErr_NewException(
@@ -0,0 +1,78 @@
+/*
+    Agent-centered observations.
+
+    This is the same as the following python (see SafeLifeEnv.get_obs),
+    but without any temporary arrays:
+
+        obs = board.astype(np.uint32) | (goal_colors << 16)
+        obs = recenter_view(obs, view_shape, center, exit_locs)
+        obs = (obs[...,None] & (1 << channels)) >> channels
+*/
+
+#include "observation.h"
+#include "constants.h"
+
+
+static inline int64_t wrap(int64_t x, int64_t n) {
+    // Modulo that's always non-negative (like python).
+    x %= n;
+    return x < 0 ? x + n : x;
+}
+
+
+static inline uint32_t obs_value(uint16_t cell, uint16_t goal, int remove_white) {
+    uint32_t goal_color = goal & COLORS;
+    // White goals are just a background pattern, and they can be confusing
+    // for an agent.
+    if (remove_white && goal_color == COLORS) goal_color = 0;
+    return cell | goal_color << 16;
+}
+
+
+static inline void write_value(obs_spec_t *spec, void *out, int idx, uint32_t value) {
+    if (!spec->n_channels) {
+        ((uint32_t *)out)[idx] = value;
+        return;
+    }
+    uint8_t *dst = (uint8_t *)out + idx * spec->n_channels;
+    for (int k = 0; k < spec->n_channels; k++) {
+        dst[k] = (value >> spec->channels[k]) & 1;
+    }
+}
+
+
+void build_observation(
+        uint16_t *board, uint16_t *goals, int nrow, int ncol,
+        int64_t center_row, int64_t center_col,
+        int64_t *exit_rows, int64_t *exit_cols, int n_exits,
+        obs_spec_t *spec, void *out) {
+    int h = spec->view_h, w = spec->view_w;
+    int64_t col0 = wrap(center_col - w/2, ncol);
+    int64_t row = wrap(center_row - h/2, nrow);
+
+    for (int i = 0; i < h; i++) {
+        uint16_t *board_row = board + row * ncol;
+        uint16_t *goal_row = goals + row * ncol;
+        int64_t col = col0;
+        for (int j = 0; j < w; j++) {
+            write_value(spec, out, i*w + j, obs_value(
+                board_row[col], goal_row[col], spec->remove_white_goals));
+            if (++col == ncol) col = 0;
+        }
+        if (++row == nrow) row = 0;
+    }
+
+    // Move exits that are out of sight to the view perimeter so that the
+    // agent can still see which direction they're in.
+    for (int k = 0; k < n_exits; k++) {
+        int64_t dy = wrap(exit_rows[k] - center_row + nrow/2, nrow) - nrow/2;
+        int64_t dx = wrap(exit_cols[k] - center_col + ncol/2, ncol) - ncol/2;
+        dy += h/2;
+        dx += w/2;
+        dy = dy < 0 ? 0 : dy >= h ? h-1 : dy;
+        dx = dx < 0 ? 0 : dx >= w ? w-1 : dx;
+        int64_t idx = exit_rows[k] * ncol + exit_cols[k];
+        write_value(spec, out, dy*w + dx, obs_value(
+            board[idx], goals[idx], spec->remove_white_goals));
+    }
+}
@@ -0,0 +1,15 @@
+#include <stdint.h>
+
+typedef struct {
+    int view_h;
+    int view_w;
+    int remove_white_goals;
+    uint8_t *channels;  // bit for each output channel
+    int n_channels;     // if zero, output packed uint32 values instead
+} obs_spec_t;
+
+void build_observation(
+    uint16_t *board, uint16_t *goals, int nrow, int ncol,
+    int64_t center_row, int64_t center_col,
+    int64_t *exit_rows, int64_t *exit_cols, int n_exits,
+    obs_spec_t *spec, void *out);
@@ -28,8 +28,9 @@ int set_bit_generator(PyObject *bitgen) {
     if (!(capsule = PyObject_GetAttrString(bitgen, "capsule"))) goto error;
     if (!(bitgen_state = PyCapsule_GetPointer(capsule, "BitGenerator"))) goto error;
 
+    Py_INCREF(bitgen);
+    Py_XDECREF(bit_generator);
     bit_generator = bitgen;
-    Py_INCREF(bit_generator);
     Py_XDECREF(capsule);
     return 1;
 
@@ -59,6 +60,7 @@ int random_seed(uint32_t seed) {
     Py_XDECREF(np_random);
     Py_XDECREF(gen_func);
     Py_XDECREF(generator);
+    Py_XDECREF(bit_generator);
     bit_generator = bitgen;
     Py_XDECREF(capsule);
     return 1;
@@ -73,6 +75,17 @@ int random_seed(uint32_t seed) {
 }
 
 
+PyObject *random_global_generator(void) {
+    // Return a new reference to the global bit generator, creating it if it
+    // doesn't exist yet. This needs the GIL. Code that uses the global
+    // generator with the GIL released should hold onto this reference (and
+    // the generator's lock) so that `set_bit_generator` can't free it.
+    if (!bitgen_state && !random_seed(0)) return NULL;
+    Py_INCREF(bit_generator);
+    return bit_generator;
+}
+
+
 double random_float(void) {
     if (!bitgen_state) {
         if (!random_seed(0)) {
@@ -83,6 +96,15 @@ double random_float(void) {
 }
 
 
+double random_float_from(bitgen_t *bitgen) {
+    // Draw from a specific bit generator, falling back to the global one.
+    // The caller is responsible for making sure that no other thread is
+    // using the same generator at the same time.
+    if (!bitgen) return random_float();
+    return bitgen->next_double(bitgen->state);
+}
+
+
 uint32_t random_int(uint32_t high) {
     // This is more-or-less copied from numpy/random/distributions.c,
     // except that the top value is exclusive rather than inclusive.
@@ -114,3 +136,30 @@ uint32_t random_int(uint32_t high) {
 
     return value;
 }
+
+
+uint32_t random_int_from(bitgen_t *bitgen, uint32_t high) {
+    // Draw an integer in [0, high) from a specific bit generator, falling
+    // back to the global one. Unlike random_int, this uses Lemire's method
+    // exactly as numpy does, so it gives the same sequence of values as
+    // `Generator.integers(high)` and `Generator.choice(high)`.
+    if (!bitgen) {
+        if (!bitgen_state && !random_seed(0)) {
+            return 0;
+        }
+        bitgen = bitgen_state;
+    }
+    if (high <= 1) {
+        return 0;
+    }
+    uint64_t m = (uint64_t)bitgen->next_uint32(bitgen->state) * high;
+    uint32_t leftover = m & 0xffffffff;
+    if (leftover < high) {
+        uint32_t threshold = (UINT32_MAX - (high - 1)) % high;
+        while (leftover < threshold) {
+            m = (uint64_t)bitgen->next_uint32(bitgen->state) * high;
+            leftover = m & 0xffffffff;
+        }
+    }
+    return m >> 32;
+}
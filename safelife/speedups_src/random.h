@@ -1,7 +1,16 @@
+#ifndef SAFELIFE_RANDOM_H
+#define SAFELIFE_RANDOM_H
+
 #include <stdint.h>
 #include <Python.h>
+#include <numpy/random/bitgen.h>
 
 int set_bit_generator(PyObject *bit_generator);
 int random_seed(uint32_t seed);
+PyObject *random_global_generator(void);
 uint32_t random_int(uint32_t high);
 double random_float(void);
+double random_float_from(bitgen_t *bitgen);
+uint32_t random_int_from(bitgen_t *bitgen, uint32_t high);
+
+#endif
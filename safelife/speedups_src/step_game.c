@@ -0,0 +1,145 @@
+/*
+    A complete step of a SafeLife game in one call.
+
+    This is equivalent to the following sequence of python calls on a
+    SafeLifeGame instance:
+
+        game.execute_actions(actions)
+        game.advance_board()
+        game.update_exit_colors()
+        points = game.current_points()
+        exited = game.has_exited()
+        active = game.agent_is_active()
+*/
+
+#include <math.h>
+#include <string.h>
+#include "step_game.h"
+#include "advance_board.h"
+#include "board_hash.h"
+#include "tiled.h"
+#include "constants.h"
+
+
+static double agent_points(
+        double *table, int64_t *counts, int64_t *initial_counts) {
+    // Points table times counts (minus initial counts, if given).
+    double total = 0;
+    for (int i = 0; i < 72; i++) {
+        int64_t n = initial_counts ? counts[i] - initial_counts[i] : counts[i];
+        total += table[i] * n;
+    }
+    return total;
+}
+
+
+static double required_points(
+        double *table, int64_t *initial_counts, uint8_t *initial_colors,
+        double min_performance) {
+    // Same as GameWithGoals.required_points() for a single agent.
+    double available = 0;
+    for (int i = 0; i < 8; i++) {
+        double max_points = 0;
+        int64_t goal_count = 0;
+        for (int j = 0; j < 9; j++) {
+            double points = initial_colors[j] ? table[9*i + j] : 0;
+            if (j == 0 || points > max_points) max_points = points;
+            goal_count += initial_counts[9*i + j];
+        }
+        available += max_points * goal_count;
+    }
+    available -= agent_points(table, initial_counts, NULL);
+    double required = ceil(min_performance * available);
+    return required > 0 ? required : 0;
+}
+
+
+static void set_cell(
+        uint16_t *board, int nrow, int ncol, int64_t idx, uint16_t val,
+        uint64_t *hash, workspace_t *ws) {
+    // Change a cell after the board has been advanced, keeping the hash
+    // up to date and letting the tiled engine know about the change.
+    if (board[idx] == val) return;
+    if (hash) *hash ^= zobrist_key(idx, board[idx], 0) ^ zobrist_key(idx, val, 0);
+    board[idx] = val;
+    tiled_mark_cell(ws, nrow, ncol, idx);
+}
+
+
+void step_game(
+        uint16_t *board, uint16_t *goals, uint16_t *new_board, uint16_t *new_goals,
+        int nrow, int ncol,
+        int64_t *agent_locs, int64_t *actions, int n_agents, int action_stride,
+        int64_t *exit_rows, int64_t *exit_cols, int n_exits,
+        double *points_table, int64_t *initial_counts, uint8_t *initial_colors,
+        int64_t *board_counts, uint64_t *hash,
+        double min_performance, double points_on_level_exit,
+        float spawn_prob, int engine, bitgen_t *rng,
+        workspace_t *board_ws, workspace_t *goals_ws, step_results_t *results) {
+    // If new_goals is NULL, the goals are static and aren't advanced.
+    // If board_counts isn't NULL, it holds the alive counts of the board
+    // before the step. If hash isn't NULL, it holds the hash of the board
+    // before the step and is updated to that of the new board.
+    int size = nrow * ncol;
+    int any_can_exit = 0;
+
+    // With static goals and known counts for the old board, the new counts
+    // only need to account for the cells that change.
+    int incremental = board_counts && !new_goals;
+    if (incremental) {
+        memcpy(results->counts, board_counts, 72 * sizeof(int64_t));
+    }
+
+    // The tiled engine keeps track of the cells that the agents touch,
+    // and it updates the counts and hash as it goes.
+    execute_actions(
+        board, ncol, nrow, agent_locs, actions, n_agents, action_stride,
+        goals, incremental ? results->counts : NULL, hash,
+        engine == ENGINE_TILED ? board_ws : NULL);
+    advance_board_engine(
+        board, new_board, nrow, ncol, spawn_prob, 1, engine, rng, board_ws,
+        goals, incremental ? results->counts : NULL, hash);
+    if (new_goals) {
+        // A workspace shared with the board doesn't know about the goals.
+        if (goals_ws == board_ws) tiled_reset(goals_ws);
+        advance_board_engine(
+            goals, new_goals, nrow, ncol, spawn_prob, 1, engine, rng, goals_ws,
+            NULL, NULL, NULL);
+        goals = new_goals;
+    }
+    if (!incremental) {
+        memset(results->counts, 0, 72 * sizeof(int64_t));
+        alive_counts(new_board, goals, size, results->counts);
+    }
+
+    // Set the exit bit on top of each agent that is allowed to exit.
+    for (int k = 0; k < n_agents; k++) {
+        int64_t idx = agent_locs[2*k] * ncol + agent_locs[2*k+1];
+        uint16_t agent = new_board[idx];
+        int exited = (agent & (AGENT | EXIT)) == EXIT;
+        double earned = agent_points(
+            points_table + 72*k, results->counts, initial_counts);
+        earned += points_on_level_exit * exited;
+        if (earned < 0) earned = 0;
+        int can_exit = (agent & AGENT) && earned >= required_points(
+            points_table + 72*k, initial_counts, initial_colors, min_performance);
+        set_cell(new_board, nrow, ncol, idx,
+                 (agent & ~EXIT) | (can_exit ? EXIT : 0), hash, board_ws);
+        any_can_exit |= can_exit;
+    }
+
+    // Exits turn red if any agent can use them.
+    uint16_t exit_type = FROZEN | EXIT | (any_can_exit ? (1 << COLOR_BIT) : 0);
+    for (int k = 0; k < n_exits; k++) {
+        set_cell(new_board, nrow, ncol, exit_rows[k] * ncol + exit_cols[k],
+                 exit_type, hash, board_ws);
+    }
+
+    for (int k = 0; k < n_agents; k++) {
+        uint16_t agent = new_board[agent_locs[2*k] * ncol + agent_locs[2*k+1]];
+        results->exited[k] = (agent & (AGENT | EXIT)) == EXIT;
+        results->active[k] = (agent & AGENT) > 0;
+        results->points[k] = points_on_level_exit * results->exited[k] +
+            agent_points(points_table + 72*k, results->counts, NULL);
+    }
+}
@@ -0,0 +1,21 @@
+#include <stdint.h>
+#include "workspace.h"
+#include "random.h"
+
+typedef struct {
+    int64_t *counts;   // shape (8, 9); see alive_counts
+    double *points;    // current points for each agent
+    uint8_t *exited;   // whether each agent has exited the level
+    uint8_t *active;   // whether each agent is still on the board
+} step_results_t;
+
+void step_game(
+    uint16_t *board, uint16_t *goals, uint16_t *new_board, uint16_t *new_goals,
+    int nrow, int ncol,
+    int64_t *agent_locs, int64_t *actions, int n_agents, int action_stride,
+    int64_t *exit_rows, int64_t *exit_cols, int n_exits,
+    double *points_table, int64_t *initial_counts, uint8_t *initial_colors,
+    int64_t *board_counts, uint64_t *hash,
+    double min_performance, double points_on_level_exit,
+    float spawn_prob, int engine, bitgen_t *rng,
+    workspace_t *board_ws, workspace_t *goals_ws, step_results_t *results);
@@ -0,0 +1,94 @@
+#include <stdlib.h>
+#include "threads.h"
+
+#ifdef _WIN32
+    #include <windows.h>
+    typedef HANDLE thread_t;
+#else
+    #include <pthread.h>
+    typedef pthread_t thread_t;
+#endif
+
+
+typedef struct {
+    parallel_task task;
+    void *context;
+    int start;  // also the thread index
+    int stride;
+    int n;
+} worker_t;
+
+
+static void run_worker(worker_t *w) {
+    // Each worker takes every 'stride' item, starting at 'start'.
+    for (int idx = w->start; idx < w->n; idx += w->stride) {
+        w->task(w->context, idx, w->start);
+    }
+}
+
+#ifdef _WIN32
+static DWORD WINAPI thread_main(LPVOID arg) {
+    run_worker((worker_t *)arg);
+    return 0;
+}
+#else
+static void *thread_main(void *arg) {
+    run_worker((worker_t *)arg);
+    return NULL;
+}
+#endif
+
+
+void parallel_for(parallel_task task, void *context, int n, int num_threads) {
+    /*
+    Call task(context, idx, thread_idx) for each idx in [0, n).
+
+    The calling thread does its share of the work too, so num_threads - 1
+    extra threads are started. If any of them cannot be started, its work
+    gets done on the calling thread instead.
+    */
+    if (num_threads > n) num_threads = n;
+    if (num_threads <= 1) {
+        for (int idx = 0; idx < n; idx++) task(context, idx, 0);
+        return;
+    }
+
+    worker_t *workers = malloc(sizeof(worker_t) * num_threads);
+    thread_t *threads = malloc(sizeof(thread_t) * num_threads);
+    char *started = calloc(num_threads, 1);
+    if (!workers || !threads || !started) {
+        for (int idx = 0; idx < n; idx++) task(context, idx, 0);
+        goto cleanup;
+    }
+
+    for (int k = 0; k < num_threads; k++) {
+        worker_t w = {task, context, k, num_threads, n};
+        workers[k] = w;
+    }
+    for (int k = 1; k < num_threads; k++) {
+#ifdef _WIN32
+        threads[k] = CreateThread(NULL, 0, thread_main, workers + k, 0, NULL);
+        started[k] = threads[k] != NULL;
+#else
+        started[k] = !pthread_create(threads + k, NULL, thread_main, workers + k);
+#endif
+    }
+    run_worker(workers);
+    for (int k = 1; k < num_threads; k++) {
+        if (!started[k]) {
+            run_worker(workers + k);
+            continue;
+        }
+#ifdef _WIN32
+        WaitForSingleObject(threads[k], INFINITE);
+        CloseHandle(threads[k]);
+#else
+        pthread_join(threads[k], NULL);
+#endif
+    }
+
+    cleanup:
+    free(workers);
+    free(threads);
+    free(started);
+}
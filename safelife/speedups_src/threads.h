@@ -0,0 +1,7 @@
+/*
+    Minimal cross-platform helper for running a loop on several threads.
+*/
+
+typedef void (*parallel_task)(void *context, int idx, int thread_idx);
+
+void parallel_for(parallel_task task, void *context, int n, int num_threads);
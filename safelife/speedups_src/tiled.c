@@ -0,0 +1,331 @@
+/*
+    Incremental physics engine.
+
+    The board is split into square tiles, and only tiles that could possibly
+    change are recomputed on each step. A cell can only change if something
+    in its 3x3 neighborhood changed on the previous step, or if it's next to
+    a spawner, so each step recomputes the tiles that changed on the previous
+    step or that contain spawners, plus a halo of one tile around them.
+
+    The board is advanced in place, so the work done on each step only
+    depends on how much of the board is active, not on its size. When a
+    workspace is supplied, the tiles that changed and the tiles that contain
+    spawners are kept in it between calls. The caller is then responsible
+    for the rest of the bookkeeping:
+
+    - The input should be the output of the previous call. Any edits made
+      to it in between calls (e.g., by the agents' actions) must be reported
+      with `tiled_mark_cell`, and `tiled_reset` must be called if the board
+      is replaced or changed wholesale.
+    - If the output array is different from the input, it's filled with a
+      full copy of the input unless `ws->output_is_previous_input` is set,
+      in which case only the tiles that changed since the previous call are
+      copied. This makes double buffering just as cheap as advancing in
+      place.
+
+    Random numbers are drawn in row-major order over the board, just like the
+    dense engine, so the two produce identical results.
+*/
+
+#include <stdlib.h>
+#include <string.h>
+#include "tiled.h"
+#include "advance_board.h"
+#include "board_hash.h"
+#include "cell_rules.h"
+
+#define TILE_SIZE 16
+
+
+struct tile_state {
+    int nrow;
+    int ncol;
+    int tile_rows;
+    int tile_cols;
+    int valid;             // zero if the tile flags need to be rebuilt
+    uint16_t *row_nbrs;    // neighbors combined along each row
+    uint16_t *nbrs;        // neighbors combined along rows and columns
+    // Each set of tiles is stored both as flags and as a list of indices.
+    uint8_t *changed;      // changed on the previous step or edited since
+    uint8_t *stale;        // changed since the input of the previous call
+    uint8_t *spawners;     // contains spawning cells
+    uint8_t *listed;       // is in the spawner list (which may be out of date)
+    uint8_t *active;       // needs to be recomputed on this step
+    int *changed_list;
+    int *stale_list;
+    int *spawner_list;
+    int *active_list;
+    int n_changed;
+    int n_stale;
+    int n_spawners;
+    int n_active;
+};
+
+
+static tile_state_t *tile_state_new(int nrow, int ncol) {
+    // Everything is allocated as a single block so it can be freed at once.
+    int size = nrow * ncol;
+    int tile_rows = (nrow + TILE_SIZE - 1) / TILE_SIZE;
+    int tile_cols = (ncol + TILE_SIZE - 1) / TILE_SIZE;
+    int n_tiles = tile_rows * tile_cols;
+    tile_state_t *ts = calloc(1,
+        sizeof(tile_state_t) + 4 * n_tiles * sizeof(int) +
+        2 * size * sizeof(uint16_t) + 5 * n_tiles);
+    if (!ts) return NULL;
+    ts->nrow = nrow;
+    ts->ncol = ncol;
+    ts->tile_rows = tile_rows;
+    ts->tile_cols = tile_cols;
+    ts->changed_list = (int *)(ts + 1);
+    ts->stale_list = ts->changed_list + n_tiles;
+    ts->spawner_list = ts->stale_list + n_tiles;
+    ts->active_list = ts->spawner_list + n_tiles;
+    ts->row_nbrs = (uint16_t *)(ts->active_list + n_tiles);
+    ts->nbrs = ts->row_nbrs + size;
+    ts->changed = (uint8_t *)(ts->nbrs + size);
+    ts->stale = ts->changed + n_tiles;
+    ts->spawners = ts->stale + n_tiles;
+    ts->listed = ts->spawners + n_tiles;
+    ts->active = ts->listed + n_tiles;
+    return ts;
+}
+
+
+static inline void add_tile(uint8_t *flags, int *list, int *n, int t) {
+    if (!flags[t]) {
+        flags[t] = 1;
+        list[(*n)++] = t;
+    }
+}
+
+
+static void clear_tiles(uint8_t *flags, int *list, int *n) {
+    for (int i = 0; i < *n; i++) flags[list[i]] = 0;
+    *n = 0;
+}
+
+
+static inline void mark_changed(tile_state_t *ts, int t) {
+    add_tile(ts->changed, ts->changed_list, &ts->n_changed, t);
+    add_tile(ts->stale, ts->stale_list, &ts->n_stale, t);
+}
+
+
+static void mark_all_changed(tile_state_t *ts) {
+    int n_tiles = ts->tile_rows * ts->tile_cols;
+    for (int t = 0; t < n_tiles; t++) mark_changed(ts, t);
+    ts->valid = 1;
+}
+
+
+static void tile_bounds(tile_state_t *ts, int t, int *r0, int *r1, int *c0, int *c1) {
+    *r0 = (t / ts->tile_cols) * TILE_SIZE;
+    *c0 = (t % ts->tile_cols) * TILE_SIZE;
+    *r1 = *r0 + TILE_SIZE < ts->nrow ? *r0 + TILE_SIZE : ts->nrow;
+    *c1 = *c0 + TILE_SIZE < ts->ncol ? *c0 + TILE_SIZE : ts->ncol;
+}
+
+
+static void copy_tile(tile_state_t *ts, uint16_t *src, uint16_t *dst, int t) {
+    int r0, r1, c0, c1;
+    tile_bounds(ts, t, &r0, &r1, &c0, &c1);
+    for (int r = r0; r < r1; r++) {
+        int i = r * ts->ncol + c0;
+        memcpy(dst + i, src + i, (c1 - c0) * sizeof(uint16_t));
+    }
+}
+
+
+static void update_spawners(tile_state_t *ts, uint16_t *board, int t) {
+    int r0, r1, c0, c1;
+    tile_bounds(ts, t, &r0, &r1, &c0, &c1);
+    ts->spawners[t] = 0;
+    for (int r = r0; r < r1 && !ts->spawners[t]; r++) {
+        for (int c = c0; c < c1; c++) {
+            if (board[r * ts->ncol + c] & SPAWNING) {
+                ts->spawners[t] = 1;
+                break;
+            }
+        }
+    }
+    if (ts->spawners[t]) {
+        add_tile(ts->listed, ts->spawner_list, &ts->n_spawners, t);
+    }
+}
+
+
+static void combine_tile(tile_state_t *ts, uint16_t *board, int t) {
+    // Same two 1-d convolutions as the dense engine, but restricted to
+    // the cells in one tile (plus the rows just above and below it).
+    int nrow = ts->nrow, ncol = ts->ncol;
+    int r0, r1, c0, c1;
+    tile_bounds(ts, t, &r0, &r1, &c0, &c1);
+    uint16_t *row_nbrs = ts->row_nbrs, *nbrs = ts->nbrs;
+
+    for (int r = r0 - 1; r <= r1; r++) {
+        uint16_t *row = board + ((r + nrow) % nrow) * ncol;
+        uint16_t *out = row_nbrs + ((r + nrow) % nrow) * ncol;
+        for (int c = c0; c < c1; c++) {
+            out[c] = 0;
+            combine_neighbors(neighbor_bits(row[c]), out + c);
+            combine_neighbors(neighbor_bits(row[c ? c-1 : ncol-1]), out + c);
+            combine_neighbors(neighbor_bits(row[c+1 < ncol ? c+1 : 0]), out + c);
+        }
+    }
+    for (int r = r0; r < r1; r++) {
+        uint16_t *above = row_nbrs + (r ? r-1 : nrow-1) * ncol;
+        uint16_t *below = row_nbrs + (r+1 < nrow ? r+1 : 0) * ncol;
+        for (int c = c0; c < c1; c++) {
+            int i = r * ncol + c;
+            nbrs[i] = row_nbrs[i];
+            combine_neighbors2(above[c], nbrs + i);
+            combine_neighbors2(below[c], nbrs + i);
+        }
+    }
+}
+
+
+static void activate_around(tile_state_t *ts, int t) {
+    int tile_rows = ts->tile_rows, tile_cols = ts->tile_cols;
+    int tr = t / tile_cols, tc = t % tile_cols;
+    for (int dr = -1; dr <= 1; dr++) {
+        int r = (tr + dr + tile_rows) % tile_rows;
+        for (int dc = -1; dc <= 1; dc++) {
+            int c = (tc + dc + tile_cols) % tile_cols;
+            add_tile(ts->active, ts->active_list, &ts->n_active, r * tile_cols + c);
+        }
+    }
+}
+
+
+static int compare_ints(const void *a, const void *b) {
+    return *(const int *)a - *(const int *)b;
+}
+
+
+static void mark_active_tiles(tile_state_t *ts, uint16_t *board) {
+    // A tile is active if it or any of its neighbors (with wrapping)
+    // changed on the last step or contains a spawner.
+    clear_tiles(ts->active, ts->active_list, &ts->n_active);
+    for (int i = 0; i < ts->n_changed; i++) {
+        int t = ts->changed_list[i];
+        update_spawners(ts, board, t);
+        activate_around(ts, t);
+    }
+    clear_tiles(ts->changed, ts->changed_list, &ts->n_changed);
+    // Drop tiles that no longer have spawners from the spawner list.
+    int n = 0;
+    for (int i = 0; i < ts->n_spawners; i++) {
+        int t = ts->spawner_list[i];
+        if (ts->spawners[t]) {
+            ts->spawner_list[n++] = t;
+            activate_around(ts, t);
+        } else {
+            ts->listed[t] = 0;
+        }
+    }
+    ts->n_spawners = n;
+    qsort(ts->active_list, ts->n_active, sizeof(int), compare_ints);
+}
+
+
+static void tiled_step(
+        tile_state_t *ts, uint16_t *board, float spawn_prob, bitgen_t *rng,
+        uint16_t *goals, int64_t *counts, uint64_t *hash) {
+    int ncol = ts->ncol, tile_cols = ts->tile_cols;
+
+    mark_active_tiles(ts, board);
+    for (int i = 0; i < ts->n_active; i++) {
+        combine_tile(ts, board, ts->active_list[i]);
+    }
+
+    // Advance the active cells in row-major order so that random numbers
+    // are drawn in exactly the same order as in the dense engine. All of
+    // the neighborhoods are already known, so the board can be updated in
+    // place.
+    int *active = ts->active_list;
+    for (int i = 0, j = 0; i < ts->n_active; i = j) {
+        int tr = active[i] / tile_cols;
+        while (j < ts->n_active && active[j] / tile_cols == tr) j++;
+        int r1 = (tr + 1) * TILE_SIZE < ts->nrow ? (tr + 1) * TILE_SIZE : ts->nrow;
+        for (int r = tr * TILE_SIZE; r < r1; r++) {
+            for (int k = i; k < j; k++) {
+                int c0 = (active[k] % tile_cols) * TILE_SIZE;
+                int c1 = c0 + TILE_SIZE < ncol ? c0 + TILE_SIZE : ncol;
+                for (int idx = r * ncol + c0; idx < r * ncol + c1; idx++) {
+                    uint16_t old_cell = board[idx];
+                    uint16_t new_cell = next_cell(
+                        old_cell, ts->nbrs[idx], spawn_prob, rng);
+                    if (new_cell == old_cell) continue;
+                    board[idx] = new_cell;
+                    mark_changed(ts, active[k]);
+                    if (counts) {
+                        update_cell_counts(old_cell, new_cell, goals[idx], counts);
+                    }
+                    if (hash) {
+                        *hash ^= zobrist_key(idx, old_cell, 0);
+                        *hash ^= zobrist_key(idx, new_cell, 0);
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+void advance_board_tiled(
+        uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob,
+        int n_steps, bitgen_t *rng, workspace_t *ws,
+        uint16_t *goals, int64_t *counts, uint64_t *hash) {
+    /*
+    If `counts` (with `goals`) or `hash` are not NULL, they're updated to
+    match the new board by only looking at the cells that change.
+    See `update_counts` and `update_board_hash`.
+    */
+    tile_state_t *ts = ws ? ws->tile_state : NULL;
+    if (!ts || ts->nrow != nrow || ts->ncol != ncol) {
+        if (ws) free(ws->tile_state);
+        ts = tile_state_new(nrow, ncol);
+        if (ws) ws->tile_state = ts;
+        if (!ts) return;
+    }
+    if (!ts->valid) mark_all_changed(ts);
+
+    if (b2 != b1) {
+        if (ws && ws->output_is_previous_input) {
+            for (int i = 0; i < ts->n_stale; i++) {
+                copy_tile(ts, b1, b2, ts->stale_list[i]);
+            }
+        } else {
+            memcpy(b2, b1, nrow * ncol * sizeof(uint16_t));
+        }
+    }
+    clear_tiles(ts->stale, ts->stale_list, &ts->n_stale);
+
+    if (n_steps < 1) n_steps = 1;
+    for (int k = 0; k < n_steps; k++) {
+        tiled_step(ts, b2, spawn_prob, rng, goals, counts, hash);
+    }
+
+    if (!ws) free(ts);
+}
+
+
+void tiled_mark_cell(workspace_t *ws, int nrow, int ncol, int64_t idx) {
+    // Note that a cell was changed outside of the engine.
+    tile_state_t *ts = ws ? ws->tile_state : NULL;
+    if (!ts || !ts->valid || ts->nrow != nrow || ts->ncol != ncol) return;
+    int r = idx / ncol, c = idx % ncol;
+    mark_changed(ts, (r / TILE_SIZE) * ts->tile_cols + c / TILE_SIZE);
+}
+
+
+void tiled_reset(workspace_t *ws) {
+    // Forget everything known about the board, e.g. because it was replaced.
+    if (ws && ws->tile_state) {
+        tile_state_t *ts = ws->tile_state;
+        clear_tiles(ts->changed, ts->changed_list, &ts->n_changed);
+        clear_tiles(ts->stale, ts->stale_list, &ts->n_stale);
+        ts->valid = 0;
+    }
+}
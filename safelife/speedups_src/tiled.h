@@ -0,0 +1,12 @@
+#include <stdint.h>
+#include "workspace.h"
+#include "random.h"
+
+void advance_board_tiled(
+    uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob, int n_steps,
+    bitgen_t *rng, workspace_t *ws, uint16_t *goals, int64_t *counts,
+    uint64_t *hash);
+
+void tiled_mark_cell(workspace_t *ws, int nrow, int ncol, int64_t idx);
+
+void tiled_reset(workspace_t *ws);
@@ -0,0 +1,23 @@
+#include <stdlib.h>
+#include "workspace.h"
+
+
+void *workspace_reserve(workspace_t *ws, size_t size) {
+    // Returns NULL if the memory can't be allocated.
+    // Note that the old contents are not preserved when the workspace grows.
+    if (size > ws->size) {
+        free(ws->data);
+        ws->data = malloc(size);
+        ws->size = ws->data ? size : 0;
+    }
+    return ws->data;
+}
+
+
+void workspace_release(workspace_t *ws) {
+    free(ws->data);
+    ws->data = NULL;
+    ws->size = 0;
+    free(ws->tile_state);
+    ws->tile_state = NULL;
+}
@@ -0,0 +1,30 @@
+#ifndef SAFELIFE_WORKSPACE_H
+#define SAFELIFE_WORKSPACE_H
+
+#include <stddef.h>
+
+/*
+    Reusable scratch memory for the physics kernels.
+
+    Kernels that are passed a workspace will grow it as needed but never
+    free it, so repeated calls with the same workspace don't allocate.
+    Kernels that are passed NULL allocate (and free) their own scratch space.
+
+    The tiled engine additionally keeps its activity state in the workspace
+    so that it persists from one call to the next. If its output array holds
+    the input of the previous call, `output_is_previous_input` should be set
+    so that only the parts that changed since then need to be copied.
+*/
+typedef struct tile_state tile_state_t;
+
+typedef struct {
+    void *data;
+    size_t size;
+    tile_state_t *tile_state;
+    int output_is_previous_input;
+} workspace_t;
+
+void *workspace_reserve(workspace_t *ws, size_t size);
+void workspace_release(workspace_t *ws);
+
+#endif
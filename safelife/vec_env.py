@@ -0,0 +1,646 @@
+"""
+Vectorized SafeLife environments.
+
+A :class:`SafeLifeVecEnv` owns many games and steps them all at once, which
+is much faster than looping over a list of :class:`SafeLifeEnv` objects
+(and their wrappers) when training with many environments in parallel.
+A :class:`SubprocSafeLifeVecEnv` further splits the environments between
+several worker processes so that stepping can use more than one core.
+"""
+
+import multiprocessing
+import pickle
+import signal
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from gym import spaces
+
+from .helper_utils import load_kwargs, AsyncStepMixin
+from .level_iterator import SafeLifeLevelIterator
+from .safelife_env import SafeLifeEnv
+from .safelife_game import VectorSafeLifeGame
+from .side_effects import side_effect_score, total_side_effect
+from .speedups import build_observations
+
+
+def _splice(array, start, stop, values):
+    # Replace array[start:stop] with values, which may have a different size.
+    if stop - start == len(values):
+        array[start:stop] = values
+        return array
+    return np.concatenate([array[:start], values, array[stop:]])
+
+
+class SafeLifeVecEnv(AsyncStepMixin):
+    """
+    Many SafeLife environments stepped together.
+
+    This behaves like a list of :class:`SafeLifeEnv` instances with the same
+    parameters, except that all of the games are stored in a single
+    :class:`VectorSafeLifeGame` and each step is done with a handful of
+    batched calls. Environments are automatically reset with a new level
+    from the level iterator as soon as all of their agents are done.
+
+    Agents in all of the environments are given a single flat index, so
+    multi-agent levels are supported: ``agent_env[i]`` is the environment
+    that agent ``i`` belongs to. For single-agent levels the agent index is
+    just the environment index. All levels must have the same board shape.
+
+    Parameters
+    ----------
+    level_iterator : iterator or str
+        See :class:`SafeLifeEnv`. Should produce :class:`SafeLifeGame`
+        instances.
+    num_envs : int
+    time_limit : int
+    remove_white_goals : bool
+    output_channels : None or tuple of ints
+    view_shape : (int, int)
+    side_effect_weights : dict[str, float] or None
+    should_calculate_side_effects : bool
+    side_effect_pool : side_effects.SideEffectPool or None
+        See :class:`SafeLifeEnv`. When using a pool, side effects that are
+        ready show up in ``infos[k]['side_effects']`` for the environment
+        that produced them, keyed by episode id.
+    physics_engine : str
+    num_threads : int
+        See :class:`VectorSafeLifeGame`.
+    logger : SafeLifeLogger or None
+        If set, steps are counted and finished episodes are logged just as
+        they would be by :class:`SafeLifeLogWrapper`, except that no episode
+        histories are recorded. With a side effect pool, episodes are logged
+        once their side effects are ready.
+
+    Attributes
+    ----------
+    games : list of SafeLifeGame
+        The current level in each environment. These are only brought up to
+        date with the vectorized game state at the end of each episode.
+    vector_game : VectorSafeLifeGame
+    agent_env : ndarray of shape (num_agents,)
+        The environment of each agent in the most recent observations.
+    """
+    num_envs = 16
+    time_limit = SafeLifeEnv.time_limit
+    remove_white_goals = SafeLifeEnv.remove_white_goals
+    view_shape = SafeLifeEnv.view_shape
+    output_channels = SafeLifeEnv.output_channels
+    side_effect_weights = SafeLifeEnv.side_effect_weights
+    should_calculate_side_effects = SafeLifeEnv.should_calculate_side_effects
+    side_effect_pool = None
+    physics_engine = VectorSafeLifeGame.physics_engine
+    num_threads = VectorSafeLifeGame.num_threads
+    logger = None
+
+    games = None
+    vector_game = None
+
+    def __init__(self, level_iterator, **kwargs):
+        if isinstance(level_iterator, str):
+            self.level_iterator = SafeLifeLevelIterator(level_iterator)
+        else:
+            self.level_iterator = level_iterator
+
+        load_kwargs(self, kwargs)
+
+        self.action_space = spaces.Discrete(9)
+        if self.output_channels is None:
+            self.observation_space = spaces.Box(
+                low=0, high=2**15,
+                shape=self.view_shape,
+                dtype=np.uint32,
+            )
+        else:
+            self.observation_space = spaces.Box(
+                low=0, high=1,
+                shape=self.view_shape + (len(self.output_channels),),
+                dtype=np.uint8,
+            )
+        self._obs = None
+        self._rewards = None
+        self._dones = None
+        self._pending_side_effects = {}
+
+    def __len__(self):
+        return self.num_envs
+
+    @property
+    def agent_env(self):
+        return self.vector_game.agent_game
+
+    def _next_game(self):
+        game = next(self.level_iterator)
+        game.revert()
+        game.update_exit_colors()
+        return game
+
+    def _get_obs(self):
+        game = self.vector_game
+        shape = (len(game.agent_locs),) + self.observation_space.shape
+        if self._obs is None or self._obs.shape != shape:
+            self._obs = np.empty(shape, dtype=self.observation_space.dtype)
+        return build_observations(
+            game.boards, game.goals, game.agent_locs, self.view_shape,
+            exit_locs=game.exit_locs, exit_offsets=game.exit_offsets,
+            board_index=game.agent_game,
+            output_channels=self.output_channels or None,
+            remove_white_goals=self.remove_white_goals, out=self._obs)
+
+    def reset(self):
+        """
+        Start new episodes in every environment.
+
+        Returns
+        -------
+        obs : ndarray of shape (num_agents, V, V, C)
+        """
+        self.games = [self._next_game() for _ in range(self.num_envs)]
+        self.vector_game = VectorSafeLifeGame(
+            self.games, physics_engine=self.physics_engine,
+            num_threads=self.num_threads)
+        num_agents = len(self.vector_game.agent_locs)
+        self._is_active = np.ones(num_agents, dtype=bool)
+        self.episode_length = np.zeros(num_agents, dtype=int)
+        self.episode_reward = np.zeros(num_agents, dtype=np.float32)
+        self._old_points = self.vector_game.current_points()
+        return self._get_obs()
+
+    def _reset_envs(self, indices):
+        game = self.vector_game
+        for k in indices:
+            new_game = self._next_game()
+            start, stop = game.agent_offsets[k:k+2]
+            game.reset(k, new_game)
+            self.games[k] = new_game
+            n = len(new_game.agent_locs)
+            self._is_active = _splice(
+                self._is_active, start, stop, np.ones(n, dtype=bool))
+            self.episode_length = _splice(
+                self.episode_length, start, stop, np.zeros(n, dtype=int))
+            self.episode_reward = _splice(
+                self.episode_reward, start, stop, np.zeros(n, dtype=np.float32))
+        self._old_points = game.current_points()
+
+    def _end_episode(self, index, success):
+        game = self.games[index]
+        start, stop = self.vector_game.agent_offsets[index:index+2]
+        info = {
+            'length': self.episode_length[start:stop].copy(),
+            'reward': self.episode_reward[start:stop].copy(),
+            'success': success[start:stop].copy(),
+        }
+        if self.should_calculate_side_effects or self.logger is not None:
+            self.vector_game.copy_to(index, game)
+        if self.should_calculate_side_effects and self.side_effect_pool is not None:
+            episode_id, future = self.side_effect_pool.submit(
+                game, self.side_effect_weights)
+            info['episode_id'] = episode_id
+            self._pending_side_effects[episode_id] = (index, game, info, future)
+            return info
+        if self.should_calculate_side_effects:
+            side_effects = side_effect_score(game, strkeys=True)
+            if self.side_effect_weights is not None:
+                side_effects['total'] = total_side_effect(
+                    side_effects, self.side_effect_weights)
+            info['side_effects'] = side_effects
+        if self.logger is not None:
+            self.logger.log_episode(game, info)
+        return info
+
+    def collect_side_effects(self, wait=False, infos=None):
+        """
+        Gather side effects that have been calculated in the background.
+
+        Finished episodes are logged as their side effects come in.
+
+        Parameters
+        ----------
+        wait : bool
+            If True, wait for all outstanding calculations to finish.
+        infos : list of dicts or None
+            If given, each result is also added to the info dict of the
+            environment it came from.
+
+        Returns
+        -------
+        dict
+            Maps episode ids to side effects.
+        """
+        side_effects = {}
+        for episode_id, pending in list(self._pending_side_effects.items()):
+            index, game, info, future = pending
+            if not (wait or future.done()):
+                continue
+            del self._pending_side_effects[episode_id]
+            effects = side_effects[episode_id] = future.result()
+            if infos is not None:
+                infos[index].setdefault('side_effects', {})[episode_id] = effects
+            if self.logger is not None:
+                self.logger.log_episode(game, dict(info, side_effects=effects))
+        return side_effects
+
+    def step(self, actions):
+        """
+        Take one step in every environment.
+
+        The returned arrays are reused, so they're overwritten by the next
+        call to :meth:`step` or :meth:`reset`.
+
+        Parameters
+        ----------
+        actions : ndarray of shape (num_agents,)
+            One action for each agent in the last observations.
+
+        Returns
+        -------
+        obs : ndarray of shape (num_agents, V, V, C)
+            Observations for the agents that act next. Environments that
+            finished on this step have already been reset, so if their new
+            levels have a different number of agents the observations won't
+            line up with the rewards. Use :attr:`agent_env` to match them up.
+        rewards : ndarray of shape (num_agents,)
+        dones : ndarray of shape (num_agents,)
+            Rewards and done flags for the agents that took the actions.
+        infos : list of dicts
+            One for each environment. Environments whose episodes finished
+            have an 'episode' entry, as in :meth:`SafeLifeEnv.step`, except
+            that its values always have one entry per agent.
+            Side effects calculated in the background are added under
+            'side_effects' once they're ready (see `side_effect_pool`).
+        """
+        assert self.vector_game is not None, "Environments are not initialized."
+        game = self.vector_game
+        num_agents = len(game.agent_locs)
+        if self._rewards is None or len(self._rewards) != num_agents:
+            self._rewards = np.zeros(num_agents, dtype=np.float32)
+            self._dones = np.zeros(num_agents, dtype=bool)
+
+        points, success, active = game.step(actions)
+
+        times_up = game.num_steps[game.agent_game] >= self.time_limit
+        rewards = np.subtract(
+            points, self._old_points, out=self._rewards, casting='same_kind')
+        rewards *= self._is_active
+        self._old_points = points
+        dones = np.logical_or(~active, times_up, out=self._dones)
+
+        self.episode_reward += rewards
+        self.episode_length += self._is_active
+        self._is_active &= ~dones
+
+        if self.logger is not None:
+            key = self.logger.episode_type + '_steps'
+            self.logger.cumulative_stats[key] += len(self)
+
+        infos = [{} for _ in range(len(self))]
+        finished = np.flatnonzero(np.bincount(
+            game.agent_game, ~dones, minlength=len(self)) == 0)
+        for k in finished:
+            infos[k]['episode'] = self._end_episode(k, success)
+        if len(finished) > 0:
+            self._reset_envs(finished)
+        if self._pending_side_effects:
+            self.collect_side_effects(infos=infos)
+
+        return self._get_obs(), rewards, dones, infos
+
+    def close(self):
+        if self._pending_side_effects:
+            self.collect_side_effects(wait=True)
+
+
+class _SharedOutputs(object):
+    """
+    Observation, reward, and done arrays for one worker in shared memory.
+
+    The arrays are stored as a ring of `num_slots` slots, each with room for
+    `capacity` agents. A worker writes each new result into the next slot, so
+    it never overwrites results that the parent may still be reading.
+    """
+    num_slots = 2
+
+    def __init__(self, capacity, obs_shape, obs_dtype, name=None):
+        obs_dtype = np.dtype(obs_dtype)
+        obs_size = capacity * int(np.prod(obs_shape)) * obs_dtype.itemsize
+        # Keep each array 8-byte aligned.
+        obs_size = -(-obs_size // 8) * 8
+        rewards_size = -(-capacity * 4 // 8) * 8
+        slot_size = obs_size + rewards_size + -(-capacity // 8) * 8
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=max(1, slot_size * self.num_slots))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.capacity = capacity
+        self.slots = []
+        for k in range(self.num_slots):
+            offset = k * slot_size
+            self.slots.append((
+                np.ndarray(
+                    (capacity,) + tuple(obs_shape), obs_dtype,
+                    buffer=self.shm.buf, offset=offset),
+                np.ndarray(
+                    capacity, np.float32,
+                    buffer=self.shm.buf, offset=offset + obs_size),
+                np.ndarray(
+                    capacity, bool,
+                    buffer=self.shm.buf, offset=offset + obs_size + rewards_size),
+            ))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self, unlink=False):
+        self.slots = []  # views must be released before closing
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _shared_array(shape, dtype, name=None):
+    # Numpy array backed by shared memory. Returns (shm, array).
+    size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    if name is None:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype, buffer=shm.buf)
+
+
+def _subproc_worker(conn, level_iterator, seed, num_envs, env_kwargs):
+    # Ignore keyboard interrupts; the parent process takes care of them.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    level_iterator = pickle.loads(level_iterator)
+    if getattr(level_iterator, 'num_workers', 0) > 0:
+        # Worker processes can't start their own pools.
+        level_iterator.num_workers = 0
+        level_iterator.max_queue = 1
+    if hasattr(level_iterator, 'seed'):
+        level_iterator.seed(seed)
+    env = SafeLifeVecEnv(level_iterator, num_envs=num_envs, **env_kwargs)
+    obs_space = env.observation_space
+    outputs = None
+    actions = None
+    actions_shm = None
+    slot = 0
+    num_agents = 0
+    try:
+        while True:
+            cmd, *args = conn.recv()
+            if cmd == 'close':
+                break
+            elif cmd == 'reset':
+                obs = env.reset()
+                rewards = dones = ()
+                infos = None
+            elif cmd == 'step':
+                actions_name, start = args
+                if actions_shm is None or actions_shm.name != actions_name:
+                    actions = None
+                    if actions_shm is not None:
+                        actions_shm.close()
+                    actions_shm = shared_memory.SharedMemory(name=actions_name)
+                    actions = np.ndarray(
+                        actions_shm.size // 8, np.int64, buffer=actions_shm.buf)
+                obs, rewards, dones, infos = env.step(
+                    actions[start:start+num_agents])
+            num_agents = len(obs)
+            needed = max(len(obs), len(rewards))
+            if outputs is None or outputs.capacity < needed:
+                # Ask the parent for a bigger block.
+                conn.send(('grow', needed))
+                name, capacity = conn.recv()
+                if outputs is not None:
+                    outputs.close()
+                outputs = _SharedOutputs(
+                    capacity, obs_space.shape, obs_space.dtype, name)
+            slot = (slot + 1) % outputs.num_slots
+            out_obs, out_rewards, out_dones = outputs.slots[slot]
+            out_obs[:len(obs)] = obs
+            out_rewards[:len(rewards)] = rewards
+            out_dones[:len(dones)] = dones
+            conn.send(('done', slot, env.agent_env.copy(), infos))
+    except Exception as err:
+        conn.send(('error', "%s\n%s" % (err, traceback.format_exc())))
+    finally:
+        actions = None
+        if actions_shm is not None:
+            actions_shm.close()
+        if outputs is not None:
+            outputs.close()
+        conn.close()
+
+
+class SubprocSafeLifeVecEnv(AsyncStepMixin):
+    """
+    Vectorized environments that are stepped in several worker processes.
+
+    The environments are split between the workers, each of which runs a
+    :class:`SafeLifeVecEnv`. On each step the actions for every agent are
+    written to a single shared memory array and all of the workers are told
+    to step at once. The observations, rewards, and done flags come back
+    through shared memory as well, so only small messages (and any episode
+    info) go through the pipes. Otherwise this behaves exactly like a
+    :class:`SafeLifeVecEnv` with the same number of environments.
+
+    Parameters
+    ----------
+    level_iterator : iterator or str
+        Each worker gets its own copy of the level iterator. If it has a
+        `seed` method it's reseeded so that the workers don't all produce
+        the same levels, and any level generation pool is replaced by
+        generating levels within the worker itself.
+    num_envs : int
+    num_workers : int
+        Defaults to the number of CPUs, but never more than `num_envs`.
+    seed : int or numpy.random.SeedSequence or None
+        Used to seed the level iterators of the workers.
+    **kwargs
+        Any other parameters of :class:`SafeLifeVecEnv`, except `logger`
+        and `side_effect_pool`. Side effects are calculated in the workers.
+
+    Attributes
+    ----------
+    agent_env : ndarray of shape (num_agents,)
+        The environment of each agent in the most recent observations.
+    """
+    def __init__(
+            self, level_iterator, num_envs=16, num_workers=None, seed=None,
+            **kwargs):
+        if isinstance(level_iterator, str):
+            level_iterator = SafeLifeLevelIterator(level_iterator)
+        if 'logger' in kwargs:
+            raise ValueError("Loggers can't be shared between processes.")
+        if 'side_effect_pool' in kwargs:
+            raise ValueError(
+                "Side effect pools can't be shared between processes.")
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        num_workers = max(1, min(num_workers, num_envs))
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+
+        # Use a throwaway env to check the parameters and get the spaces.
+        env = SafeLifeVecEnv(level_iterator, **kwargs)
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+
+        self.num_envs = num_envs
+        sizes = [len(x) for x in np.array_split(np.arange(num_envs), num_workers)]
+        self._env_offsets = np.cumsum([0] + sizes)
+        self._outputs = [None] * num_workers
+        self._actions_shm = None
+        self._actions = None
+        self._agent_envs = [np.zeros(0, dtype=np.int64)] * num_workers
+        self._obs = None
+        self._rewards = None
+        self._dones = None
+        self.agent_env = None
+        self._stepping = False
+
+        # Pickle the iterator up front so that any levels that it's still
+        # generating are finished here rather than in the workers.
+        level_iterator = pickle.dumps(level_iterator)
+        # The workers need to share our resource tracker. Otherwise each
+        # one starts its own, which unlinks our shared memory when it exits.
+        resource_tracker.ensure_running()
+        self._conns = []
+        self._processes = []
+        self.closed = False
+        for size, worker_seed in zip(sizes, seed.spawn(num_workers)):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_subproc_worker, daemon=True, args=(
+                    child_conn, level_iterator, worker_seed, size, kwargs))
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+    def __len__(self):
+        return self.num_envs
+
+    def _receive(self, worker):
+        # Get a worker's results, giving it more room for them if needed.
+        conn = self._conns[worker]
+        while True:
+            msg, *args = conn.recv()
+            if msg == 'error':
+                raise RuntimeError("SafeLife worker failed: " + args[0])
+            elif msg == 'grow':
+                old = self._outputs[worker]
+                capacity = max(args[0], 2 * old.capacity if old else 0)
+                new = _SharedOutputs(
+                    capacity, self.observation_space.shape,
+                    self.observation_space.dtype)
+                conn.send((new.name, capacity))
+                self._outputs[worker] = new
+                if old is not None:
+                    old.close(unlink=True)
+            else:
+                return args
+
+    def _gather(self, reset=False):
+        obs = []
+        rewards = []
+        dones = []
+        agent_envs = []
+        infos = []
+        for k in range(len(self._conns)):
+            slot, agent_env, worker_infos = self._receive(k)
+            out_obs, out_rewards, out_dones = self._outputs[k].slots[slot]
+            num_prev = len(self._agent_envs[k])
+            obs.append(out_obs[:len(agent_env)])
+            rewards.append(out_rewards[:num_prev])
+            dones.append(out_dones[:num_prev])
+            agent_envs.append(agent_env + self._env_offsets[k])
+            self._agent_envs[k] = agent_env
+            if worker_infos is not None:
+                infos += worker_infos
+        self.agent_env = np.concatenate(agent_envs)
+        num_agents = len(self.agent_env)
+        if self._obs is None or len(self._obs) != num_agents:
+            self._obs = np.empty(
+                (num_agents,) + self.observation_space.shape,
+                dtype=self.observation_space.dtype)
+        np.concatenate(obs, out=self._obs)
+        if reset:
+            return self._obs
+        num_prev = sum(len(x) for x in rewards)
+        if self._rewards is None or len(self._rewards) != num_prev:
+            self._rewards = np.empty(num_prev, dtype=np.float32)
+            self._dones = np.empty(num_prev, dtype=bool)
+        np.concatenate(rewards, out=self._rewards)
+        np.concatenate(dones, out=self._dones)
+        return self._obs, self._rewards, self._dones, infos
+
+    def reset(self):
+        """See :meth:`SafeLifeVecEnv.reset`."""
+        for conn in self._conns:
+            conn.send(('reset',))
+        for k in range(len(self._conns)):
+            self._agent_envs[k] = np.zeros(0, dtype=np.int64)
+        return self._gather(reset=True)
+
+    def step(self, actions):
+        """See :meth:`SafeLifeVecEnv.step`."""
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions):
+        """
+        Send the actions to the workers without waiting for the results.
+
+        The workers step in parallel with the caller until :meth:`step_wait`
+        is called.
+        """
+        assert self.agent_env is not None, "Environments are not initialized."
+        if self._stepping:
+            raise RuntimeError("Must call step_wait() before stepping again.")
+        num_agents = len(self.agent_env)
+        if self._actions is None or len(self._actions) < num_agents:
+            self._actions = None
+            if self._actions_shm is not None:
+                self._actions_shm.close()
+                self._actions_shm.unlink()
+            self._actions_shm, self._actions = _shared_array(
+                max(num_agents, 2 * self.num_envs), np.int64)
+        self._actions[:num_agents] = actions
+        start = 0
+        for conn, agent_env in zip(self._conns, self._agent_envs):
+            conn.send(('step', self._actions_shm.name, start))
+            start += len(agent_env)
+        self._stepping = True
+
+    def step_wait(self):
+        """Wait for and return the results of :meth:`step_async`."""
+        if not self._stepping:
+            raise RuntimeError("Must call step_async() before step_wait().")
+        self._stepping = False
+        return self._gather()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for conn in self._conns:
+            try:
+                conn.send(('close',))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self._processes:
+            process.join()
+        for outputs in self._outputs:
+            if outputs is not None:
+                outputs.close(unlink=True)
+        self._actions = None
+        if self._actions_shm is not None:
+            self._actions_shm.close()
+            self._actions_shm.unlink()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
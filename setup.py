@@ -55,7 +55,10 @@ setuptools.setup(
                 '-Wno-shorten-64-to-32',
                 '-Wno-c++11-extensions',
                 '-Wvla',
-            ] if platform.system() != 'Windows' else []
+            ] if platform.system() != 'Windows' else [],
+            extra_link_args=[
+                '-pthread',
+            ] if platform.system() != 'Windows' else [],
         ),
     ],
     entry_points={
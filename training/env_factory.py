@@ -16,6 +16,7 @@ from safelife.level_iterator import SafeLifeLevelIterator
 from safelife.random import coinflip
 
 from safelife.render_graphics import render_file
+from safelife.replay import EpisodeReplay
 from safelife.safelife_env import SafeLifeEnv
 from safelife.safelife_game import CellTypes
 from safelife.safelife_logger import SafeLifeLogWrapper
@@ -148,7 +149,11 @@ class CurricularLevelIterator(SafeLifeLevelIterator):
     def record_video(self, lvl, perf):
         filename = "best_score-{}-{}.npz".format(lvl, perf)
         path = os.path.join(self.logger.logdir, filename)
-        np.savez_compressed(path, **self.logger.last_history)
+        history = self.logger.last_history
+        if isinstance(history, EpisodeReplay):
+            history.save(path)
+        else:
+            np.savez_compressed(path, **history)
         render_file(path, movie_format="mp4")
 
 